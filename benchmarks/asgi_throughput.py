@@ -0,0 +1,116 @@
+""" Compares the WSGI and ASGI throughput of an I/O bound operation
+
+Both apps serve one operation which waits `--latency` seconds, like a Redis or SQL
+round trip: `time.sleep` for WSGI, `asyncio.sleep` for ASGI. The WSGI app is driven by
+`--threads` worker threads, like a threaded WSGI server, and the ASGI app by one event
+loop. Each one serves `--requests` requests from `--connections` concurrent clients.
+
+    python benchmarks/asgi_throughput.py [--requests N] [--connections C] [--threads T]
+"""
+
+from falconopenapi.asgi import SwaggerAsgiAPI
+from falconopenapi.swagger_api import SwaggerAPI
+from falconopenapi.models.http import ModelHttpMeta
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from wsgiref.util import setup_testing_defaults
+import argparse
+import asyncio
+
+
+LATENCY = 0.01
+
+
+class _ModelMeta(ModelHttpMeta):
+    __schema__ = {
+        '/io': {
+            'get': {
+                'operationId': 'get_io',
+                'responses': {'200': {'description': 'I/O bound operation'}}
+            }
+        }
+    }
+
+    def get_io(cls, req, resp):
+        sleep(LATENCY)
+        resp.body = '{}'
+
+
+class _AsyncModelMeta(_ModelMeta):
+
+    async def get_io(cls, req, resp):
+        await asyncio.sleep(LATENCY)
+        resp.body = '{}'
+
+
+class Model(metaclass=_ModelMeta):
+    pass
+
+
+class AsyncModel(metaclass=_AsyncModelMeta):
+    pass
+
+
+def run_wsgi(requests, connections, threads):
+    app = SwaggerAPI([Model], title='Benchmark API')
+
+    def request(_):
+        environ = {'PATH_INFO': '/io', 'REQUEST_METHOD': 'GET'}
+        setup_testing_defaults(environ)
+        b''.join(app(environ, lambda status, headers, exc_info=None: None))
+
+    start = perf_counter()
+    with ThreadPoolExecutor(min(threads, connections)) as executor:
+        list(executor.map(request, range(requests)))
+
+    return requests / (perf_counter() - start)
+
+
+def run_asgi(requests, connections):
+    app = SwaggerAsgiAPI([AsyncModel], title='Benchmark API')
+    scope = {'type': 'http', 'method': 'GET', 'path': '/io', 'query_string': b'', 'headers': []}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        pass
+
+    async def client(count):
+        for _ in range(count):
+            await app(scope, receive, send)
+
+    async def run():
+        counts = [requests // connections + (i < requests % connections)
+                  for i in range(connections)]
+        await asyncio.gather(*[client(count) for count in counts])
+
+    loop = asyncio.new_event_loop()
+    start = perf_counter()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    return requests / (perf_counter() - start)
+
+
+def main():
+    global LATENCY
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=LATENCY)
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    wsgi = run_wsgi(args.requests, args.connections, args.threads)
+    asgi = run_asgi(args.requests, args.connections)
+    print('wsgi ({} threads): {:.0f} requests/s'.format(args.threads, wsgi))
+    print('asgi ({} connections): {:.0f} requests/s'.format(args.connections, asgi))
+
+
+if __name__ == '__main__':
+    main()
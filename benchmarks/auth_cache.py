@@ -0,0 +1,96 @@
+""" Measures the authorization cost per request of the `SharedCachingAuthorizer`
+
+Authorizes `--tokens` distinct credentials in three states:
+
+- warm: the results are in the in-process near cache;
+- cold: a fresh worker, the results are only in Redis;
+- invalidated: after `invalidate()`, every request calls the wrapped authorizer, which
+  waits `--authorize-ms` like a SQL or Redis lookup.
+
+It uses a fakeredis server unless `--redis-url` is given.
+
+    python benchmarks/auth_cache.py [--tokens N] [--authorize-ms MS] [--redis-url URL]
+"""
+
+from falconopenapi.hooks import Authorizer, SharedCachingAuthorizer
+from falconopenapi.pubsub import InvalidationChannel
+from time import perf_counter, sleep
+import argparse
+
+
+class _Authorizer(Authorizer):
+
+    def __init__(self, latency):
+        Authorizer.__init__(self, 'benchmark')
+        self.latency = latency
+
+    def authorize(self, session, authorization, uri_template, path, method):
+        sleep(self.latency)
+        return authorization
+
+
+class _Session(object):
+    __slots__ = ['redis_bind', 'user']
+
+    def __init__(self, redis_bind):
+        self.redis_bind = redis_bind
+        self.user = None
+
+
+def _build_redis_bind(redis_url):
+    if redis_url is None:
+        from fakeredis import FakeStrictRedis
+        redis_bind = FakeStrictRedis()
+        redis_bind.flushall()
+        return redis_bind
+
+    from redis import StrictRedis
+    return StrictRedis.from_url(redis_url)
+
+
+def _authorize_all(authorizer, session, tokens):
+    start = perf_counter()
+    for token in tokens:
+        authorizer.authorize(session, token, '/model/{id}', '/model/1', 'GET')
+
+    return (perf_counter() - start) / len(tokens)
+
+
+def run(tokens_count, latency, redis_url):
+    redis_bind = _build_redis_bind(redis_url)
+    session = _Session(redis_bind)
+    tokens = ['token{}'.format(i) for i in range(tokens_count)]
+
+    def build_worker():
+        return SharedCachingAuthorizer(
+            _Authorizer(latency), InvalidationChannel(redis_bind), maxsize=tokens_count)
+
+    worker = build_worker()
+    worker.invalidate()
+    _authorize_all(worker, session, tokens)
+    results = [('warm', _authorize_all(worker, session, tokens))]
+
+    cold_worker = build_worker()
+    results.append(('cold', _authorize_all(cold_worker, session, tokens)))
+
+    worker.invalidate()
+    results.append(('invalidated', _authorize_all(worker, session, tokens)))
+
+    worker.channel.close()
+    cold_worker.channel.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=1000)
+    parser.add_argument('--authorize-ms', type=float, default=1.0)
+    parser.add_argument('--redis-url')
+    args = parser.parse_args()
+
+    for state, seconds in run(args.tokens, args.authorize_ms / 1000, args.redis_url):
+        print('{:<12} {:>10.2f} us/request'.format(state, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+""" Measures the per request overhead of the route metrics
+
+Runs the `MetricsMiddleware` hooks against lightweight request and response objects and
+prints the mean cost per request. Exits with status 1 when it is above the budget.
+
+    python benchmarks/metrics_overhead.py [--requests N] [--budget-us US]
+"""
+
+from falconopenapi.metrics import RouteMetrics
+from falconopenapi.middlewares import MetricsMiddleware
+from time import perf_counter
+import argparse
+import sys
+
+
+class _Request(object):
+    __slots__ = ['uri_template', 'method', 'context']
+
+    def __init__(self, uri_template, method):
+        self.uri_template = uri_template
+        self.method = method
+        self.context = dict()
+
+
+class _Response(object):
+    __slots__ = ['status']
+
+    def __init__(self, status):
+        self.status = status
+
+
+def run(requests):
+    middleware = MetricsMiddleware(RouteMetrics())
+    routes = [('/model{}/{{id}}'.format(i), method, status)
+              for i in range(10) for method in ('GET', 'POST') for status in ('200 OK', '404 Not Found')]
+    pairs = [(_Request(uri_template, method), _Response(status))
+             for uri_template, method, status in routes]
+    process_request = middleware.process_request
+    process_response = middleware.process_response
+
+    start = perf_counter()
+    for i in range(requests):
+        req, resp = pairs[i % len(pairs)]
+        process_request(req, resp)
+        process_response(req, resp, None, True)
+    elapsed = perf_counter() - start
+
+    # loop and indexing cost, without the middleware
+    start = perf_counter()
+    for i in range(requests):
+        req, resp = pairs[i % len(pairs)]
+    baseline = perf_counter() - start
+
+    return (elapsed - baseline) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000000)
+    parser.add_argument('--budget-us', type=float, default=2.0)
+    args = parser.parse_args()
+
+    overhead_us = run(args.requests) * 1e6
+    print('metrics overhead: {:.3f} us/request (budget {:.3f} us)'.format(
+        overhead_us, args.budget_us))
+    return 0 if overhead_us <= args.budget_us else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
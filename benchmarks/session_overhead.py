@@ -0,0 +1,63 @@
+""" Measures the session allocation and teardown per request
+
+Compares, for `--requests` requests on an in-memory SQLite bind:
+
+- eager: a new `Session` built and closed per request, as before the sessions were pooled;
+- pooled: the `SessionMiddleware`, reusing the thread session, which each request reads;
+- unused: the `SessionMiddleware` on requests which never read their session.
+
+    python benchmarks/session_overhead.py [--requests N]
+"""
+
+from falconopenapi.middlewares import SessionMiddleware, RequestContext
+from falconopenapi.models.orm.session import Session
+from sqlalchemy import create_engine
+from time import perf_counter
+import argparse
+
+
+class _Request(object):
+    __slots__ = ['context', 'method']
+
+    def __init__(self):
+        self.context = RequestContext()
+        self.method = 'GET'
+
+
+def run_eager(requests, bind):
+    start = perf_counter()
+    for _ in range(requests):
+        session = Session(bind=bind, redis_bind=None)
+        session.close()
+
+    return (perf_counter() - start) / requests
+
+
+def run_middleware(requests, bind, read_session):
+    middleware = SessionMiddleware(bind)
+
+    start = perf_counter()
+    for _ in range(requests):
+        req = _Request()
+        middleware.process_resource(req, None, None, {})
+        if read_session:
+            req.context['session']
+        middleware.process_response(req, None, None)
+
+    return (perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    args = parser.parse_args()
+    bind = create_engine('sqlite://')
+
+    for name, seconds in (('eager', run_eager(args.requests, bind)),
+                          ('pooled', run_middleware(args.requests, bind, True)),
+                          ('unused', run_middleware(args.requests, bind, False))):
+        print('{:<8} {:>8.2f} us/request'.format(name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
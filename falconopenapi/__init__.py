@@ -1,34 +1,280 @@
 import json
 import yaml
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 from pathlib import Path
+from falconopenapi.exceptions import OpenApiError
+from falconopenapi.utils import OPERATION_METHODS, iter_operations
+
+
+DefinitionDiff = namedtuple('DefinitionDiff', ['added', 'removed', 'changed'])
+
+
+class LazyMapping(Mapping):
+    """ Read-only mapping which materializes its entries on first access
+
+    The raw entries are kept as read from the definition file and handed over to
+    `loader(key, raw_value)` the first time a key is requested. The loaded value is cached.
+    """
+    __slots__ = ['_raw', '_loader', '_loaded']
+
+    def __init__(self, raw, loader):
+        self._raw = raw
+        self._loader = loader
+        self._loaded = dict()
+
+    def __getitem__(self, key):
+        try:
+            return self._loaded[key]
+        except KeyError:
+            pass
+
+        value = self._loader(key, self._raw[key])
+        self._loaded[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __contains__(self, key):
+        return key in self._raw
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, list(self._raw))
 
 
 class OpenApiDefinition(object):
     """ Data class for storing OpenApi definition
 
+    With `lazy=True` the `paths` and `components` are exposed as `LazyMapping` objects which
+    resolve each entry only when it is accessed. `tags` and `paths` restrict the definition to the
+    operations a service actually serves; components not referenced by them are dropped.
 
+    The `operations` index maps each operationId to its `Operation` (path, method, merged
+    parameters, security and tags). It is built once at load time from every path item, resolving
+    their references also in lazy mode: `lazy` defers the `paths` and `components` entries, not
+    the index.
     """
-    __slots__ = ['openapi', 'info', 'servers', 'paths', 'components', 'security', 'tags', 'externalDocs']
+    _fields = ('openapi', 'info', 'servers', 'paths', 'components', 'security', 'tags', 'externalDocs')
+    __slots__ = list(_fields) + ['_document', '_operations', '_definition_file', '_options']
+
+    def __init__(self, definition_file: str, lazy: bool=False, tags=None, paths=None):
+        self._definition_file = definition_file
+        self._options = {'lazy': lazy, 'tags': tags, 'paths': paths}
 
-    def __init__(self, definition_file: str):
         # Initialize the slots to an empty dict
-        for slot in type(self).__slots__:
+        for slot in type(self)._fields:
             if slot == 'openapi':
                 setattr(self, slot, str())
             else:
                 setattr(self, slot, dict())
 
         definition = self._read_definitions_file(definition_file)
-        for slot in type(self).__slots__:
+        self._document = definition
+
+        if tags is not None or paths is not None:
+            self._restrict(definition, tags, paths)
+
+        for slot in type(self)._fields:
             if slot not in definition:
                 continue
             setattr(self, slot, definition[slot])
 
+        if lazy:
+            self.paths = LazyMapping(self.paths, self._load_path_item)
+            self.components = LazyMapping(self.components, self._load_components_section)
+        else:
+            # the path items references are resolved, as the lazy paths resolve them
+            self.paths = {path: self._resolve_reference(path_item)
+                          for path, path_item in self.paths.items()}
+            self._document = None
+
+        self._operations = self._build_operations_index(definition)
+
+    @property
+    def operations(self):
+        return self._operations
+
+    def _build_operations_index(self, document):
+        # built from the raw path items, so the lazy paths are not loaded
+        raw_paths = self.paths._raw if isinstance(self.paths, LazyMapping) else self.paths
+        paths = OrderedDict([(path, self._resolve_reference(path_item, document))
+                             for path, path_item in raw_paths.items()])
+        operations = OrderedDict()
+
+        for operation in iter_operations(paths, self.security or None):
+            if operation.operation_id is None:
+                raise OpenApiError("Element operationId was not found for path: '{}' method: '{}'"
+                                   .format(operation.path, operation.method.lower()))
+
+            if operation.operation_id in operations:
+                duplicated = operations[operation.operation_id]
+                raise OpenApiError("Duplicated operationId '{}' for '{} {}' and '{} {}'".format(
+                    operation.operation_id, duplicated.method, duplicated.path,
+                    operation.method, operation.path))
+
+            operations[operation.operation_id] = operation
+
+        return operations
+
+    def reload(self):
+        """ Re-reads the definition file and swaps the new contents in
+
+        Returns a `DefinitionDiff` with the (path, method) pairs which were added, removed or
+        changed. An operation is changed when its own definition or any component it
+        references, directly or not, has changed.
+        """
+        definition = type(self)(self._definition_file, **self._options)
+        operations = {(op.path, op.method): op for op in self._operations.values()}
+        new_operations = {(op.path, op.method): op for op in definition.operations.values()}
+        changed_components = self._get_changed_components(definition)
+        new_components = definition._get_raw_components()
+        changed = set()
+
+        for key in set(operations).intersection(new_operations):
+            operation = new_operations[key]
+            if operation != operations[key] or (changed_components and \
+                    changed_components.intersection(
+                        self._collect_references(operation.schema, new_components))):
+                changed.add(key)
+
+        for slot in type(self).__slots__:
+            setattr(self, slot, getattr(definition, slot))
+
+        return DefinitionDiff(
+            set(new_operations).difference(operations),
+            set(operations).difference(new_operations),
+            changed)
+
+    def _get_raw_components(self):
+        if isinstance(self.components, LazyMapping):
+            return self.components._raw
+        return self.components
+
+    def _get_changed_components(self, definition):
+        components = self._get_raw_components()
+        new_components = definition._get_raw_components()
+        changed = set()
+
+        for section in set(components).union(new_components):
+            entries = components.get(section, {})
+            new_entries = new_components.get(section, {})
+            for name in set(entries).union(new_entries):
+                if entries.get(name) != new_entries.get(name):
+                    changed.add((section, name))
+
+        return changed
+
     def __getitem__(self, item):
-        if item not in type(self).__slots__:
+        if item not in type(self)._fields:
             raise KeyError(item)
         return getattr(self, item)
 
+    def _load_path_item(self, path, path_item):
+        return self._resolve_reference(path_item)
+
+    def _load_components_section(self, section, entries):
+        return LazyMapping(entries, lambda name, entry: self._resolve_reference(entry))
+
+    def _resolve_reference(self, value, document=None):
+        if document is None:
+            document = self._document
+
+        seen = set()
+        while isinstance(value, dict) and '$ref' in value:
+            ref = value['$ref']
+            if not ref.startswith('#/') or ref in seen:
+                break
+            seen.add(ref)
+            value = self._resolve_pointer(document, ref)
+
+        return value
+
+    @staticmethod
+    def _resolve_pointer(document, ref):
+        value = document
+        for token in ref[2:].split('/'):
+            value = value[token.replace('~1', '/').replace('~0', '~')]
+        return value
+
+    def _restrict(self, definition, tags, paths):
+        tags = None if tags is None else set(tags)
+        paths = None if paths is None else set(paths)
+        selected = dict()
+
+        for path, path_item in definition.get('paths', {}).items():
+            if paths is not None and path not in paths:
+                continue
+
+            path_item = self._resolve_pointer(definition, path_item['$ref']) \
+                if '$ref' in path_item else path_item
+
+            if tags is not None:
+                path_item = self._filter_operations_by_tags(path_item, tags)
+                if path_item is None:
+                    continue
+
+            selected[path] = path_item
+
+        definition['paths'] = selected
+
+        if 'components' in definition:
+            definition['components'] = self._reachable_components(definition)
+
+    @staticmethod
+    def _filter_operations_by_tags(path_item, tags):
+        filtered = dict()
+        has_operation = False
+
+        for key, value in path_item.items():
+            if key in OPERATION_METHODS:
+                if not tags.intersection(value.get('tags', [])):
+                    continue
+                has_operation = True
+
+            filtered[key] = value
+
+        return filtered if has_operation else None
+
+    def _reachable_components(self, definition):
+        components = definition['components']
+        reachable = dict()
+
+        for section, name in self._collect_references(definition['paths'], components):
+            reachable.setdefault(section, dict())[name] = components[section][name]
+
+        # security schemes are referenced by name, not by '$ref'
+        if 'securitySchemes' in components:
+            reachable['securitySchemes'] = components['securitySchemes']
+
+        return reachable
+
+    @staticmethod
+    def _collect_references(value, components):
+        references = set()
+        pending = [value]
+
+        while pending:
+            value = pending.pop()
+            if isinstance(value, dict):
+                ref = value.get('$ref')
+                if isinstance(ref, str) and ref.startswith('#/components/'):
+                    section, _, name = ref[len('#/components/'):].partition('/')
+                    name = name.replace('~1', '/').replace('~0', '~')
+                    if (section, name) not in references and name in components.get(section, {}):
+                        references.add((section, name))
+                        pending.append(components[section][name])
+
+                pending.extend(value.values())
+
+            elif isinstance(value, list):
+                pending.extend(value)
+
+        return references
+
     @staticmethod
     def _read_definitions_file(definition_file):
         f = Path(definition_file)
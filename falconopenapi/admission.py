@@ -0,0 +1,270 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.exceptions import ServiceUnavailableError
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+import asyncio
+import json
+
+
+def _wake_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ConcurrencyLimiter(object):
+    """ Bounds the requests in flight to `limit`
+
+    When the limit is reached up to `max_queue` requests wait for a slot, each one for at
+    most `timeout` seconds; the others are rejected straight away. Requests arriving while
+    others are waiting join the queue, so the waiting ones are served first.
+    `acquire_async` waits on the event loop instead of blocking the thread; both kinds of
+    waiters share the same slots and queue.
+    """
+
+    def __init__(self, limit, max_queue=0, timeout=0.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.accepted_count = 0
+        self.queued_count = 0
+        self.rejected_count = 0
+        self._condition = Condition()
+        self._async_waiters = deque()
+
+    def acquire(self):
+        with self._condition:
+            if self.in_flight < self.limit and not self.waiting:
+                self.in_flight += 1
+                self.accepted_count += 1
+                return True
+
+            if self.waiting >= self.max_queue or self.timeout <= 0:
+                self.rejected_count += 1
+                return False
+
+            self.waiting += 1
+            self.queued_count += 1
+            deadline = monotonic() + self.timeout
+
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.rejected_count += 1
+                        return False
+
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            self.accepted_count += 1
+            return True
+
+    async def acquire_async(self):
+        with self._condition:
+            if self.in_flight < self.limit and not self.waiting:
+                self.in_flight += 1
+                self.accepted_count += 1
+                return True
+
+            if self.waiting >= self.max_queue or self.timeout <= 0:
+                self.rejected_count += 1
+                return False
+
+            self.waiting += 1
+            self.queued_count += 1
+
+        loop = asyncio.get_event_loop()
+        deadline = monotonic() + self.timeout
+        waiter = None
+
+        try:
+            while True:
+                with self._condition:
+                    if waiter is not None:
+                        self._remove_async_waiter(waiter)
+                        waiter = None
+
+                    if self.in_flight < self.limit:
+                        self.in_flight += 1
+                        self.accepted_count += 1
+                        return True
+
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.rejected_count += 1
+                        return False
+
+                    waiter = (loop, loop.create_future())
+                    self._async_waiters.append(waiter)
+
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter[1]), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._condition:
+                self.waiting -= 1
+                # cancelled while waiting, a wake up already sent is handed over
+                if waiter is not None and not self._remove_async_waiter(waiter) \
+                        and self.in_flight < self.limit:
+                    self._wake_async_waiter()
+
+    def _remove_async_waiter(self, waiter):
+        try:
+            self._async_waiters.remove(waiter)
+        except ValueError:
+            return False
+        return True
+
+    def _wake_async_waiter(self):
+        if self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            loop.call_soon_threadsafe(_wake_waiter, future)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+            self._wake_async_waiter()
+
+    def get_stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'accepted': self.accepted_count,
+            'queued': self.queued_count,
+            'rejected': self.rejected_count
+        }
+
+
+class AdmissionController(object):
+    """ Admits the requests through a global and per route concurrency limits
+
+    The route limits come from `routes_max_concurrency`, keyed by 'METHOD uri_template', or
+    from the 'x-max-concurrency' operation extension. Rejected requests raise a
+    `ServiceUnavailableError` with a body serialized once.
+    """
+
+    def __init__(self, max_concurrency=None, routes_max_concurrency=None,
+                 max_queue=0, timeout=0.0, retry_after=1):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.global_limiter = None if max_concurrency is None else \
+            ConcurrencyLimiter(max_concurrency, max_queue, timeout)
+        self._routes_max_concurrency = dict(routes_max_concurrency or {})
+        self._routes_limiters = dict()
+        self._exempted_routes = set()
+        self._lock = Lock()
+        self._body = json.dumps({'error': 'Service unavailable, please retry later'})
+
+    def exempt(self, route):
+        self._exempted_routes.add(self._build_route_key(route))
+
+    def discard(self, route):
+        """ Drops the route limiter, so it is rebuilt from the route schema on the next request """
+        with self._lock:
+            self._routes_limiters.pop(self._build_route_key(route), None)
+
+    def admit(self, route):
+        route_limiters = self._get_limiters(route)
+        if route_limiters is None:
+            return ()
+
+        limiters = []
+        for limiter in route_limiters:
+            if not limiter.acquire():
+                self._reject(limiters)
+
+            limiters.append(limiter)
+
+        return limiters
+
+    async def admit_async(self, route):
+        """ Same as `admit`, waiting for the queued slots on the event loop """
+        route_limiters = self._get_limiters(route)
+        if route_limiters is None:
+            return ()
+
+        limiters = []
+        for limiter in route_limiters:
+            if not await limiter.acquire_async():
+                self._reject(limiters)
+
+            limiters.append(limiter)
+
+        return limiters
+
+    def _get_limiters(self, route):
+        key = self._build_route_key(route)
+        if key in self._exempted_routes:
+            return None
+
+        route_limiter = self._routes_limiters.get(key)
+        if route_limiter is None and key not in self._routes_limiters:
+            route_limiter = self._set_route_limiter(key, route)
+
+        return [limiter for limiter in (self.global_limiter, route_limiter)
+                if limiter is not None]
+
+    def _reject(self, limiters):
+        self.release(limiters)
+        raise ServiceUnavailableError('Service unavailable', self.retry_after, self._body)
+
+    def release(self, limiters):
+        for limiter in limiters:
+            limiter.release()
+
+    def _set_route_limiter(self, key, route):
+        with self._lock:
+            if key in self._routes_limiters:
+                return self._routes_limiters[key]
+
+            limit = self._routes_max_concurrency.get(
+                key, route.extensions.get('x-max-concurrency'))
+            limiter = None if limit is None else \
+                ConcurrencyLimiter(limit, self.max_queue, self.timeout)
+            self._routes_limiters[key] = limiter
+            return limiter
+
+    def _build_route_key(self, route):
+        return '{} {}'.format(route.method_name, route.uri_template)
+
+    def get_stats(self):
+        stats = {}
+        if self.global_limiter is not None:
+            stats['global'] = self.global_limiter.get_stats()
+
+        for key, limiter in list(self._routes_limiters.items()):
+            if limiter is not None:
+                stats[key] = limiter.get_stats()
+
+        return stats
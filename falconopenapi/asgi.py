@@ -0,0 +1,253 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.swagger_api import SwaggerAPI
+from falconopenapi.middlewares import SessionMiddleware
+from falcon import HTTP_204, HTTP_304, HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import asyncio
+import sys
+
+
+_ROUTE_ENV_KEY = 'falconopenapi.route'
+
+def build_environ(scope, body):
+    """ Builds a WSGI environ from an ASGI http scope and the request body """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').lower()
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+
+        value = value.decode('latin-1')
+        if key in environ:
+            value = '{},{}'.format(environ[key], value)
+
+        environ[key] = value
+
+    return environ
+
+
+async def _read_body(receive):
+    chunks = []
+    more_body = True
+
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+
+    return b''.join(chunks)
+
+
+class SwaggerAsgiAPI(SwaggerAPI):
+    """ ASGI application serving the same models and routes as `SwaggerAPI`
+
+    Routes whose operation (or authorizer) is a coroutine function are run on the event
+    loop with `Route.call_async`. The other requests are run by the WSGI pipeline on a
+    thread pool bounded by `executor_workers`. `async_redis_bind` is exposed to the
+    operations as `session.async_redis_bind`.
+    """
+
+    def __init__(self, models, sqlalchemy_bind=None, redis_bind=None,
+                 async_redis_bind=None, executor_workers=None, **kwargs):
+        self._async_redis_bind = async_redis_bind
+        self._executor = ThreadPoolExecutor(executor_workers)
+        SwaggerAPI.__init__(self, models, sqlalchemy_bind, redis_bind, **kwargs)
+
+    def _build_session_middleware(self, sqlalchemy_bind, redis_bind, redis_write_behind=None,
+                                  redis_chunk_size=500, related_batch_size=500,
+                                  related_max_depth=None):
+        return SessionMiddleware(sqlalchemy_bind, redis_bind, self._async_redis_bind,
+                                 redis_write_behind=redis_write_behind,
+                                 redis_chunk_size=redis_chunk_size,
+                                 related_batch_size=related_batch_size,
+                                 related_max_depth=related_max_depth)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            raise NotImplementedError("Unsupported ASGI scope type '{}'".format(scope['type']))
+
+        environ = build_environ(scope, await _read_body(receive))
+        req = self._request_type(environ, options=self.req_options)
+
+        try:
+            route, params = self._router.get_route_and_params(req)
+        except HTTPError:
+            # routed again and handled by the WSGI pipeline
+            route = None
+        else:
+            if route is not None:
+                environ[_ROUTE_ENV_KEY] = (route, params)
+
+        if route is not None and route.is_async:
+            status, headers, body = await self._call_async(req, environ)
+        else:
+            loop = asyncio.get_event_loop()
+            status, headers, body = await loop.run_in_executor(
+                self._executor, self._call_wsgi, environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status[:3]),
+            'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=True)
+                if self.redis_write_behind is not None:
+                    self.redis_write_behind.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _get_responder(self, req):
+        # the requests are routed once, when choosing how to run them
+        routed = req.env.get(_ROUTE_ENV_KEY)
+        if routed is None:
+            return SwaggerAPI._get_responder(self, req)
+
+        route, params = routed
+        req.context['route'] = route
+        return route, params, route.module, route.uri_template
+
+    def _call_wsgi(self, environ):
+        start_response_args = []
+
+        def start_response(status, headers, exc_info=None):
+            start_response_args[:] = [status, headers]
+
+        chunks = SwaggerAPI.__call__(self, environ, start_response)
+        try:
+            body = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+        status, headers = start_response_args
+        return status, headers, body
+
+    async def _call_async(self, req, environ):
+        # mirrors falcon.API.__call__, awaiting the responder
+        resp = self._response_type(options=self.resp_options)
+        resource = None
+        params = {}
+        dependent_mw_resp_stack = []
+        mw_req_stack, mw_rsrc_stack, mw_resp_stack = self._middleware
+        req_succeeded = False
+        req.context['route'] = environ[_ROUTE_ENV_KEY][0]
+
+        try:
+            try:
+                if self._independent_middleware:
+                    for process_request in mw_req_stack:
+                        process_request(req, resp)
+                else:
+                    for process_request, process_response in mw_req_stack:
+                        if process_request:
+                            process_request(req, resp)
+                        if process_response:
+                            dependent_mw_resp_stack.insert(0, process_response)
+
+                route, params, resource, req.uri_template = self._get_responder(req)
+            except Exception as ex:
+                if not self._handle_exception(ex, req, resp, params):
+                    raise
+            else:
+                try:
+                    if resource is not None:
+                        if self.admission is not None and route is req.context.get('route'):
+                            req.context['admission_limiters'] = \
+                                await self.admission.admit_async(route)
+
+                        for process_resource in mw_rsrc_stack:
+                            process_resource(req, resp, resource, params)
+
+                    if getattr(route, 'is_async', False):
+                        await route.call_async(req, resp, **params)
+                    else:
+                        route(req, resp, **params)
+
+                    req_succeeded = True
+                except Exception as ex:
+                    if not self._handle_exception(ex, req, resp, params):
+                        raise
+        finally:
+            for process_response in mw_resp_stack or dependent_mw_resp_stack:
+                try:
+                    process_response(req, resp, resource, req_succeeded)
+                except Exception as ex:
+                    if not self._handle_exception(ex, req, resp, params):
+                        raise
+
+                    req_succeeded = False
+
+        if req.method == 'HEAD' or resp.status in self._BODILESS_STATUS_CODES:
+            body = b''
+        else:
+            body, _ = self._get_body(resp, environ.get('wsgi.file_wrapper'))
+            body = b''.join(body)
+            resp._headers['content-length'] = str(len(body))
+
+        media_type = None if resp.status in (HTTP_204, HTTP_304) else self._media_type
+        return resp.status, resp._wsgi_headers(media_type), body
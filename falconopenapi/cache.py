@@ -0,0 +1,266 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic, time
+import msgpack
+
+
+class LRUCache(object):
+    """ Thread safe mapping bounded to `maxsize` entries, evicting the least recently used
+
+    Each entry may have its own TTL in seconds; expired entries are dropped when read.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = None if ttl is None else monotonic() + ttl
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def discard_keys(self, match):
+        """ Drops the entries whose key satisfies `match(key)`, returns how many were dropped """
+        with self._lock:
+            keys = [key for key in self._entries if match(key)]
+            for key in keys:
+                del self._entries[key]
+
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class NearCache(object):
+    """ In-process cache, set as a model `__near_cache__`, of the objects read from Redis
+
+    Entries are keyed by (model redis key, instance redis key) and hold the packed and the
+    decoded object for `ttl` seconds at most. The decoded objects are shared by the requests
+    and must not be changed. The sessions invalidate the instances they write to Redis;
+    with `channel` (an `InvalidationChannel`) the invalidations reach every process. A fill
+    read while an invalidation happened is not stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, channel=None):
+        self.ttl = ttl
+        self.channel = channel
+        self.topic = None
+        self.generation = 0
+        self._entries = LRUCache(maxsize)
+        self._subscribed = False
+        self._lock = Lock()
+
+    def bind(self, topic):
+        self.topic = topic
+
+    def get_many(self, keys):
+        if self.channel is not None and not self._subscribed:
+            self._subscribed = True
+            self.channel.subscribe(self.topic, self._on_invalidation)
+
+        return [self._entries.get(key) for key in keys]
+
+    def set_many(self, entries, generation):
+        if generation != self.generation:
+            return
+
+        for key, value in entries:
+            self._entries.set(key, value, self.ttl)
+
+    def invalidate(self, keys=None):
+        """ Drops the entries of the instances redis `keys`, or every entry when None """
+        self._discard(keys)
+
+        if self.channel is not None:
+            self.channel.publish(
+                self.topic, None if keys is None else [key.decode() for key in keys])
+
+    def _on_invalidation(self, keys):
+        self._discard(None if keys is None else [key.encode() for key in keys])
+
+    def _discard(self, keys):
+        with self._lock:
+            self.generation += 1
+
+        if keys is None:
+            self._entries.clear()
+        else:
+            keys = set(keys)
+            self._entries.discard_keys(lambda key: key[1] in keys)
+
+    def get_stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self._entries.hits,
+            'misses': self._entries.misses
+        }
+
+
+class ResponseCache(object):
+    """ Two tiers cache of (status, headers, body) responses grouped by tag
+
+    Invalidating a tag increments its generation, which is part of the keys, so the old
+    entries are never read again and age out. A response computed while its tag was
+    invalidated is not stored.
+
+    With the Redis tier the generation of a tag is a Redis counter, shared by every
+    process: it is read on each lookup and is part of the hash keys, so an invalidation
+    reaches the local entries of all the processes. Without Redis the generations are per
+    process, unless `channel` (an `InvalidationChannel`) broadcasts the invalidations.
+    """
+
+    def __init__(self, maxsize=1024, redis_prefix='falconopenapi_response_cache', channel=None):
+        self.redis_prefix = redis_prefix
+        self.channel = channel
+        self.topic = redis_prefix
+        self._entries = LRUCache(maxsize)
+        self._generations = dict()
+        self._redis_tags = set()
+        self._subscribed = False
+        self._lock = Lock()
+
+    def register_tag(self, tag, redis=False):
+        with self._lock:
+            self._generations.setdefault(tag, 0)
+            if redis:
+                self._redis_tags.add(tag)
+
+    def is_registered(self, tag):
+        return tag in self._generations
+
+    def get_generation(self, tag):
+        return self._generations.get(tag, 0)
+
+    def get(self, tag, key, redis_bind=None):
+        if self.channel is not None and not self._subscribed:
+            self._subscribed = True
+            self.channel.subscribe(self.topic, self._on_invalidation)
+
+        if redis_bind is None:
+            generation = self._generations.get(tag, 0)
+        else:
+            generation = self._get_shared_generation(tag, redis_bind)
+
+        response = self._entries.get((tag, generation, key))
+
+        if response is None and redis_bind is not None:
+            packed = redis_bind.hget(self._build_redis_key(tag, generation), key)
+            if packed is not None:
+                expires_at, status, headers, body = msgpack.loads(packed, encoding='utf-8')
+                ttl = expires_at - time()
+                if ttl > 0:
+                    response = (status, [tuple(header) for header in headers], body)
+                    self._entries.set((tag, generation, key), response, ttl)
+
+        return response
+
+    def set(self, tag, key, response, ttl, generation, redis_bind=None):
+        if generation != self._generations.get(tag, 0):
+            return
+
+        self._entries.set((tag, generation, key), response, ttl)
+
+        if redis_bind is not None:
+            status, headers, body = response
+            redis_key = self._build_redis_key(tag, generation)
+            packed = msgpack.dumps((time() + ttl, status, headers, body), use_bin_type=True)
+            pipeline = redis_bind.pipeline(transaction=False)
+            pipeline.hset(redis_key, key, packed)
+            pipeline.expire(redis_key, int(ttl) + 1)
+            pipeline.execute()
+
+    def invalidate(self, tag, redis_bind=None):
+        self._bump_generation(tag)
+
+        if redis_bind is not None and tag in self._redis_tags:
+            self._set_generation(tag, redis_bind.incr(self._build_generation_key(tag)))
+
+        if self.channel is not None:
+            self.channel.publish(self.topic, tag)
+
+    def _on_invalidation(self, tag):
+        if tag is None:
+            for tag in list(self._generations):
+                self._bump_generation(tag)
+        else:
+            self._bump_generation(tag)
+
+    def _bump_generation(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def _get_shared_generation(self, tag, redis_bind):
+        generation = int(redis_bind.get(self._build_generation_key(tag)) or 0)
+        if generation != self._generations.get(tag, 0):
+            self._set_generation(tag, generation)
+
+        return generation
+
+    def _set_generation(self, tag, generation):
+        with self._lock:
+            self._generations[tag] = generation
+
+    def _build_generation_key(self, tag):
+        return '{}:{}:generation'.format(self.redis_prefix, tag)
+
+    def _build_redis_key(self, tag, generation):
+        return '{}:{}:{}'.format(self.redis_prefix, tag, generation)
+
+
+RESPONSE_CACHE = ResponseCache()
@@ -21,7 +21,8 @@
 # SOFTWARE.
 
 
-from falcon import HTTP_UNAUTHORIZED, HTTP_BAD_REQUEST
+from falcon import HTTP_UNAUTHORIZED, HTTP_BAD_REQUEST, HTTP_SERVICE_UNAVAILABLE, \
+    HTTP_TOO_MANY_REQUESTS
 
 import json
 
@@ -74,6 +75,25 @@ class UnauthorizedError(FalconSwaggerError):
         FalconSwaggerError.__init__(self, message, status, headers)
 
 
+class ServiceUnavailableError(FalconSwaggerError):
+    def __init__(self, message, retry_after, body=None):
+        FalconSwaggerError.__init__(
+            self, message, HTTP_SERVICE_UNAVAILABLE, {'Retry-After': str(retry_after)})
+        self.body = json.dumps(self.to_json()) if body is None else body
+
+    @staticmethod
+    def handle(exception, req, resp, params):
+        resp.status = exception.status
+        resp.body = exception.body
+        [resp.set_header(key, value) for key, value in exception.headers.items()]
+
+
+class TooManyRequestsError(FalconSwaggerError):
+    def __init__(self, message, retry_after):
+        FalconSwaggerError.__init__(
+            self, message, HTTP_TOO_MANY_REQUESTS, {'Retry-After': str(retry_after)})
+
+
 class SwaggerAPIError(Exception):
     pass
 
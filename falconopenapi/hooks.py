@@ -22,11 +22,46 @@
 
 
 from falconopenapi.exceptions import UnauthorizedError
-from falcon import HTTP_FORBIDDEN, HTTP_METHODS
+from falconopenapi.cache import LRUCache
+from falcon import HTTP_FORBIDDEN
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Mapper
+from sqlalchemy.orm.attributes import instance_state
+from collections import namedtuple
 from types import MethodType
+from inspect import iscoroutinefunction
+from hashlib import sha1
+from time import time
+import asyncio
+import msgpack
 
 
 def authorization_hook(authorizer, req, resp, params):
+    authorization = _get_authorization(authorizer, req)
+    session = req.context['session']
+    authorization = authorizer.authorize(
+        session, authorization, req.uri_template, req.path, req.method)
+    _check_authorization(authorizer, authorization)
+    return authorization
+
+
+async def async_authorization_hook(authorizer, req, resp, params):
+    authorization = _get_authorization(authorizer, req)
+    session = req.context['session']
+    args = (session, authorization, req.uri_template, req.path, req.method)
+
+    if iscoroutinefunction(authorizer.authorize):
+        authorization = await authorizer.authorize(*args)
+    else:
+        # the sync authorizers may query the database, they are run on the executor
+        authorization = await asyncio.get_event_loop().run_in_executor(
+            None, authorizer.authorize, *args)
+
+    _check_authorization(authorizer, authorization)
+    return authorization
+
+
+def _get_authorization(authorizer, req):
     authorization = req.auth
     if authorization is None:
         raise UnauthorizedError('Authorization header is required', authorizer.realm)
@@ -35,10 +70,10 @@ def authorization_hook(authorizer, req, resp, params):
     if authorization.startswith(basic_str):
         authorization = authorization.replace(basic_str, '')
 
-    session = req.context['session']
-    authorization = authorizer.authorize(
-        session, authorization, req.uri_template, req.path, req.method)
+    return authorization
+
 
+def _check_authorization(authorizer, authorization):
     if authorization is None:
         raise UnauthorizedError('Invalid authorization', authorizer.realm)
 
@@ -47,42 +82,85 @@ def authorization_hook(authorizer, req, resp, params):
             'Please refresh your authorization', authorizer.realm, HTTP_FORBIDDEN)
 
 
+def get_authorization_identity(authorizer, session, credentials, authorization):
+    """ Returns `authorizer.get_identity(...)`, or the default identity for authorizers
+    not deriving from `Authorizer` """
+    get_identity = getattr(authorizer, 'get_identity', None)
+    if get_identity is None:
+        return _build_identity(credentials, authorization)
+
+    return get_identity(session, credentials, authorization)
+
+
+def _build_identity(credentials, authorization):
+    if isinstance(authorization, (str, int)) and not isinstance(authorization, bool):
+        return str(authorization)
+
+    return sha1(credentials.encode()).hexdigest()
+
+
+SKIP_OPERATION = object()
+
+
 def before_operation(func):
-    def _wrap_class_method(cls, method_name):
-        method = getattr(cls, method_name, None)
-        if method:
-            setattr(cls, method_name, _before_operation(method))
+    """ Registers `func(req, resp, cls, params)` to run before the operation
 
-    def _before_operation(func_):
-        cls = None
-        is_cls = False
-        if isinstance(func_, type):
-            is_cls = True
-            cls = func_
-        elif isinstance(func_, MethodType):
-            cls = func_.__self__
+    Applied to a model class it runs before all the class operations, applied to an
+    operation method only before it. The routes compile their hooks into one call sequence:
+    the class hooks, then the method hooks, the outermost decorator first. A hook returning
+    `SKIP_OPERATION` skips the remaining before hooks and the operation. Coroutine hooks
+    are awaited when the route is served by the ASGI app.
+    """
+    return _build_hook_decorator('before', func)
 
-        def do_before(req, resp, **params):
-            func(req, resp, cls, params)
-            func_(req, resp, **params)
 
-        if is_cls:
-            methods = set()
-            for path in cls.__schema__.values():
-                for method_name, method in path.items():
-                    if method_name.upper() in HTTP_METHODS:
-                        op_name = method.get('operationId')
-                        if op_name:
-                            methods.add(op_name)
+def after_operation(func):
+    """ Registers `func(req, resp, cls, params)` to run after the operation
 
-            for method in methods:
-                _wrap_class_method(cls, method)
+    The method hooks run first, then the class hooks, the innermost decorator first.
+    """
+    return _build_hook_decorator('after', func)
 
-            return cls
 
-        return do_before
+def _build_hook_decorator(stage, func):
+    def decorator(target):
+        if isinstance(target, type):
+            hooks = target.__dict__.get('__hooks__')
+            if hooks is None:
+                inherited = getattr(target, '__hooks__', None) or {}
+                hooks = {name: list(inherited.get(name, [])) for name in ('before', 'after')}
+                target.__hooks__ = hooks
 
-    return _before_operation
+            _add_hook(hooks, stage, func)
+            _compile_routes_hooks(target)
+            return target
+
+        # bound methods, classmethods and staticmethods keep the hooks on their function
+        function = getattr(target, '__func__', target)
+        hooks = function.__dict__.get('__hooks__')
+        if hooks is None:
+            hooks = function.__hooks__ = {'before': [], 'after': []}
+
+        _add_hook(hooks, stage, func)
+
+        if isinstance(target, MethodType):
+            _compile_routes_hooks(target.__self__)
+
+        return target
+
+    return decorator
+
+
+def _add_hook(hooks, stage, func):
+    if stage == 'before':
+        hooks[stage].insert(0, func)
+    else:
+        hooks[stage].append(func)
+
+
+def _compile_routes_hooks(cls):
+    for route in getattr(cls, '__routes__', ()):
+        route.compile_hooks()
 
 
 class Authorizer(object):
@@ -92,3 +170,227 @@ class Authorizer(object):
 
     def authorize(self, session, authorization, uri_template, path, method):
         pass
+
+    def get_identity(self, session, credentials, authorization):
+        """ Returns the key the rate limits are counted by
+
+        `authorization` is the value returned by `authorize`; when it is an account
+        identifier (a string or an integer) the requests are counted by account, otherwise
+        (eg. True or an object) by credentials. Override it to count by other identities,
+        which must be stable across requests and processes.
+        """
+        return _build_identity(credentials, authorization)
+
+
+_OrmUser = namedtuple('_OrmUser', ['instance'])
+
+
+def _build_user_entry(user):
+    # the ORM users are bound to a session and a thread, they are merged into the hit sessions
+    if not isinstance(getattr(type(user), '__mapper__', None), Mapper):
+        return user
+
+    return None if instance_state(user).identity is None else _OrmUser(user)
+
+
+def _merge_user(session, user):
+    try:
+        return session.merge(user, load=False)
+    except InvalidRequestError:
+        # changed and not flushed by the request which loaded it
+        return session.query(type(user)).get(instance_state(user).identity)
+
+
+class CachingAuthorizer(Authorizer):
+    """ Caches the results of `authorizer.authorize` by (credentials, uri_template, method)
+
+    The concrete path is not part of the key, so the wrapped authorizer must not depend on
+    it: a result for /users/1 is reused for /users/2. Pass `per_resource=True` to add the
+    path to the key for authorizers deciding per resource.
+
+    Valid authorizations are kept for `ttl` seconds and invalid ones (None) for
+    `negative_ttl` seconds. A False result (credentials to refresh) is not cached and drops
+    every entry of the credentials. The `session.user` set by the authorizer is cached along
+    with the result and set again on hits; ORM users are merged into the hit session
+    without querying the database. Call `invalidate` on logout or when permissions change; results
+    computed while an invalidation happens are not stored.
+    """
+
+    def __init__(self, authorizer, maxsize=1024, ttl=60, negative_ttl=5, per_resource=False):
+        Authorizer.__init__(self, authorizer.realm)
+        self.authorizer = authorizer
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.per_resource = per_resource
+        self.cache = LRUCache(maxsize)
+        self._generation = 0
+
+        if iscoroutinefunction(authorizer.authorize):
+            self.authorize = self._authorize_async
+
+    def authorize(self, session, authorization, uri_template, path, method):
+        key = self._build_key(authorization, uri_template, path, method)
+        entry = self._get(session, key)
+        if entry is not None:
+            return self._restore(session, entry)
+
+        generation = self._generation
+        result = self.authorizer.authorize(session, authorization, uri_template, path, method)
+        self._store(session, key, result, generation)
+        return result
+
+    async def _authorize_async(self, session, authorization, uri_template, path, method):
+        key = self._build_key(authorization, uri_template, path, method)
+        entry = await self._run_storage(self._get, session, key)
+        if entry is not None:
+            return self._restore(session, entry)
+
+        generation = self._generation
+        result = await self.authorizer.authorize(
+            session, authorization, uri_template, path, method)
+        await self._run_storage(self._store, session, key, result, generation)
+        return result
+
+    async def _run_storage(self, func, *args):
+        return func(*args)
+
+    def _build_key(self, authorization, uri_template, path, method):
+        if self.per_resource:
+            return (authorization, uri_template, method, path)
+
+        return (authorization, uri_template, method)
+
+    def _get(self, session, key):
+        return self.cache.get(key)
+
+    def _restore(self, session, entry):
+        result, user = entry
+        if isinstance(user, _OrmUser):
+            session.user = _merge_user(session, user.instance)
+
+        elif user is not None:
+            session.user = user
+
+        return result
+
+    def _store(self, session, key, result, generation):
+        if result is False:
+            self._evict(key[0])
+
+        elif generation != self._generation:
+            return
+
+        elif result is None:
+            self._set(session, key, (None, None), self.negative_ttl)
+
+        else:
+            user = _build_user_entry(getattr(session, 'user', None))
+            self._set(session, key, (result, user), self.ttl)
+
+    def _set(self, session, key, entry, ttl):
+        self.cache.set(key, entry, ttl)
+
+    def invalidate(self, authorization=None):
+        """ Drops the cached results of the `authorization` credentials, or all of them """
+        credentials_key = None if authorization is None else \
+            self._build_key(authorization, None, None, None)[0]
+        self._evict(credentials_key)
+
+    def _evict(self, credentials_key):
+        self._discard(credentials_key)
+
+    def _discard(self, credentials_key):
+        self._generation += 1
+
+        if credentials_key is None:
+            self.cache.clear()
+        else:
+            self.cache.discard_keys(lambda key: key[0] == credentials_key)
+
+    def get_identity(self, session, credentials, authorization):
+        return get_authorization_identity(self.authorizer, session, credentials, authorization)
+
+
+class SharedCachingAuthorizer(CachingAuthorizer):
+    """ `CachingAuthorizer` sharing its results between processes through Redis
+
+    The results are stored in the session `redis_bind`, one hash per credentials (by sha1)
+    expiring `ttl` seconds after its last write, and read through the in-process cache,
+    which keeps them at most `near_ttl` seconds. The invalidations delete the hashes and are
+    broadcast on the `InvalidationChannel`, evicting the in-process entries of every worker.
+
+    The shared results must be serializable with msgpack. The `session.user` is not shared:
+    a result read from Redis for which the authorizer had set a user is authorized again by
+    the wrapped authorizer, which sets the user and the in-process entry.
+    """
+
+    def __init__(self, authorizer, channel, maxsize=1024, ttl=60, negative_ttl=5,
+                 near_ttl=10, redis_prefix='falconopenapi_authorization', per_resource=False):
+        CachingAuthorizer.__init__(self, authorizer, maxsize, ttl, negative_ttl, per_resource)
+        self.channel = channel
+        self.near_ttl = near_ttl
+        self.redis_prefix = redis_prefix
+        self._subscribed = False
+
+    def _build_key(self, authorization, uri_template, path, method):
+        key = CachingAuthorizer._build_key(self, authorization, uri_template, path, method)
+        return (sha1(authorization.encode()).hexdigest(),) + key[1:]
+
+    def _run_storage(self, func, *args):
+        # the Redis calls are blocking, the async authorizations run them on the executor
+        return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _get(self, session, key):
+        if not self._subscribed:
+            self._subscribed = True
+            self.channel.subscribe(self.redis_prefix, self._discard)
+
+        entry = self.cache.get(key)
+        redis_bind = getattr(session, 'redis_bind', None)
+        if entry is not None or redis_bind is None:
+            return entry
+
+        packed = redis_bind.hget(self._build_redis_key(key[0]), self._build_redis_field(key))
+        if packed is None:
+            return None
+
+        expires_at, result, has_user = msgpack.loads(packed, encoding='utf-8')
+        ttl = expires_at - time()
+        if ttl <= 0 or has_user:
+            return None
+
+        entry = (result, None)
+        self.cache.set(key, entry, min(ttl, self.near_ttl))
+        return entry
+
+    def _set(self, session, key, entry, ttl):
+        self.cache.set(key, entry, min(ttl, self.near_ttl))
+
+        redis_bind = getattr(session, 'redis_bind', None)
+        if redis_bind is not None:
+            redis_key = self._build_redis_key(key[0])
+            pipeline = redis_bind.pipeline(transaction=False)
+            pipeline.hset(redis_key, self._build_redis_field(key),
+                          msgpack.dumps((time() + ttl, entry[0], entry[1] is not None),
+                                        use_bin_type=True))
+            pipeline.expire(redis_key, int(self.ttl) + 1)
+            pipeline.execute()
+
+    def _evict(self, credentials_key):
+        self._discard(credentials_key)
+        redis_bind = self.channel.redis_bind
+
+        if credentials_key is None:
+            keys = list(redis_bind.scan_iter('{}:*'.format(self.redis_prefix)))
+            if keys:
+                redis_bind.delete(*keys)
+        else:
+            redis_bind.delete(self._build_redis_key(credentials_key))
+
+        self.channel.publish(self.redis_prefix, credentials_key)
+
+    def _build_redis_key(self, credentials_key):
+        return '{}:{}'.format(self.redis_prefix, credentials_key)
+
+    def _build_redis_field(self, key):
+        return ' '.join((key[2], key[1]) + key[3:])
@@ -0,0 +1,130 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from bisect import bisect_left
+from threading import Lock, local
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_float(value):
+    return repr(float(value))
+
+
+class RouteMetrics(object):
+    """ Per (uri_template, method, status) request counters and latency histograms
+
+    Each thread accumulates into its own series dict, so `record` takes no lock; the lock
+    is only taken the first time a thread records. The exporter merges the series of all
+    the threads, which makes the values eventually consistent while a scrape is running.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, namespace='falconopenapi'):
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._local = local()
+        self._threads_series = []
+        self._lock = Lock()
+
+    def _get_series(self):
+        try:
+            return self._local.series
+        except AttributeError:
+            series = dict()
+            with self._lock:
+                self._threads_series.append(series)
+            self._local.series = series
+            return series
+
+    def record(self, uri_template, method, status, seconds):
+        try:
+            series = self._local.series
+        except AttributeError:
+            series = self._get_series()
+
+        key = (uri_template, method, status)
+        values = series.get(key)
+        if values is None:
+            # one counter per bucket, plus the '+Inf' bucket and the sum of the latencies
+            values = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        values[bisect_left(self.buckets, seconds)] += 1
+        values[-1] += seconds
+
+    def get_series(self):
+        with self._lock:
+            threads_series = list(self._threads_series)
+
+        merged = dict()
+        for series in threads_series:
+            for key, values in list(series.items()):
+                merged_values = merged.get(key)
+                if merged_values is None:
+                    merged[key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        merged_values[i] += value
+
+        return merged
+
+    def reset(self):
+        with self._lock:
+            for series in self._threads_series:
+                series.clear()
+
+    def get_prometheus_text(self):
+        requests_name = '{}_requests_total'.format(self.namespace)
+        duration_name = '{}_request_duration_seconds'.format(self.namespace)
+        buckets_labels = [_format_float(bucket) for bucket in self.buckets] + ['+Inf']
+        series = sorted(self.get_series().items())
+        requests_lines = [
+            '# HELP {} Total number of requests.'.format(requests_name),
+            '# TYPE {} counter'.format(requests_name)
+        ]
+        duration_lines = [
+            '# HELP {} Requests latency in seconds.'.format(duration_name),
+            '# TYPE {} histogram'.format(duration_name)
+        ]
+
+        for (uri_template, method, status), values in series:
+            labels = 'uri_template="{}",method="{}",status="{}"'.format(
+                _escape_label_value(uri_template), method, status)
+            count = 0
+
+            for bucket_label, bucket_count in zip(buckets_labels, values):
+                count += bucket_count
+                duration_lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    duration_name, labels, bucket_label, count))
+
+            duration_lines.append('{}_sum{{{}}} {}'.format(
+                duration_name, labels, _format_float(values[-1])))
+            duration_lines.append('{}_count{{{}}} {}'.format(duration_name, labels, count))
+            requests_lines.append('{}{{{}}} {}'.format(requests_name, labels, count))
+
+        return '\n'.join(requests_lines + duration_lines) + '\n'
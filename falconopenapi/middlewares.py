@@ -21,26 +21,218 @@
 # SOFTWARE.
 
 
+from falconopenapi.models.orm.replicas import build_replicas
 from falconopenapi.models.orm.session import Session
 from falconopenapi.models.orm.sqlalchemy_redis import ModelSQLAlchemyRedisMeta
+from falconopenapi.timing import RequestTimer, NULL_TIMER
+from time import perf_counter
+from random import random
+from threading import local
+import logging
+import json
+
+
+_READ_METHODS = frozenset(['GET', 'HEAD'])
+
+
+class RequestContext(dict):
+    """ `req.context` mapping whose lazy entries are built by their factory on the first read """
+    __slots__ = ['_factories']
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._factories = None
+
+    def set_lazy(self, key, factory):
+        if self._factories is None:
+            self._factories = dict()
+
+        self._factories[key] = factory
+        dict.pop(self, key, None)
+
+    def __missing__(self, key):
+        if self._factories is None or key not in self._factories:
+            raise KeyError(key)
+
+        value = self[key] = self._factories.pop(key)()
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or \
+            (self._factories is not None and key in self._factories)
 
 
 class SessionMiddleware(object):
+    """ Sets the request session, built the first time `req.context['session']` is read
+
+    The routes which do not need a session (see `Route.needs_session`) get none. Closed
+    sessions are kept for reuse by the next requests of the same thread, up to
+    `max_idle_sessions` per thread. With `redis_write_behind` (a `RedisWriteBehind`) the
+    sessions commits queue their Redis writes instead of sending them. `redis_chunk_size`,
+    `related_batch_size` and `related_max_depth` are passed to the sessions (see `Session`).
 
-    def __init__(self, sqlalchemy_bind=None, redis_bind=None):
+    With `replica_binds` the queries of GET and HEAD requests go to a replica, chosen by
+    `replica_strategy` ('round_robin', 'least_latency' or a class built from the binds),
+    until the session writes (see `Session.get_bind`).
+    """
+
+    def __init__(self, sqlalchemy_bind=None, redis_bind=None, async_redis_bind=None,
+                 max_idle_sessions=1, redis_write_behind=None, replica_binds=None,
+                 replica_strategy='round_robin', redis_chunk_size=500,
+                 related_batch_size=500, related_max_depth=None):
         self.sqlalchemy_bind = sqlalchemy_bind
         self.redis_bind = redis_bind
+        self.redis_write_behind = redis_write_behind
+        self.redis_chunk_size = redis_chunk_size
+        self.related_batch_size = related_batch_size
+        self.related_max_depth = related_max_depth
+        self.replicas = build_replicas(replica_binds, replica_strategy)
+        self.async_redis_bind = async_redis_bind
+        self.max_idle_sessions = max_idle_sessions
+        self.created_count = 0
+        self._local = local()
 
     def process_resource(self, req, resp, model, uri_params):
         if getattr(model, '__session__', None):
             req.context['session'] = model.__session__
             return
 
-        req.context['session'] = Session(bind=self.sqlalchemy_bind, redis_bind=self.redis_bind)
+        route = req.context.get('route')
+        if route is not None and not route.needs_session:
+            return
+
+        timer = req.context.get('timer', NULL_TIMER)
+        use_replicas = req.method in _READ_METHODS
+        if isinstance(req.context, RequestContext):
+            req.context.set_lazy('session', lambda: self._acquire_session(timer, use_replicas))
+        else:
+            req.context['session'] = self._acquire_session(timer, use_replicas)
 
     def process_response(self, req, resp, model):
         session = req.context.pop('session', None)
         if session is not None \
                 and hasattr(session, 'close') \
                 and not getattr(model, '__session__', None):
-            session.close()
+            self._release_session(session)
+
+    def _acquire_session(self, timer, use_replicas=False):
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions:
+            session = sessions.pop()
+        else:
+            session = Session(bind=self.sqlalchemy_bind, redis_bind=self.redis_bind,
+                              redis_write_behind=self.redis_write_behind,
+                              redis_chunk_size=self.redis_chunk_size,
+                              related_batch_size=self.related_batch_size,
+                              related_max_depth=self.related_max_depth,
+                              replicas=self.replicas)
+            session.async_redis_bind = self.async_redis_bind
+            self.created_count += 1
+
+        session.timer = timer
+        session.use_replicas = use_replicas
+        return session
+
+    def _release_session(self, session):
+        session.close()
+
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = []
+
+        if len(sessions) < self.max_idle_sessions:
+            sessions.append(session)
+
+
+class MetricsMiddleware(object):
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def process_request(self, req, resp):
+        req.context['metrics_start'] = perf_counter()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        start = req.context.get('metrics_start')
+        if start is not None:
+            self.metrics.record(req.uri_template or '', req.method,
+                                resp.status[:3], perf_counter() - start)
+
+
+class TimingMiddleware(object):
+
+    def __init__(self, sample_rate=1.0, log=False):
+        self.sample_rate = sample_rate
+        self.log = log
+        self._logger = logging.getLogger('falconopenapi.timing')
+
+    def process_request(self, req, resp):
+        if self.sample_rate >= 1.0 or random() < self.sample_rate:
+            req.context['timer'] = RequestTimer()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        timer = req.context.get('timer')
+        if timer is None:
+            return
+
+        total = timer.get_total()
+        resp.set_header('Server-Timing', timer.get_server_timing(total))
+
+        if self.log:
+            self._logger.info(json.dumps({
+                'uri_template': req.uri_template,
+                'method': req.method,
+                'status': resp.status[:3],
+                'total_ms': round(total * 1000, 3),
+                'phases_ms': {name: round(seconds * 1000, 3)
+                              for name, seconds in timer.phases.items()},
+                'counters': timer.counters
+            }, sort_keys=True))
+
+
+class ProfilerMiddleware(object):
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def process_request(self, req, resp):
+        # the coroutines share the event loop thread, their stacks can't be told apart
+        route = req.context.get('route')
+        if route is not None and route.is_async:
+            return
+
+        capture = self.profiler.start()
+        if capture is not None:
+            req.context['profile_capture'] = capture
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        capture = req.context.pop('profile_capture', None)
+        if capture is not None:
+            route = req.context.get('route')
+            operation_name = None if route is None else '{}.{}'.format(
+                getattr(route.module, '__name__', type(route.module).__name__),
+                route.operation_name)
+            self.profiler.stop(capture, req.uri_template, req.method, operation_name)
+
+
+class AdmissionMiddleware(object):
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def process_resource(self, req, resp, resource, params):
+        # the ASGI async routes are admitted by the application, without blocking the loop
+        route = req.context.get('route')
+        if route is not None and 'admission_limiters' not in req.context:
+            req.context['admission_limiters'] = self.controller.admit(route)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        limiters = req.context.pop('admission_limiters', None)
+        if limiters:
+            self.controller.release(limiters)
@@ -25,13 +25,13 @@ from falconopenapi.router import Route
 from falconopenapi.exceptions import ModelBaseError, JSONError
 from falconopenapi.models.logger import ModelLoggerMetaMixin
 from falconopenapi.constants import SWAGGER_VALIDATOR
-from falconopenapi.utils import get_dir_path, get_module_path, build_validator
+from falconopenapi.profiling import STARTUP_PROFILER
+from falconopenapi.utils import get_dir_path, get_module_path, build_validator, iter_operations
 from falcon.errors import HTTPNotFound, HTTPMethodNotAllowed
-from falcon import HTTP_CREATED, HTTP_NO_CONTENT, HTTP_METHODS
+from falcon import HTTP_CREATED, HTTP_NO_CONTENT
 from falcon.responders import create_default_options
 from jsonschema import ValidationError
 from collections import defaultdict
-from copy import deepcopy
 from concurrent.futures import ThreadPoolExecutor
 import json
 import os.path
@@ -52,60 +52,131 @@ class ModelHttpMetaMixin(type):
         cls.__key__ = getattr(cls, '__key__', _camel_case_convert(name))
 
     def _set_routes(cls):
-        SWAGGER_VALIDATOR.validate(cls.__schema__)
-        cls.__routes__ = set()
-        cls.__options_routes__ = set()
-        dict_ = defaultdict(list)
-        schema = cls.__schema__
-        cls._set_key()
-
-        if not hasattr(cls, '__schema_dir__'):
-            cls.__schema_dir__ = get_module_path(cls)
-
-        for uri_template in schema:
-            all_methods_parameters = schema[uri_template].get('parameters', [])
-            for method_name in HTTP_METHODS:
-                method_schema = schema[uri_template].get(method_name.lower())
-                if method_schema:
-                    method_schema = deepcopy(method_schema)
-                    operation_id = method_schema['operationId']
-
-                    try:
-                        getattr(cls, operation_id)
-                    except AttributeError:
-                        raise ModelBaseError("'operationId' '{}' was not found".format(operation_id))
-
-                    definitions = schema.get('definitions')
-
-                    parameters = method_schema.get('parameters', [])
-                    parameters.extend(all_methods_parameters)
-                    method_schema['parameters'] = parameters
-
-                    route = Route(uri_template, method_name, operation_id, cls,
-                                  method_schema, definitions, cls.__authorizer__)
-                    cls.__routes__.add(route)
-
-        routes = defaultdict(set)
-        for route in cls.__routes__:
-            routes[route.uri_template].add(route.method_name)
-
-        for uri_template, methods_names in routes.items():
+        with STARTUP_PROFILER.phase('set_routes', cls.__name__):
+            SWAGGER_VALIDATOR.validate(cls.__schema__)
+            schema = cls.__schema__
+            cls._set_key()
+
+            if not hasattr(cls, '__schema_dir__'):
+                cls.__schema_dir__ = get_module_path(cls)
+
+            cls.__operations__ = list(iter_operations(schema))
+            definitions = schema.get('definitions')
+            cls.__routes__ = set([cls._build_route(operation, definitions)
+                                  for operation in cls.__operations__])
+            cls.__options_routes__ = cls._build_options_routes(cls.__routes__)
+            cls.__routes__.update(cls.__options_routes__)
+
+    def _build_route(cls, operation, definitions):
+        try:
+            getattr(cls, operation.operation_id)
+        except AttributeError:
+            raise ModelBaseError("'operationId' '{}' was not found".format(operation.operation_id))
+
+        method_schema = dict(operation.schema)
+        method_schema['parameters'] = operation.parameters
+
+        label = '{}.{}'.format(cls.__name__, operation.operation_id)
+        with STARTUP_PROFILER.phase('route_init', label):
+            return Route(operation.path, operation.method, operation.operation_id, cls,
+                         method_schema, definitions, cls.__authorizer__)
+
+    def _build_options_routes(cls, routes, old_options_routes=None):
+        old_options_routes = {route.uri_template: route for route in old_options_routes or []}
+        routes_methods = defaultdict(set)
+        for route in routes:
+            routes_methods[route.uri_template].add(route.method_name)
+
+        options_routes = set()
+        for uri_template, methods_names in routes_methods.items():
             if not 'OPTIONS' in methods_names:
-                options_operation = create_default_options(methods_names)
                 uri_template_norm = uri_template.replace('{', '_').replace('}', '_')
                 options_operation_name = '{}_{}'.format(uri_template_norm, 'options')
+                old_route = old_options_routes.get(uri_template)
+
+                if old_route is not None and old_route.methods_names == methods_names:
+                    options_routes.add(old_route)
+                    continue
+
+                options_operation = create_default_options(methods_names)
                 setattr(cls, options_operation_name, options_operation)
 
                 route = Route(uri_template, 'OPTIONS', options_operation_name,
-                              cls, {}, [], cls.__authorizer__)
-                cls.__options_routes__.add(route)
-                cls.__routes__.add(route)
+                              cls, {'x-session': False}, [], cls.__authorizer__)
+                route.methods_names = methods_names
+                options_routes.add(route)
+
+        return options_routes
+
+    def reload_schema(cls, schema):
+        """ Replaces the model schema rebuilding only the routes of changed operations
+
+        Returns a tuple with the new routes and the routes which are not used anymore.
+        See `prepare_reload_schema`.
+        """
+        attributes, new_routes, removed_routes = cls.prepare_reload_schema(schema)
+        cls.commit_reload_schema(attributes)
+        return new_routes, removed_routes
+
+    def prepare_reload_schema(cls, schema):
+        """ Builds the routes of a new schema without changing the model
+
+        The operations are compared per path and method with the current ones. Unchanged
+        operations keep their `Route` objects (and validators). Returns a tuple with the
+        model attributes to pass to `commit_reload_schema`, the new routes and the routes
+        which are not used anymore.
+        """
+        SWAGGER_VALIDATOR.validate(schema)
+        definitions = schema.get('definitions')
+        definitions_changed = definitions != cls.__schema__.get('definitions')
+        operations = list(iter_operations(schema))
+        old_operations = {(op.path, op.method): op for op in cls.__operations__}
+        old_routes = {(route.uri_template, route.method_name): route \
+            for route in cls.__routes__.difference(cls.__options_routes__)}
+        routes = set()
+        new_routes = set()
+
+        for operation in operations:
+            key = (operation.path, operation.method)
+            old_route = old_routes.get(key)
+
+            if old_route is not None and old_operations.get(key) == operation \
+                    and not (definitions_changed and old_route.has_body_parameter):
+                routes.add(old_route)
+            else:
+                route = cls._build_route(operation, definitions)
+                routes.add(route)
+                new_routes.add(route)
+
+        options_routes = cls._build_options_routes(routes, cls.__options_routes__)
+        new_routes.update(options_routes.difference(cls.__options_routes__))
+        routes.update(options_routes)
+        removed_routes = cls.__routes__.difference(routes)
+
+        # the model hooks only apply to the operations listed in `__operations__`
+        for route in new_routes:
+            route.compile_hooks(operations)
+
+        attributes = {
+            '__schema__': schema,
+            '__operations__': operations,
+            '__options_routes__': options_routes,
+            '__routes__': routes
+        }
+        return attributes, new_routes, removed_routes
+
+    def commit_reload_schema(cls, attributes):
+        for name, value in attributes.items():
+            setattr(cls, name, value)
 
 
 class ModelHttpMeta(ModelLoggerMetaMixin, ModelHttpMetaMixin):
     __authorizer__ = None
+    __response_cache__ = None
+    __rate_limiter__ = None
     __api__ = None
 
     def __init__(cls, name, bases_classes, attributes):
-        cls._set_logger()
-        cls._set_routes()
+        with STARTUP_PROFILER.phase('model_init', name):
+            cls._set_logger()
+            cls._set_routes()
@@ -22,12 +22,13 @@
 
 
 from falconopenapi.router import Route
-from falconopenapi.utils import build_validator
+from falconopenapi.utils import build_validator, build_etag, etag_matches
 from falconopenapi.exceptions import ModelBaseError, JSONError
 from falconopenapi.models.logger import ModelLoggerMetaMixin
 from falconopenapi.models.http import ModelHttpMetaMixin
+from falconopenapi.timing import NULL_TIMER
 from falcon.errors import HTTPNotFound, HTTPMethodNotAllowed
-from falcon import HTTP_CREATED, HTTP_NO_CONTENT, HTTP_METHODS
+from falcon import HTTP_CREATED, HTTP_NO_CONTENT, HTTP_NOT_MODIFIED, HTTP_METHODS
 from falcon.responders import create_default_options
 from jsonschema import ValidationError
 from collections import defaultdict
@@ -37,6 +38,7 @@ from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 import json
+import msgpack
 import os.path
 import logging
 import random
@@ -54,6 +56,9 @@ class _ModelContextMetaMixin(type):
         kwargs.update(parameters['query_string'])
         return session, req_body, id_, kwargs
 
+    def _serialize(cls, req, value):
+        with req.context.get('timer', NULL_TIMER).phase('serialize'):
+            return json.dumps(value)
 
 
 class _ModelPostMetaMixin(_ModelContextMetaMixin):
@@ -72,7 +77,7 @@ class _ModelPostMetaMixin(_ModelContextMetaMixin):
 
         resp_body = cls.insert(session, req_body, **kwargs)
         resp_body = resp_body if isinstance(req_body, list) else resp_body[0]
-        resp.body = json.dumps(resp_body)
+        resp.body = cls._serialize(req, resp_body)
         resp.status = HTTP_CREATED
 
     def _update_dict(cls, dict_, other):
@@ -93,7 +98,7 @@ class _ModelPutMetaMixin(_ModelPostMetaMixin):
         objs = cls.update(session, req_body, **kwargs)
 
         if objs:
-            resp.body = json.dumps(objs)
+            resp.body = cls._serialize(req, objs)
         else:
             raise HTTPNotFound()
 
@@ -119,7 +124,7 @@ class _ModelPutMetaMixin(_ModelPostMetaMixin):
             req.context['parameters']['body'] = req_body
             cls._insert(req, resp, with_update=True)
         else:
-            resp.body = json.dumps(objs[0])
+            resp.body = cls._serialize(req, objs[0])
 
 
 class _ModelPatchMetaMixin(_ModelPutMetaMixin):
@@ -133,7 +138,7 @@ class _ModelPatchMetaMixin(_ModelPutMetaMixin):
         cls._update_dict(req_body, id_)
         objs = cls.update(session, req_body, ids=id_, **kwargs)
         if objs:
-            resp.body = json.dumps(objs[0])
+            resp.body = cls._serialize(req, objs[0])
         else:
             raise HTTPNotFound()
 
@@ -157,25 +162,67 @@ class _ModelGetMetaMixin(_ModelContextMetaMixin):
 
     def get_by_body(cls, req, resp):
         session, req_body, _, kwargs = cls._get_context_values(req.context)
+        cls._get_and_respond(req, resp, session, (req_body,) if req_body else (), kwargs)
 
-        if req_body:
-            resp_body = cls.get(session, req_body, **kwargs)
+    def get_by_uri_template(cls, req, resp):
+        session, _, id_, kwargs = cls._get_context_values(req.context)
+        cls._get_and_respond(req, resp, session, (id_,), kwargs, first=True)
+
+    def _get_and_respond(cls, req, resp, session, args, kwargs, first=False):
+        page = cls._get_page_packed(session, args, kwargs)
+        if page is None:
+            packed_objs = cls._get_packed(session, args, kwargs)
         else:
-            resp_body = cls.get(session, **kwargs)
+            packed_objs, next_cursor = page
+            if next_cursor is not None:
+                resp.set_header('X-Next-Cursor', next_cursor)
 
-        if not resp_body:
-            raise HTTPNotFound()
+        if packed_objs is not None:
+            if not packed_objs:
+                raise HTTPNotFound()
 
-        resp.body = json.dumps(resp_body)
+            packed_objs = packed_objs[:1] if first else packed_objs
+            if cls._set_etag(req, resp, build_etag(packed_objs)):
+                return
 
-    def get_by_uri_template(cls, req, resp):
-        session, _, id_, kwargs = cls._get_context_values(req.context)
+            objs = [msgpack.loads(obj, encoding='utf-8') for obj in packed_objs]
+            resp.body = cls._serialize(req, objs[0] if first else objs)
+            return
 
-        resp_body = cls.get(session, id_, **kwargs)
-        if not resp_body:
+        objs = cls.get(session, *args, **kwargs)
+        if not objs:
             raise HTTPNotFound()
 
-        resp.body = json.dumps(resp_body[0])
+        body = cls._serialize(req, objs[0] if first else objs)
+        if not cls._set_etag(req, resp, build_etag([body.encode()])):
+            resp.body = body
+
+    def _get_packed(cls, session, args, kwargs):
+        # the packed objects bypass `get`, so they are not used when it was overridden
+        get_packed = getattr(cls, 'get_packed', None)
+        if get_packed is None or getattr(cls.get, '__func__', None) is not type(cls).get:
+            return None
+
+        return get_packed(session, *args, **kwargs)
+
+    def _get_page_packed(cls, session, args, kwargs):
+        # the collection reads with a cursor, or with a limit and no offset, are paginated
+        get_page_packed = getattr(cls, 'get_page_packed', None)
+        if get_page_packed is None or args or 'offset' in kwargs \
+                or ('cursor' not in kwargs and 'limit' not in kwargs) \
+                or getattr(cls.get, '__func__', None) is not type(cls).get:
+            return None
+
+        return get_page_packed(session, **kwargs)
+
+    def _set_etag(cls, req, resp, etag):
+        resp.set_header('ETag', etag)
+
+        if etag_matches(req.get_header('If-None-Match'), etag):
+            resp.status = HTTP_NOT_MODIFIED
+            return True
+
+        return False
 
     def get_schema(cls, req, resp):
         resp.body = json.dumps(cls.__schema__)
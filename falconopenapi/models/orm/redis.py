@@ -24,12 +24,100 @@
 from falconopenapi.models.orm.redis_base import ModelRedisBaseMeta, ModelRedisBase
 from collections import OrderedDict
 from copy import deepcopy
+from falconopenapi.exceptions import ModelBaseError
 from types import MethodType
+import base64
+import binascii
 import msgpack
 
 
+# KEYS[1]: model hash, KEYS[2]: model index; ARGV: key, packed object pairs, an empty
+# object deletes the key
+_UPDATE_SCRIPT = '''
+local applied = {}
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        if ARGV[i + 1] == '' then
+            redis.call('HDEL', KEYS[1], ARGV[i])
+            redis.call('ZREM', KEYS[2], ARGV[i])
+        else
+            redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+        end
+        applied[#applied + 1] = 1
+    else
+        applied[#applied + 1] = 0
+    end
+end
+return applied
+'''
+
+_UPDATE_SCRIPTS = dict()
+
+
+def _get_update_script(redis_bind):
+    script = _UPDATE_SCRIPTS.get(redis_bind)
+    if script is None:
+        script = _UPDATE_SCRIPTS[redis_bind] = redis_bind.register_script(_UPDATE_SCRIPT)
+
+    return script
+
+
 class ModelRedisMeta(ModelRedisBaseMeta):
+    """ Model stored in a Redis hash, keyed by the instances ids
+
+    `update` checks the existence of the submitted keys only. With `ATOMIC_UPDATE` a Lua
+    script checks and writes each key atomically, otherwise the check is a pipeline of
+    HEXISTS followed by the writes.
+
+    The keys are also kept in a sorted set, the index, which serves `limit`/`offset` and
+    the cursors of `get_page` in key order. Hashes written before the index existed are
+    indexed by `rebuild_index`, which is also run when a read finds the index empty while
+    the hash is not.
+    """
     CHUNKS = 100
+    PAGE_SIZE = 100
+    ATOMIC_UPDATE = False
+
+    def get_index_key(cls):
+        return cls.__key__ + '_index'
+
+    def _add_to_index(cls, redis_bind, keys):
+        # ZADD with score/member pairs has the same syntax in every redis client version
+        args = []
+        for key in keys:
+            args.append(0)
+            args.append(key)
+
+        redis_bind.execute_command('ZADD', cls.get_index_key(), *args)
+
+    def rebuild_index(cls, session):
+        """ Indexes the keys of the model hash, returns how many keys were indexed """
+        keys = session.redis_bind.hkeys(cls.__key__)
+        pipeline = session.redis_bind.pipeline(transaction=True)
+        pipeline.delete(cls.get_index_key())
+        for i in range(0, len(keys), cls.CHUNKS):
+            cls._add_to_index(pipeline, keys[i:i + cls.CHUNKS])
+
+        pipeline.execute()
+        return len(keys)
+
+    def _read_index(cls, session, read_keys):
+        keys = read_keys()
+        if not keys and cls._rebuild_missing_index(session):
+            keys = read_keys()
+
+        return keys
+
+    def _rebuild_missing_index(cls, session):
+        pipeline = session.redis_bind.pipeline(transaction=False)
+        pipeline.zcard(cls.get_index_key())
+        pipeline.hlen(cls.__key__)
+        indexed, count = pipeline.execute()
+        if indexed or not count:
+            return False
+
+        cls.rebuild_index(session)
+        return True
 
     def insert(cls, session, objs, **kwargs):
         input_ = deepcopy(objs)
@@ -45,11 +133,13 @@ class ModelRedisMeta(ModelRedisBaseMeta):
 
             if counter == cls.CHUNKS:
                 session.redis_bind.hmset(cls.__key__, ids_objs_map)
+                cls._add_to_index(session.redis_bind, ids_objs_map.keys())
                 ids_objs_map = dict()
                 counter = 0
 
         if ids_objs_map:
             session.redis_bind.hmset(cls.__key__, ids_objs_map)
+            cls._add_to_index(session.redis_bind, ids_objs_map.keys())
 
         return objs
 
@@ -62,13 +152,12 @@ class ModelRedisMeta(ModelRedisBaseMeta):
         else:
             keys_objs_map = OrderedDict([(cls.get_instance_key(obj), obj) for obj in objs])
 
-        keys = set(keys_objs_map.keys())
-        keys.difference_update(set(session.redis_bind.hkeys(cls.__key__)))
-        keys.intersection_update(keys)
-        invalid_keys = keys
+        if cls.ATOMIC_UPDATE:
+            return cls._update_atomically(session, keys_objs_map)
 
-        for key in invalid_keys:
-            keys_objs_map.pop(key, None)
+        for key, exists in zip(list(keys_objs_map), cls._get_keys_exist(session, keys_objs_map)):
+            if not exists:
+                keys_objs_map.pop(key)
 
         keys_objs_to_del = dict()
 
@@ -95,9 +184,51 @@ class ModelRedisMeta(ModelRedisBaseMeta):
 
         if keys_objs_to_del:
             session.redis_bind.hdel(cls.__key__, *keys_objs_to_del.keys())
+            session.redis_bind.zrem(cls.get_index_key(), *keys_objs_to_del.keys())
 
         return list(keys_objs_map.values()) or list(keys_objs_to_del.values())
 
+    def _get_keys_exist(cls, session, keys):
+        # checks only the submitted keys, in one round trip, instead of reading the whole hash
+        if not keys:
+            return []
+
+        pipeline = session.redis_bind.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hexists(cls.__key__, key)
+
+        return pipeline.execute()
+
+    def _update_atomically(cls, session, keys_objs_map):
+        # the script sets or deletes each key only if it exists, in one round trip
+        items = list(keys_objs_map.items())
+        if not items:
+            return []
+
+        script = _get_update_script(session.redis_bind)
+        pipeline = session.redis_bind.pipeline(transaction=False)
+
+        for i in range(0, len(items), cls.CHUNKS):
+            args = []
+            for key, obj in items[i:i + cls.CHUNKS]:
+                args.append(key)
+                args.append(b'' if obj.get('_operation') == 'delete' else msgpack.dumps(obj))
+
+            script(keys=[cls.__key__, cls.get_index_key()], args=args, client=pipeline)
+
+        applied = [applied for chunk in pipeline.execute() for applied in chunk]
+        objs_set = []
+        objs_deleted = []
+
+        for (key, obj), was_applied in zip(items, applied):
+            if was_applied:
+                if obj.get('_operation') == 'delete':
+                    objs_deleted.append(obj)
+                else:
+                    objs_set.append(obj)
+
+        return objs_set or objs_deleted
+
     def _build_keys_objs_map_with_ids(cls, objs, ids):
         ids = cls._to_list(ids)
         keys_objs_map = OrderedDict()
@@ -116,28 +247,85 @@ class ModelRedisMeta(ModelRedisBaseMeta):
         keys = [cls._build_key(id_) for id_ in cls._to_list(ids)]
         if keys:
             session.redis_bind.hdel(cls.__key__, *keys)
+            session.redis_bind.zrem(cls.get_index_key(), *keys)
 
     def get(cls, session, ids=None, limit=None, offset=None, **kwargs):
-        if limit is not None and offset is not None:
-            limit += offset
+        return cls._unpack_objs(cls.get_packed(session, ids, limit, offset, **kwargs))
 
-        elif ids is None and limit is None and offset is None:
-            return cls._unpack_objs(session.redis_bind.hgetall(cls.__key__))
+    def get_packed(cls, session, ids=None, limit=None, offset=None, **kwargs):
+        """ Returns the msgpack blobs of the objects, without decoding them """
+        if ids is None and limit is None and offset is None:
+            return cls._filter_packed_objs(session.redis_bind.hgetall(cls.__key__))
 
         if ids is None:
-            keys = [k for k in session.redis_bind.hkeys(cls.__key__)][offset:limit]
-            if keys:
-                return cls._unpack_objs(session.redis_bind.hmget(cls.__key__, *keys))
-            else:
+            if limit == 0:
                 return []
-        else:
-            ids = [cls._build_key(id_) for id_ in cls._to_list(ids)]
-            return cls._unpack_objs(session.redis_bind.hmget(cls.__key__, *ids[offset:limit]))
 
-    def _unpack_objs(cls, objs):
+            start = offset or 0
+            stop = -1 if limit is None else start + limit - 1
+            keys = cls._read_index(
+                session, lambda: session.redis_bind.zrange(cls.get_index_key(), start, stop))
+            return cls._get_packed_by_keys(session, keys)
+
+        if limit is not None and offset is not None:
+            limit += offset
+
+        ids = [cls._build_key(id_) for id_ in cls._to_list(ids)]
+        return cls._filter_packed_objs(
+            session.redis_bind.hmget(cls.__key__, *ids[offset:limit]))
+
+    def get_page(cls, session, cursor=None, limit=None, **kwargs):
+        """ Returns the objects after `cursor` and the cursor of the next page, or None """
+        packed_objs, next_cursor = cls.get_page_packed(session, cursor, limit)
+        return cls._unpack_objs(packed_objs), next_cursor
+
+    def get_page_packed(cls, session, cursor=None, limit=None, **kwargs):
+        if limit is None:
+            limit = cls.PAGE_SIZE
+
+        start = b'-' if cursor is None else b'(' + cls._decode_cursor(cursor)
+        if limit <= 0:
+            return [], None
+
+        keys = cls._read_index(session, lambda: session.redis_bind.zrangebylex(
+            cls.get_index_key(), start, b'+', 0, limit + 1))
+        next_cursor = None
+
+        if len(keys) > limit:
+            keys = keys[:limit]
+            next_cursor = cls._encode_cursor(keys[-1])
+
+        return cls._get_packed_by_keys(session, keys), next_cursor
+
+    def _get_packed_by_keys(cls, session, keys):
+        if not keys:
+            return []
+
+        return cls._filter_packed_objs(session.redis_bind.hmget(cls.__key__, *keys))
+
+    def _encode_cursor(cls, key):
+        return base64.urlsafe_b64encode(key).decode()
+
+    def _decode_cursor(cls, cursor):
+        try:
+            key = base64.urlsafe_b64decode(cursor.encode())
+        except (binascii.Error, ValueError):
+            key = None
+
+        # the decoding skips the characters out of the alphabet, so only a
+        # cursor encoding back to itself was made by _encode_cursor
+        if not key or cls._encode_cursor(key) != cursor:
+            raise ModelBaseError("invalid cursor '{}'".format(cursor), input_={'cursor': cursor})
+
+        return key
+
+    def _filter_packed_objs(cls, objs):
         if isinstance(objs, dict):
             objs = objs.values()
-        return [msgpack.loads(obj, encoding='utf-8') for obj in objs if obj is not None]
+        return [obj for obj in objs if obj is not None]
+
+    def _unpack_objs(cls, objs):
+        return [msgpack.loads(obj, encoding='utf-8') for obj in objs]
 
 
 class _ModelRedis(dict, ModelRedisBase):
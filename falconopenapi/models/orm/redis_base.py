@@ -26,6 +26,7 @@ from falconopenapi.utils import build_validator
 from falconopenapi.exceptions import ModelBaseError, JSONError
 from falconopenapi.models.logger import ModelLoggerMetaMixin
 from falconopenapi.models.orm.http import ModelOrmHttpMetaMixin
+from falconopenapi.profiling import STARTUP_PROFILER
 from falcon.errors import HTTPNotFound, HTTPMethodNotAllowed
 from falcon import HTTP_CREATED, HTTP_NO_CONTENT, HTTP_METHODS
 from falcon.responders import create_default_options
@@ -43,12 +44,13 @@ import random
 class ModelRedisBaseMeta(ModelLoggerMetaMixin, ModelOrmHttpMetaMixin):
 
     def __init__(cls, name, base_classes, attributes):
-        cls._set_logger()
+        with STARTUP_PROFILER.phase('model_init', name):
+            cls._set_logger()
 
-        if hasattr(cls, '__schema__'):
-            cls._set_routes()
-        else:
-            cls._set_key()
+            if hasattr(cls, '__schema__'):
+                cls._set_routes()
+            else:
+                cls._set_key()
 
     def _to_list(cls, objs):
         return objs if isinstance(objs, list) else [objs]
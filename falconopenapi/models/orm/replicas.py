@@ -0,0 +1,87 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from itertools import count
+from sqlalchemy import event
+from time import perf_counter
+
+
+class RoundRobinReplicas(object):
+    """ Chooses the replica binds in turn """
+
+    def __init__(self, binds):
+        self.binds = list(binds)
+        self._counter = count()
+
+    def choose(self):
+        return self.binds[next(self._counter) % len(self.binds)]
+
+
+class LeastLatencyReplicas(object):
+    """ Chooses the replica bind with the lowest moving average of the queries latency
+
+    The latency of each query run on a replica is folded into its exponentially weighted
+    moving average, weighted by `alpha`. Replicas without queries yet are chosen first.
+    """
+
+    def __init__(self, binds, alpha=0.2):
+        self.binds = list(binds)
+        self.alpha = alpha
+        self.latencies = {bind: None for bind in self.binds}
+
+        for bind in self.binds:
+            event.listen(bind, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(bind, 'after_cursor_execute', self._build_after_cursor_execute(bind))
+
+    def choose(self):
+        return min(self.binds, key=lambda bind: self.latencies[bind] or 0.0)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('falconopenapi_query_start', []).append(perf_counter())
+
+    def _build_after_cursor_execute(self, bind):
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            latency = perf_counter() - conn.info['falconopenapi_query_start'].pop()
+            average = self.latencies[bind]
+            self.latencies[bind] = latency if average is None else \
+                average + self.alpha * (latency - average)
+
+        return after_cursor_execute
+
+
+REPLICAS_STRATEGIES = {
+    'round_robin': RoundRobinReplicas,
+    'least_latency': LeastLatencyReplicas
+}
+
+
+def build_replicas(binds, strategy='round_robin'):
+    """ Returns the replicas chooser of `strategy`, a name or a class built from the binds """
+    if not binds:
+        return None
+
+    if isinstance(strategy, str):
+        if strategy not in REPLICAS_STRATEGIES:
+            raise ValueError("Unknown replicas strategy '{}'".format(strategy))
+        strategy = REPLICAS_STRATEGIES[strategy]
+
+    return strategy(binds)
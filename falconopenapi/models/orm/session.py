@@ -24,7 +24,10 @@
 from sqlalchemy.orm import sessionmaker, Session as SessionSA
 from sqlalchemy.orm.query import Query
 from sqlalchemy import event, or_
+from sqlalchemy.sql.expression import Select
 from collections import defaultdict
+from contextlib import contextmanager
+from falconopenapi.timing import NULL_TIMER
 
 import msgpack
 
@@ -33,9 +36,24 @@ class _SessionBase(SessionSA):
             self, bind=None, autoflush=True,
             expire_on_commit=True, _enable_transaction_accounting=True,
             autocommit=False, twophase=False, weak_identity_map=True,
-            binds=None, extension=None, info=None, query_cls=Query, redis_bind=None):
+            binds=None, extension=None, info=None, query_cls=Query, redis_bind=None,
+            redis_chunk_size=500, redis_transaction=False,
+            related_batch_size=500, related_max_depth=None, redis_write_behind=None,
+            replicas=None):
         self.redis_bind = redis_bind
+        self.redis_write_behind = redis_write_behind
+        self.redis_chunk_size = redis_chunk_size
+        self.redis_transaction = redis_transaction
+        self.related_batch_size = related_batch_size
+        self.related_max_depth = related_max_depth
+        self.replicas = replicas
+        self.use_replicas = False
+        self._replica_bind = None
+        self._primary_pinned = False
+        self.redis_round_trips = 0
+        self.async_redis_bind = None
         self.user = None
+        self.timer = NULL_TIMER
         self._clean_redis_sets()
         SessionSA.__init__(
             self, bind=bind, autoflush=autoflush, expire_on_commit=expire_on_commit,
@@ -49,61 +67,173 @@ class _SessionBase(SessionSA):
 
     def commit(self):
         try:
-            SessionSA.commit(self)
+            with self.timer.phase('sql'):
+                SessionSA.commit(self)
+
             if self.redis_bind is not None:
-                self._exec_hdel(self._insts_to_hdel)
-                self._update_objects_on_redis()
+                with self.timer.phase('redis'):
+                    self._update_objects_on_redis()
         finally:
             self._clean_redis_sets()
 
+    def close(self):
+        SessionSA.close(self)
+        self._clean_redis_sets()
+        self.user = None
+        self.timer = NULL_TIMER
+        self.redis_round_trips = 0
+        self.use_replicas = False
+        self._replica_bind = None
+        self._primary_pinned = False
+
+    def get_bind(self, mapper=None, clause=None):
+        """ Routes the SELECTs to a replica when `use_replicas` is set
+
+        The replica is chosen once per session use. Once the session has flushed, or ran any
+        statement other than a SELECT, every query goes to the primary until `close`, so a
+        request reads its own writes.
+        """
+        if self.replicas is not None and self.use_replicas and not self._primary_pinned:
+            if isinstance(clause, Select) and not self._flushing:
+                if self._replica_bind is None:
+                    self._replica_bind = self.replicas.choose()
+                return self._replica_bind
+
+            self._primary_pinned = True
+
+        return SessionSA.get_bind(self, mapper, clause)
+
+    def pin_primary(self):
+        self._primary_pinned = True
+
+    @contextmanager
+    def use_primary(self):
+        """ Sends the queries run in the block to the primary, without pinning the session
+
+        Used by the reads which fill the Redis cache: the cache entries have no TTL, so
+        rows read from a lagging replica would be served stale until the next write.
+        """
+        use_replicas = self.use_replicas
+        self.use_replicas = False
+        try:
+            yield
+        finally:
+            self.use_replicas = use_replicas
+
     def delete(self, instance):
-        self._insts_to_hmset.update(instance.get_related(self))
+        self._insts_to_hmset.update(
+            type(instance).get_related_many(self, [instance], self.related_batch_size))
         return SessionSA.delete(self, instance)
 
     def _update_objects_on_redis(self):
-        insts_to_hmset = set.union(self._insts_to_hdel, self._insts_to_hmset)
-        insts_to_hmset_count = 0
+        insts_to_hmset = self._collect_related(
+            set.union(self._insts_to_hdel, self._insts_to_hmset))
+        insts_to_hmset.difference_update(self._insts_to_hdel)
+        insts_to_hdel = [inst for inst in self._insts_to_hdel if type(inst).__use_redis__]
+        insts_to_hmset = [inst for inst in insts_to_hmset if type(inst).__use_redis__]
+        if not insts_to_hdel and not insts_to_hmset:
+            return
+
+        if self.redis_write_behind is not None:
+            self.redis_write_behind.put(self._build_redis_writes(insts_to_hdel, insts_to_hmset))
+            return
+
+        filters_names_sets = self._get_filters_names_sets(
+            set([type(inst) for inst in insts_to_hdel + insts_to_hmset]))
+        pipeline = self.redis_bind.pipeline(transaction=self.redis_transaction)
+        self._exec_hdel(pipeline, insts_to_hdel, filters_names_sets)
+        self._exec_hmset(pipeline, insts_to_hmset, filters_names_sets)
+        pipeline.execute()
+        self._count_redis_round_trip()
+        self._invalidate_near_caches(insts_to_hdel + insts_to_hmset)
+
+    def _invalidate_near_caches(self, insts):
+        models_keys_map = defaultdict(set)
 
-        while len(insts_to_hmset) != insts_to_hmset_count:
-            insts_to_hmset_count = len(insts_to_hmset)
-            insts_to_hmset_copy = insts_to_hmset.copy()
-            [insts_to_hmset.update(inst.get_related(self)) for inst in insts_to_hmset_copy]
+        for inst in insts:
+            if type(inst).__near_cache__ is not None:
+                keys = models_keys_map[type(inst)]
+                keys.add(inst.get_key())
+                inst_old_redis_key = getattr(inst, 'old_redis_key', None)
+                if inst_old_redis_key is not None:
+                    keys.add(inst_old_redis_key)
 
-        insts_to_hmset.difference_update(self._insts_to_hdel)
-        self._exec_hmset(insts_to_hmset)
+        for model, keys in models_keys_map.items():
+            model.__near_cache__.invalidate(keys)
+
+    def _collect_related(self, insts):
+        """ Expands `insts` with their related instances, breadth first
+
+        Each level is queried per model, so the queries count depends on the backrefs and on
+        `related_batch_size`, not on the number of instances. `related_max_depth` limits the
+        number of levels expanded; None expands until no new instance is found.
+        """
+        visited = set(insts)
+        frontier = visited
+        depth = 0
+
+        while frontier and (self.related_max_depth is None or depth < self.related_max_depth):
+            models_insts_map = defaultdict(list)
+            for inst in frontier:
+                models_insts_map[type(inst)].append(inst)
+
+            frontier = set()
+            for model, model_insts in models_insts_map.items():
+                frontier.update(
+                    model.get_related_many(self, model_insts, self.related_batch_size))
+
+            frontier.difference_update(visited)
+            visited.update(frontier)
+            depth += 1
 
-    def _exec_hdel(self, insts):
+        return visited
+
+    def _build_redis_writes(self, insts_to_hdel, insts_to_hmset):
+        writes = [(type(inst), inst.get_key(), None) for inst in insts_to_hdel]
+
+        for inst in insts_to_hmset:
+            inst_redis_key = inst.get_key()
+            inst_old_redis_key = getattr(inst, 'old_redis_key', None)
+            if inst_old_redis_key is not None and inst_old_redis_key != inst_redis_key:
+                writes.append((type(inst), inst_old_redis_key, None))
+
+            writes.append((type(inst), inst_redis_key, msgpack.dumps(inst.todict())))
+
+        return writes
+
+    def _get_filters_names_sets(self, models):
+        models = list(models)
+        pipeline = self.redis_bind.pipeline(transaction=False)
+        for model in models:
+            pipeline.smembers(model.get_filters_names_key())
+
+        filters_names_sets = pipeline.execute()
+        self._count_redis_round_trip()
+        return {model: filters_names_sets[i] for i, model in enumerate(models)}
+
+    def _count_redis_round_trip(self):
+        self.redis_round_trips += 1
+        self.timer.count('redis_round_trips')
+
+    def _exec_hdel(self, pipeline, insts, filters_names_sets):
         models_keys_insts_keys_map = defaultdict(set)
 
         for inst in insts:
             model = type(inst)
-            if not model.__use_redis__:
-                continue
-
-            filters_names_set = self._get_filters_names_set(inst)
-            for filters_names in filters_names_set:
+            for filters_names in filters_names_sets[model]:
                 model_redis_key = type(model).get_key(model, filters_names.decode())
                 inst_redis_key = inst.get_key()
                 models_keys_insts_keys_map[model_redis_key].add(inst_redis_key)
 
-        for model_key, insts_keys in models_keys_insts_keys_map.items():
-            self.redis_bind.hdel(model_key, *insts_keys)
-
-    def _get_filters_names_set(self, inst):
-        filters_names_key = type(inst).get_filters_names_key()
-        return self.redis_bind.smembers(filters_names_key)
+        self._pipeline_hdel(pipeline, models_keys_insts_keys_map)
 
-    def _exec_hmset(self, insts):
+    def _exec_hmset(self, pipeline, insts, filters_names_sets):
         models_keys_insts_keys_insts_map = defaultdict(dict)
         models_keys_insts_keys_map = defaultdict(set)
 
         for inst in insts:
             model = type(inst)
-            if not model.__use_redis__:
-                continue
-
-            filters_names_set = self._get_filters_names_set(inst)
-            for filters_names in filters_names_set:
+            for filters_names in filters_names_sets[model]:
                 model_redis_key = type(model).get_key(model, filters_names.decode())
                 inst_redis_key = inst.get_key()
 
@@ -113,11 +243,20 @@ class _SessionBase(SessionSA):
 
                 models_keys_insts_keys_insts_map[model_redis_key][inst_redis_key] = msgpack.dumps(inst.todict())
 
+        chunk_size = self.redis_chunk_size
         for model_key, insts_keys_insts_map in models_keys_insts_keys_insts_map.items():
-            self.redis_bind.hmset(model_key, insts_keys_insts_map)
+            items = list(insts_keys_insts_map.items())
+            for i in range(0, len(items), chunk_size):
+                pipeline.hmset(model_key, dict(items[i:i + chunk_size]))
 
+        self._pipeline_hdel(pipeline, models_keys_insts_keys_map)
+
+    def _pipeline_hdel(self, pipeline, models_keys_insts_keys_map):
+        chunk_size = self.redis_chunk_size
         for model_key, insts_keys in models_keys_insts_keys_map.items():
-            self.redis_bind.hdel(model_key, *insts_keys)
+            insts_keys = list(insts_keys)
+            for i in range(0, len(insts_keys), chunk_size):
+                pipeline.hdel(model_key, *insts_keys[i:i + chunk_size])
 
     def mark_for_hdel(self, inst):
         self._insts_to_hdel.add(inst)
@@ -135,6 +274,11 @@ def deleted_from_database(session, instance):
         session.mark_for_hdel(instance)
 
 
+@event.listens_for(Session, 'after_flush')
+def flushed_to_database(session, flush_context):
+    session.pin_primary()
+
+
 @event.listens_for(Session, 'pending_to_persistent')
 def added_to_database(session, instance):
     if session.redis_bind is not None and instance is not None:
@@ -31,6 +31,7 @@ from sqlalchemy.orm.collections import InstrumentedList
 from sqlalchemy import or_, and_
 from copy import deepcopy
 from collections import OrderedDict
+from contextlib import suppress
 from importlib import import_module
 from re import match as re_match, sub as re_sub
 from glob import glob
@@ -39,6 +40,8 @@ from falconopenapi.exceptions import ModelBaseError
 from falconopenapi.models.orm.redis_base import ModelRedisBaseMeta, ModelRedisBase
 from falconopenapi.models.logger import ModelLoggerMetaMixin
 from falconopenapi.models.http import ModelHttpMetaMixin
+from falconopenapi.profiling import STARTUP_PROFILER
+from falconopenapi.timing import NULL_TIMER
 
 import json
 import msgpack
@@ -49,7 +52,8 @@ class ModelSQLAlchemyRedisInitMetaMixin(
     DeclarativeMeta, ModelRedisBaseMeta):
 
     def __init__(cls, name, bases_classes, attributes):
-        DeclarativeMeta.__init__(cls, name, bases_classes, attributes)
+        with STARTUP_PROFILER.phase('declarative_init', name):
+            DeclarativeMeta.__init__(cls, name, bases_classes, attributes)
 
         if hasattr(cls, '__baseclass_name__'):
             cls._build_primary_keys()
@@ -70,9 +74,15 @@ class ModelSQLAlchemyRedisInitMetaMixin(
             cls.__columns__ = set(cls.__table__.c)
             cls.__key__ = str(cls.__table__.name)
             cls.__use_redis__ = getattr(cls, '__use_redis__', True)
+            cls.__near_cache__ = getattr(cls, '__near_cache__', None)
+            if cls.__near_cache__ is not None:
+                cls.__near_cache__.bind('falconopenapi_near_cache:' + cls.__key__)
             cls.__todict_schema__ = {}
             base_class.__all_models__[cls.__key__] = cls
-            cls._build_backrefs_for_all_models(base_class.__all_models__.values())
+
+            with STARTUP_PROFILER.phase('build_backrefs', name):
+                cls._build_backrefs_for_all_models(base_class.__all_models__.values())
+
             ModelRedisBaseMeta.__init__(cls, name, bases_classes, attributes)
 
         else:
@@ -196,12 +206,43 @@ class ModelSQLAlchemyRedisOperationsMetaMixin(type):
     def delete(cls, session, ids, commit=True, **kwargs):
         ids = cls._to_list(ids)
         filters = cls.build_filters_by_ids(ids)
-        instances = cls._build_query(session).filter(filters).all()
+        with getattr(session, 'timer', NULL_TIMER).phase('sql'):
+            instances = cls._build_query(session).filter(filters).all()
         [session.delete(inst) for inst in instances]
 
         if commit:
             session.commit()
 
+    def get_related_many(cls, session, insts, batch_size=500):
+        """ Returns the instances which reference any of `insts` through a backref
+
+        Runs one query per backref relationship and batch of `batch_size` instances.
+        """
+        related = set()
+        if not insts:
+            return related
+
+        insts = list(insts)
+        timer = getattr(session, 'timer', NULL_TIMER)
+
+        for relationship in cls.__backrefs__:
+            rel_model = cls.get_model_from_rel(relationship, parent=True)
+            for i in range(0, len(insts), batch_size):
+                filters = cls.build_in_filters_by_ids(
+                    [inst.get_ids_map() for inst in insts[i:i + batch_size]])
+                with timer.phase('sql'):
+                    related.update(
+                        rel_model._build_query(session).join(relationship).filter(filters).all())
+
+        return related
+
+    def build_in_filters_by_ids(cls, ids):
+        if len(ids) > 1 and len(ids[0]) == 1:
+            attr_name = next(iter(ids[0]))
+            return getattr(cls, attr_name).in_([id_[attr_name] for id_ in ids])
+
+        return cls.build_filters_by_ids(ids)
+
     def build_filters_by_ids(cls, ids):
         if len(ids) == 1:
             return cls._get_obj_i_comparison(ids[0])
@@ -239,7 +280,10 @@ class ModelSQLAlchemyRedisOperationsMetaMixin(type):
             if offset is not None:
                 query = query.offset(offset)
 
-            return cls._build_todict_list(query.all()) if todict else query.all()
+            with getattr(session, 'timer', NULL_TIMER).phase('sql'):
+                insts = query.all()
+
+            return cls._build_todict_list(insts) if todict else insts
 
         if limit is not None and offset is not None:
             limit += offset
@@ -247,6 +291,23 @@ class ModelSQLAlchemyRedisOperationsMetaMixin(type):
         ids = cls._to_list(ids)
         return cls._get_many(session, ids[offset:limit], todict, kwargs)
 
+    def get_packed(cls, session, ids=None, limit=None, offset=None, **kwargs):
+        """ Returns the msgpack blobs of the objects cached on redis, without decoding them
+
+        Returns None when the objects are not served by the redis cache.
+        """
+        if ids is None or session.redis_bind is None:
+            return None
+
+        if limit is not None and offset is not None:
+            limit += offset
+
+        ids = cls._to_list(ids)[offset:limit]
+        if cls.__near_cache__ is not None:
+            return [packed for packed, _ in cls._get_many_near_cached(session, ids, kwargs)]
+
+        return cls._get_many_packed(session, ids, kwargs)
+
     def _build_query(cls, session, kwargs=None):
         query = session.query(cls)
 
@@ -286,34 +347,75 @@ class ModelSQLAlchemyRedisOperationsMetaMixin(type):
         return query, filters
 
     def _get_many(cls, session, ids, todict, kwargs):
+        timer = getattr(session, 'timer', NULL_TIMER)
+
         if not todict or session.redis_bind is None:
             filters = cls.build_filters_by_ids(ids)
-            insts = cls._build_query(session, kwargs).filter(filters).all()
+            with timer.phase('sql'):
+                insts = cls._build_query(session, kwargs).filter(filters).all()
 
             if todict:
                 return [inst.todict() for inst in insts]
             else:
                 return insts
 
+        if cls.__near_cache__ is not None:
+            return [obj for _, obj in cls._get_many_near_cached(session, ids, kwargs)]
+
+        return [msgpack.loads(obj, encoding='utf-8')
+                for obj in cls._get_many_packed(session, ids, kwargs)]
+
+    def _get_many_near_cached(cls, session, ids, kwargs):
+        # returns the (packed, decoded) objects, reading Redis only for the ones not cached
+        near_cache = cls.__near_cache__
+        model_redis_key = type(cls).get_key(cls, '_'.join(kwargs.keys()))
+        keys = [(model_redis_key, cls.get_instance_key(id_, id_.keys())) for id_ in ids]
+        generation = near_cache.generation
+        entries = near_cache.get_many(keys)
+        ids_not_cached = [id_ for id_, entry in zip(ids, entries) if entry is None]
+
+        if ids_not_cached:
+            id_names = ids[0].keys()
+            loaded = dict()
+            for packed in cls._get_many_packed(session, ids_not_cached, kwargs):
+                obj = msgpack.loads(packed, encoding='utf-8')
+                loaded[(model_redis_key, cls.get_instance_key(obj, id_names))] = (packed, obj)
+
+            near_cache.set_many(loaded.items(), generation)
+            entries = [loaded.get(key) if entry is None else entry
+                       for key, entry in zip(keys, entries)]
+
+        return [entry for entry in entries if entry is not None]
+
+    def _get_many_packed(cls, session, ids, kwargs):
+        timer = getattr(session, 'timer', NULL_TIMER)
         model_redis_key = type(cls).get_key(cls, '_'.join(kwargs.keys()))
         ids_redis_keys = [cls.get_instance_key(id_, id_.keys()) for id_ in ids]
-        objs = session.redis_bind.hmget(model_redis_key, ids_redis_keys)
+        with timer.phase('redis'):
+            objs = session.redis_bind.hmget(model_redis_key, ids_redis_keys)
         ids_not_cached = [id_ for i, (id_, obj) in enumerate(zip(ids, objs)) if obj is None]
-        objs = [msgpack.loads(obj, encoding='utf-8') for obj in objs if obj is not None]
+        objs = [obj for obj in objs if obj is not None]
 
         if ids_not_cached:
-            session.redis_bind.sadd(cls.get_filters_names_key(), model_redis_key)
+            with timer.phase('redis'):
+                session.redis_bind.sadd(cls.get_filters_names_key(), model_redis_key)
+
             filters = cls.build_filters_by_ids(ids_not_cached)
-            instances = cls._build_query(session).filter(filters).all()
+            # the custom __session__ classes may not route to replicas
+            use_primary = getattr(session, 'use_primary', suppress)
+            with timer.phase('sql'), use_primary():
+                instances = cls._build_query(session).filter(filters).all()
+
             if instances:
                 items_to_set = {
                     inst.get_key(): msgpack.dumps(inst.todict()) for inst in instances}
-                session.redis_bind.hmset(model_redis_key, items_to_set)
+                with timer.phase('redis'):
+                    session.redis_bind.hmset(model_redis_key, items_to_set)
 
                 for inst in instances:
                     inst_ids = inst.get_ids_map(ids[0].keys())
                     index = ids_not_cached.index(inst_ids)
-                    objs.insert(index, inst.todict())
+                    objs.insert(index, items_to_set[inst.get_key()])
 
         return objs
 
@@ -459,23 +561,7 @@ class _ModelSQLAlchemyRedisBase(ModelRedisBase):
         pass
 
     def get_related(self, session):
-        related = set()
-        cls = type(self)
-        for relationship in cls.__backrefs__:
-            related_model_insts = self._get_related_model_insts(
-                session, relationship, parent=True)
-            related.update(related_model_insts)
-
-        return related
-
-    def _get_related_model_insts(self, session, relationship, parent=False):
-        cls = type(self)
-        rel_model = cls.get_model_from_rel(relationship, parent=parent)
-
-        filters = cls.build_filters_by_ids([self.get_ids_map()])
-        result = set(rel_model._build_query(session).join(
-            relationship).filter(filters).all())
-        return result
+        return type(self).get_related_many(session, [self])
 
     def todict(self, schema=None):
         if schema is None:
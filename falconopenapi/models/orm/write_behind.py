@@ -0,0 +1,245 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from collections import OrderedDict, defaultdict
+from threading import Condition, Thread
+from time import perf_counter, sleep
+import atexit
+import logging
+
+
+class RedisWriteBehind(object):
+    """ Applies the Redis cache writes of the sessions commits on a background thread
+
+    `put` queues (model, instance key, packed object) writes, a None object deletes the key.
+    A pending write to a key is replaced by the next one, so only the last value of each key
+    is sent. When `maxsize` keys are pending `put` blocks until the worker takes them. The
+    worker sends each batch with one SMEMBERS and one write pipeline, then invalidates the
+    models near caches. `close`, also run at exit, flushes the pending writes.
+
+    A failed batch is retried up to `max_retries` times, waiting `retry_backoff` seconds
+    doubled on each retry. When it still fails its keys are deleted from Redis instead, so
+    the next reads go to the database; the writes which could not be applied nor deleted
+    are counted as errors.
+    """
+
+    def __init__(self, redis_bind, maxsize=10000, chunk_size=500, transaction=False,
+                 max_retries=3, retry_backoff=0.1):
+        self.redis_bind = redis_bind
+        self.maxsize = maxsize
+        self.chunk_size = chunk_size
+        self.transaction = transaction
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.applied_count = 0
+        self.retries_count = 0
+        self.invalidated_count = 0
+        self.coalesced_count = 0
+        self.blocked_count = 0
+        self.blocked_seconds = 0.0
+        self.errors_count = 0
+        self.last_lag = 0.0
+        self._pending = OrderedDict()
+        self._condition = Condition()
+        self._in_flight = False
+        self._closed = False
+        self._thread = None
+        self._logger = logging.getLogger('falconopenapi.write_behind')
+
+    def put(self, writes):
+        with self._condition:
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._start()
+                self._enqueue(writes)
+                self._condition.notify_all()
+
+        if closed:
+            now = perf_counter()
+            self.applied_count += self._apply(
+                [((model, key), (value, now)) for model, key, value in writes])
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='falconopenapi-write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _enqueue(self, writes):
+        blocked = False
+
+        for model, key, value in writes:
+            pending_key = (model, key)
+            pending = self._pending.get(pending_key)
+            if pending is not None:
+                self._pending[pending_key] = (value, pending[1])
+                self.coalesced_count += 1
+                continue
+
+            if len(self._pending) >= self.maxsize:
+                start = perf_counter()
+                blocked = True
+                self._condition.notify_all()
+                while len(self._pending) >= self.maxsize:
+                    self._condition.wait()
+                self.blocked_seconds += perf_counter() - start
+
+            self._pending[pending_key] = (value, perf_counter())
+
+        if blocked:
+            self.blocked_count += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                batch, self._pending = self._pending, OrderedDict()
+                self._in_flight = True
+                self._condition.notify_all()
+
+            try:
+                self._apply_with_retries(batch)
+            finally:
+                with self._condition:
+                    self._in_flight = False
+                    self._condition.notify_all()
+
+    def _apply_with_retries(self, batch):
+        for retry in range(self.max_retries + 1):
+            if retry:
+                sleep(self.retry_backoff * 2 ** (retry - 1))
+                self.retries_count += 1
+
+            try:
+                self.applied_count += self._apply(batch.items())
+                return
+            except Exception:
+                self._logger.warning(
+                    'Failed to apply %d cache writes', len(batch), exc_info=True)
+
+        self._invalidate(batch)
+
+    def _invalidate(self, batch):
+        # the cached objects may be stale now, they are deleted to be read from the database
+        try:
+            self.invalidated_count += self._apply(
+                [(pending_key, (None, enqueued_at))
+                 for pending_key, (_, enqueued_at) in batch.items()])
+        except Exception:
+            self.errors_count += len(batch)
+            self._logger.exception('Failed to delete %d cache writes keys', len(batch))
+            self._invalidate_near_caches(batch)
+
+    def _apply(self, writes):
+        models_writes = defaultdict(dict)
+        oldest = None
+
+        for (model, key), (value, enqueued_at) in writes:
+            models_writes[model][key] = value
+            if oldest is None or enqueued_at < oldest:
+                oldest = enqueued_at
+
+        if oldest is None:
+            return 0
+
+        models = list(models_writes)
+        pipeline = self.redis_bind.pipeline(transaction=False)
+        for model in models:
+            pipeline.smembers(model.get_filters_names_key())
+
+        filters_names_sets = pipeline.execute()
+        pipeline = self.redis_bind.pipeline(transaction=self.transaction)
+        count = 0
+
+        for model, filters_names_set in zip(models, filters_names_sets):
+            model_writes = models_writes[model]
+            items = [(key, value) for key, value in model_writes.items() if value is not None]
+            keys = [key for key, value in model_writes.items() if value is None]
+            count += len(model_writes)
+
+            for filters_names in filters_names_set:
+                model_key = type(model).get_key(model, filters_names.decode())
+                for i in range(0, len(items), self.chunk_size):
+                    pipeline.hmset(model_key, dict(items[i:i + self.chunk_size]))
+                for i in range(0, len(keys), self.chunk_size):
+                    pipeline.hdel(model_key, *keys[i:i + self.chunk_size])
+
+        pipeline.execute()
+        self.last_lag = perf_counter() - oldest
+        self._invalidate_near_caches(
+            [(model, key) for model, model_writes in models_writes.items() for key in model_writes])
+        return count
+
+    def _invalidate_near_caches(self, writes):
+        models_keys = defaultdict(list)
+        for model, key in writes:
+            models_keys[model].append(key)
+
+        for model, keys in models_keys.items():
+            near_cache = getattr(model, '__near_cache__', None)
+            if near_cache is not None:
+                near_cache.invalidate(keys)
+
+    def get_lag(self):
+        """ Returns the age, in seconds, of the oldest pending write """
+        with self._condition:
+            oldest = next(iter(self._pending.values()), None)
+
+        return 0.0 if oldest is None else perf_counter() - oldest[1]
+
+    def get_stats(self):
+        with self._condition:
+            pending = len(self._pending)
+
+        return {
+            'pending': pending,
+            'lag_seconds': self.get_lag(),
+            'last_lag_seconds': self.last_lag,
+            'applied': self.applied_count,
+            'coalesced': self.coalesced_count,
+            'blocked': self.blocked_count,
+            'blocked_seconds': self.blocked_seconds,
+            'retries': self.retries_count,
+            'invalidated': self.invalidated_count,
+            'errors': self.errors_count
+        }
+
+    def flush(self):
+        """ Waits until every write queued so far was applied """
+        with self._condition:
+            while self._pending or self._in_flight:
+                self._condition.wait()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,315 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import defaultdict, deque
+from itertools import count
+from threading import Condition, Thread, get_ident
+from time import perf_counter, process_time, sleep, time
+import atexit
+import json
+import os
+import sys
+import tracemalloc
+
+
+PROFILE_STARTUP_ENV = 'FALCONOPENAPI_PROFILE_STARTUP'
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def _get_traced_memory():
+    return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+
+
+# tracemalloc.reset_peak is only available from python 3.9
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+class _Phase(object):
+    """ Measures one phase run
+
+    The traced peak is reset when a phase starts, so the peak seen before by the
+    enclosing phases is carried in `_peak` through the `stack` of running phases.
+    Without `tracemalloc.reset_peak` only the growth of the global peak is seen.
+    """
+    __slots__ = ['_record', '_stack', '_wall', '_cpu', '_memory', '_peak']
+
+    def __init__(self, record, stack):
+        self._record = record
+        self._stack = stack
+
+    def __enter__(self):
+        self._memory, peak = _get_traced_memory()
+        if self._stack:
+            parent = self._stack[-1]
+            parent._peak = max(parent._peak, peak)
+
+        if _reset_peak is not None and tracemalloc.is_tracing():
+            _reset_peak()
+            peak = self._memory
+
+        self._peak = peak
+        self._stack.append(self)
+        self._cpu = process_time()
+        self._wall = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = perf_counter() - self._wall
+        cpu = process_time() - self._cpu
+        memory, peak = _get_traced_memory()
+        peak = max(self._peak, peak)
+        self._stack.pop()
+        if self._stack:
+            parent = self._stack[-1]
+            parent._peak = max(parent._peak, peak)
+
+        record = self._record
+        record[0] += 1
+        record[1] += wall
+        record[2] += cpu
+        record[3] += max(memory - self._memory, 0)
+        record[4] = max(record[4], peak - self._memory)
+        return False
+
+
+class StartupProfiler(object):
+    """ Records wall time, CPU time and memory of the startup phases
+
+    Phases are keyed by name and label (usually the model name); nested phases are
+    inclusive. The memory is recorded as the bytes still allocated at the end of the
+    phases (retained) and the largest traced peak above the memory at the start of
+    one run (peak), which includes the temporary allocations.
+    When disabled `phase` returns a shared no-op context manager.
+    """
+
+    def __init__(self, enabled=False, output=None):
+        self.enabled = enabled
+        self.output = output
+        self._records = defaultdict(lambda: [0, 0.0, 0.0, 0, 0])
+        self._phases = []
+
+    def phase(self, name, label=''):
+        if not self.enabled:
+            return _NULL_PHASE
+
+        return _Phase(self._records[(name, label)], self._phases)
+
+    def get_records(self):
+        records = [{
+            'phase': name,
+            'label': label,
+            'calls': calls,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'retained_bytes': retained,
+            'peak_bytes': peak
+        } for (name, label), (calls, wall, cpu, retained, peak) in self._records.items()]
+        records.sort(key=lambda record: record['wall_seconds'], reverse=True)
+        return records
+
+    def get_report(self):
+        lines = ['{:<24} {:<40} {:>7} {:>11} {:>11} {:>13} {:>11}'.format(
+            'phase', 'label', 'calls', 'wall (ms)', 'cpu (ms)', 'retained (KiB)', 'peak (KiB)')]
+
+        for record in self.get_records():
+            lines.append('{:<24} {:<40} {:>7} {:>11.3f} {:>11.3f} {:>13.1f} {:>11.1f}'.format(
+                record['phase'], record['label'][:40], record['calls'],
+                record['wall_seconds'] * 1000, record['cpu_seconds'] * 1000,
+                record['retained_bytes'] / 1024, record['peak_bytes'] / 1024))
+
+        return '\n'.join(lines)
+
+    def dump(self):
+        if not self._records:
+            return
+
+        if self.output is None:
+            sys.stderr.write(self.get_report() + '\n')
+
+        elif self.output.lower().endswith('.json'):
+            with open(self.output, 'w') as output:
+                json.dump(self.get_records(), output, indent=2)
+
+        else:
+            with open(self.output, 'w') as output:
+                output.write(self.get_report() + '\n')
+
+    def reset(self):
+        self._records.clear()
+
+
+def _build_startup_profiler():
+    value = os.environ.get(PROFILE_STARTUP_ENV, '')
+    if value.lower() in ('', '0', 'false', 'no'):
+        return StartupProfiler()
+
+    output = None if value.lower() in ('1', 'true', 'yes') else value
+    profiler = StartupProfiler(enabled=True, output=output)
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    atexit.register(profiler.dump)
+    return profiler
+
+
+STARTUP_PROFILER = _build_startup_profiler()
+
+
+class _Capture(object):
+    __slots__ = ['thread_id', 'start', 'selected', 'stacks']
+
+    def __init__(self, thread_id, selected):
+        self.thread_id = thread_id
+        self.start = perf_counter()
+        self.selected = selected
+        self.stacks = dict()
+
+
+class RequestProfiler(object):
+    """ Samples the stacks of 1-in-`rate` requests and of the requests slower than `threshold`
+
+    A daemon thread reads the frames of the threads serving the captured requests every
+    `interval` seconds with `sys._current_frames`, so the profiled code is not traced. When
+    `threshold` is set every request is captured and only the slow (or selected) ones are
+    kept. The last `max_profiles` captures are kept as collapsed stacks, rooted on the route
+    and the operation name.
+    """
+
+    def __init__(self, rate=100, threshold=None, interval=0.005, max_profiles=100):
+        self.rate = rate
+        self.threshold = threshold
+        self.interval = interval
+        self.profiles = deque(maxlen=max_profiles)
+        self._requests_count = count()
+        self._active = dict()
+        self._condition = Condition()
+        self._labels = dict()
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        selected = self.rate > 0 and next(self._requests_count) % self.rate == 0
+        if not selected and self.threshold is None:
+            return None
+
+        capture = _Capture(get_ident(), selected)
+
+        with self._condition:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='falconopenapi-profiler', daemon=True)
+                self._thread.start()
+
+            self._active[id(capture)] = capture
+            self._condition.notify()
+
+        return capture
+
+    def stop(self, capture, uri_template, method, operation_name):
+        duration = perf_counter() - capture.start
+
+        with self._condition:
+            self._active.pop(id(capture), None)
+
+        if not capture.selected and (self.threshold is None or duration < self.threshold):
+            return
+
+        self.profiles.append({
+            'uri_template': uri_template,
+            'method': method,
+            'operation': operation_name,
+            'duration': duration,
+            'timestamp': time(),
+            'stacks': capture.stacks
+        })
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._active and not self._closed:
+                    self._condition.wait()
+
+                if self._closed:
+                    return
+
+                captures = list(self._active.values())
+
+            frames = sys._current_frames()
+            stacks = [(capture, self._collapse(frames.get(capture.thread_id)))
+                      for capture in captures]
+            del frames
+
+            with self._condition:
+                for capture, stack in stacks:
+                    if stack and self._active.get(id(capture)) is capture:
+                        capture.stacks[stack] = capture.stacks.get(stack, 0) + 1
+
+            sleep(self.interval)
+
+    def _collapse(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = '{}:{}'.format(
+                    frame.f_globals.get('__name__', code.co_filename),
+                    code.co_name).replace(';', ':')
+
+            labels.append(label)
+            frame = frame.f_back
+
+        labels.reverse()
+        return ';'.join(labels)
+
+    def get_collapsed_stacks(self):
+        """ Returns the stacks in the collapsed format read by flamegraph.pl and speedscope """
+        stacks = defaultdict(int)
+
+        for profile in list(self.profiles):
+            root = '{} {};{}'.format(
+                profile['method'], profile['uri_template'], profile['operation'])
+            for stack, samples in profile['stacks'].items():
+                stacks['{};{}'.format(root, stack)] += samples
+
+        return ''.join('{} {}\n'.format(stack, samples)
+                       for stack, samples in sorted(stacks.items()))
+
+    def get_profiles(self):
+        return list(self.profiles)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
@@ -0,0 +1,132 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import defaultdict
+from threading import Lock, Thread
+from time import sleep
+import json
+import logging
+
+
+class InvalidationChannel(object):
+    """ Broadcasts invalidations to every process through a Redis pub/sub channel
+
+    Messages are (topic, key) pairs; a None key invalidates the whole topic. A daemon
+    thread, started by the first `subscribe`, calls the topic callbacks with the key of
+    each message, the publisher process included. Messages published while the listener
+    was disconnected are lost, so after a reconnection every topic is invalidated.
+
+    The caches subscribe on their first read rather than when built, so the listener thread
+    is started in the worker process and not in a pre-forking master.
+    """
+
+    def __init__(self, redis_bind, channel='falconopenapi_invalidations',
+                 poll_timeout=1.0, retry_interval=1.0):
+        self.redis_bind = redis_bind
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.retry_interval = retry_interval
+        self.received_count = 0
+        self._callbacks = defaultdict(list)
+        self._lock = Lock()
+        self._thread = None
+        self._pubsub = None
+        self._closed = False
+        self._logger = logging.getLogger('falconopenapi.pubsub')
+
+    def subscribe(self, topic, callback):
+        with self._lock:
+            self._callbacks[topic].append(callback)
+
+            if self._thread is None:
+                self._pubsub = self._subscribe()
+                self._thread = Thread(target=self._run, name='falconopenapi-pubsub', daemon=True)
+                self._thread.start()
+
+    def publish(self, topic, key=None):
+        return self.redis_bind.publish(self.channel, json.dumps([topic, key]))
+
+    def _subscribe(self):
+        pubsub = self.redis_bind.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        return pubsub
+
+    def _run(self):
+        pubsub = self._pubsub
+
+        while not self._closed:
+            try:
+                if pubsub is None:
+                    pubsub = self._pubsub = self._subscribe()
+                    self._dispatch_all()
+
+                message = pubsub.get_message(timeout=self.poll_timeout)
+
+            except Exception:
+                if self._closed:
+                    break
+
+                self._logger.warning('Invalidation channel disconnected', exc_info=True)
+                self._close_pubsub(pubsub)
+                pubsub = self._pubsub = None
+                sleep(self.retry_interval)
+                continue
+
+            if message is not None and message['type'] == 'message':
+                self._dispatch(message['data'])
+
+        self._close_pubsub(pubsub)
+
+    def _dispatch(self, data):
+        try:
+            topic, key = json.loads(data.decode() if isinstance(data, bytes) else data)
+        except ValueError:
+            self._logger.warning('Invalid invalidation message: %r', data)
+            return
+
+        self.received_count += 1
+        for callback in list(self._callbacks.get(topic, ())):
+            self._call(callback, key)
+
+    def _dispatch_all(self):
+        for callbacks in list(self._callbacks.values()):
+            for callback in list(callbacks):
+                self._call(callback, None)
+
+    def _call(self, callback, key):
+        try:
+            callback(key)
+        except Exception:
+            self._logger.exception('Invalidation callback failed')
+
+    def _close_pubsub(self, pubsub):
+        if pubsub is not None:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+    def close(self):
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join(self.poll_timeout * 2)
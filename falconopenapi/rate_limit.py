@@ -0,0 +1,213 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.exceptions import TooManyRequestsError
+from collections import OrderedDict, namedtuple
+from math import ceil
+from threading import Lock
+from time import monotonic, time
+import logging
+
+
+RateLimit = namedtuple('RateLimit', ['limit', 'period', 'burst'])
+
+
+# KEYS[1]: bucket hash; ARGV: tokens per second, burst, now, cost
+_TOKEN_BUCKET_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1])
+local timestamp = tonumber(bucket[2])
+
+if tokens == nil then
+    tokens = burst
+    timestamp = now
+end
+
+tokens = math.min(burst, tokens + math.max(0, now - timestamp) * rate)
+local allowed = 0
+local retry_after = 0
+
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens), tostring(retry_after)}
+'''
+
+
+class LocalTokenBuckets(object):
+    """ In-process token buckets, keeping the `max_keys` most recently used ones """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key, rate, burst, now, cost=1):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens, timestamp = burst, now
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens, timestamp = bucket
+                self._buckets.move_to_end(key)
+
+            tokens = min(burst, tokens + max(0, now - timestamp) * rate)
+            retry_after = 0.0
+
+            if tokens >= cost:
+                tokens -= cost
+                allowed = True
+            else:
+                retry_after = (cost - tokens) / rate
+                allowed = False
+
+            self._buckets[key] = (tokens, now)
+            return allowed, tokens, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RateLimiter(object):
+    """ Token bucket rate limits per route and identity
+
+    The limits come from `routes_rate_limits`, keyed by 'METHOD uri_template', or from the
+    'x-rate-limit' operation extension: `{"limit": 100, "period": 60, "burst": 100}` allows
+    `limit` requests per `period` seconds with bursts up to `burst` (defaults to `limit`).
+
+    The buckets live in the session Redis and are updated by a Lua script, one round trip
+    per request. When the Redis call fails, or a call takes longer than `redis_timeout` seconds, the
+    next `fallback_period` seconds are limited by in-process buckets; each process then
+    applies the whole limit on its own. Configure a socket timeout on the Redis client to
+    bound the slowest call.
+    """
+
+    def __init__(self, routes_rate_limits=None, redis_prefix='falconopenapi_rate_limit',
+                 redis_timeout=0.05, fallback_period=5.0, max_local_keys=10000):
+        self.redis_prefix = redis_prefix
+        self.redis_timeout = redis_timeout
+        self.fallback_period = fallback_period
+        self.local_buckets = LocalTokenBuckets(max_local_keys)
+        self.limited_count = 0
+        self.fallback_count = 0
+        self._routes_rate_limits = dict(routes_rate_limits or {})
+        self._routes_limits = dict()
+        self._scripts = dict()
+        self._fallback_until = 0.0
+        self._logger = logging.getLogger('falconopenapi.rate_limit')
+
+    def get_limit(self, route):
+        key = self._build_route_key(route)
+        try:
+            return self._routes_limits[key]
+        except KeyError:
+            pass
+
+        options = self._routes_rate_limits.get(key, route.extensions.get('x-rate-limit'))
+        limit = None
+        if options is not None:
+            limit = RateLimit(options['limit'], options.get('period', 1),
+                              options.get('burst', options['limit']))
+
+        self._routes_limits[key] = limit
+        return limit
+
+    def discard(self, route):
+        """ Drops the route limit, so it is read again from the route schema """
+        self._routes_limits.pop(self._build_route_key(route), None)
+
+    def check(self, route, identity, redis_bind=None):
+        """ Takes a token for `identity` or raises `TooManyRequestsError`
+
+        Returns the tokens left, or None when the route is not limited.
+        """
+        limit = self.get_limit(route)
+        if limit is None:
+            return None
+
+        key = '{}:{}:{}'.format(self.redis_prefix, self._build_route_key(route), identity)
+        rate = limit.limit / limit.period
+        allowed, tokens, retry_after = self._take(key, rate, limit.burst, redis_bind)
+
+        if not allowed:
+            self.limited_count += 1
+            raise TooManyRequestsError('Too many requests', max(int(ceil(retry_after)), 1))
+
+        return int(tokens)
+
+    def _take(self, key, rate, burst, redis_bind):
+        now = time()
+
+        if redis_bind is not None and monotonic() >= self._fallback_until:
+            start = monotonic()
+            try:
+                allowed, tokens, retry_after = self._get_script(redis_bind)(
+                    keys=[key], args=[rate, burst, now, 1])
+            except Exception:
+                self._logger.warning('Redis rate limit failed, using the local buckets',
+                                     exc_info=True)
+                self._start_fallback()
+            else:
+                if monotonic() - start > self.redis_timeout:
+                    self._start_fallback()
+
+                return bool(allowed), float(tokens), float(retry_after)
+
+        return self.local_buckets.take(key, rate, burst, now)
+
+    def _start_fallback(self):
+        self.fallback_count += 1
+        self._fallback_until = monotonic() + self.fallback_period
+
+    def _get_script(self, redis_bind):
+        script = self._scripts.get(redis_bind)
+        if script is None:
+            script = self._scripts[redis_bind] = redis_bind.register_script(_TOKEN_BUCKET_SCRIPT)
+
+        return script
+
+    def _build_route_key(self, route):
+        return '{} {}'.format(route.method_name, route.uri_template)
+
+    def get_stats(self):
+        return {
+            'limited': self.limited_count,
+            'fallbacks': self.fallback_count,
+            'fallback': monotonic() < self._fallback_until
+        }
+
+
+RATE_LIMITER = RateLimiter()
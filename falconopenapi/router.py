@@ -23,25 +23,42 @@
 
 from falconopenapi.json_builder import JsonBuilder
 from falconopenapi.exceptions import ModelBaseError, JSONError
-from falconopenapi.hooks import authorization_hook
-from falconopenapi.utils import build_validator
+from falconopenapi.hooks import authorization_hook, async_authorization_hook, \
+    get_authorization_identity, SKIP_OPERATION
+from falconopenapi.utils import build_validator, etag_matches
+from falconopenapi.timing import NULL_TIMER
+from falconopenapi.cache import RESPONSE_CACHE
+from falconopenapi.rate_limit import RATE_LIMITER
 from collections import defaultdict, deque
 from jsonschema import RefResolver, Draft4Validator
-from falcon import HTTP_METHODS, HTTPMethodNotAllowed
+from falcon import HTTP_METHODS, HTTP_NOT_MODIFIED, HTTPMethodNotAllowed
 from copy import deepcopy
+from hashlib import sha1
+from inspect import isawaitable, iscoroutinefunction
+from time import perf_counter
 import re
 import os.path
+import asyncio
 import json
 
 
 DefaultDict = lambda: defaultdict(DefaultDict)
 
 
+def _copy_nodes(nodes):
+    nodes_copy = DefaultDict()
+    for key, value in nodes.items():
+        nodes_copy[key] = _copy_nodes(value) if isinstance(value, defaultdict) else value
+    return nodes_copy
+
+
 def _build_private_method_name(method_name):
         return '__{}__'.format(method_name)
 
 
 PRIVATE_METHODS_KEYS = set([_build_private_method_name(method) for method in HTTP_METHODS])
+_CACHE_INVALIDATION_METHODS = set(['POST', 'PUT', 'PATCH', 'DELETE'])
+_CACHE_HIT = object()
 
 
 class Route(object):
@@ -62,6 +79,28 @@ class Route(object):
         self._body_required = False
         self._has_body_parameter = False
         self._auth_required = False
+        self._is_async = None
+        self.extensions = {key: value for key, value in schema.items() if key.startswith('x-')}
+        self._cache_options = self.extensions.get('x-cache')
+        self._cache_tag = getattr(module, '__name__', type(module).__name__)
+        self._response_cache = None
+
+        if self._cache_options is not None or method_name in _CACHE_INVALIDATION_METHODS:
+            self._response_cache = getattr(module, '__response_cache__', None) or RESPONSE_CACHE
+            if self._cache_options is not None:
+                self._response_cache.register_tag(
+                    self._cache_tag, bool(self._cache_options.get('redis')))
+
+        self._rate_limiter = getattr(module, '__rate_limiter__', None)
+        if self._rate_limiter is None and 'x-rate-limit' in self.extensions:
+            self._rate_limiter = RATE_LIMITER
+
+        if self._rate_limiter is not None:
+            self._rate_limiter.discard(self)
+
+        self._before_hooks = ()
+        self._after_hooks = ()
+        self.compile_hooks()
 
         query_string_schema = self._build_default_schema()
         uri_template_schema = self._build_default_schema()
@@ -104,6 +143,19 @@ class Route(object):
 
             self._headers_validator = build_validator(headers_schema, self._schema_dir)
 
+    @property
+    def has_body_parameter(self):
+        return self._has_body_parameter
+
+    @property
+    def operation_name(self):
+        return self._operation_name
+
+    @property
+    def needs_session(self):
+        """ False for the operations with 'x-session: false' and without authorization """
+        return self._auth_required or self.extensions.get('x-session', True)
+
     def _build_default_schema(self):
         return {'type': 'object', 'required': [], 'properties': {}}
 
@@ -127,13 +179,242 @@ class Route(object):
         schema['properties'][name] = property_
 
     def __call__(self, req, resp, **kwargs):
+        timer = req.context.get('timer', NULL_TIMER)
+        authorization = None
+
+        if self._auth_required:
+            with timer.phase('auth'):
+                authorization = authorization_hook(self._authorizer, req, resp, kwargs)
+
+        if self._rate_limiter is not None:
+            self._check_rate_limit(req, authorization, timer)
+
+        cached = self._get_cached_response(req, resp, kwargs, timer)
+        if cached is _CACHE_HIT:
+            return
+
+        self._set_parameters(req, kwargs, timer)
+
+        with timer.phase('operation'):
+            if not self._before_hooks or self._run_hooks(self._before_hooks, req, resp, kwargs):
+                getattr(self.module, self._operation_name)(req, resp)
+
+            if self._after_hooks:
+                self._run_hooks(self._after_hooks, req, resp, kwargs)
+
+        self._update_response_cache(req, resp, cached)
+
+    async def call_async(self, req, resp, **kwargs):
+        timer = req.context.get('timer', NULL_TIMER)
+        authorization = None
+
         if self._auth_required:
-            authorization_hook(self._authorizer, req, resp, kwargs)
+            with timer.phase('auth'):
+                authorization = await async_authorization_hook(
+                    self._authorizer, req, resp, kwargs)
+
+        if self._rate_limiter is not None:
+            # the token bucket script is a blocking Redis call
+            await self._run_in_executor(self._check_rate_limit, req, authorization, timer)
+
+        # the Redis tier and the invalidation channel calls are blocking, so with them
+        # the response cache is read and updated on the executor; the memory tier is not
+        cache_in_executor = self._is_cache_blocking(req)
+        if cache_in_executor:
+            cached = await self._run_in_executor(
+                self._get_cached_response, req, resp, kwargs, timer)
+        else:
+            cached = self._get_cached_response(req, resp, kwargs, timer)
+
+        if cached is _CACHE_HIT:
+            return
+
+        self._set_parameters(req, kwargs, timer)
+
+        with timer.phase('operation'):
+            if not self._before_hooks or \
+                    await self._run_hooks_async(self._before_hooks, req, resp, kwargs):
+                result = getattr(self.module, self._operation_name)(req, resp)
+                if isawaitable(result):
+                    await result
+
+            if self._after_hooks:
+                await self._run_hooks_async(self._after_hooks, req, resp, kwargs)
+
+        if cache_in_executor:
+            await self._run_in_executor(self._update_response_cache, req, resp, cached)
+        else:
+            self._update_response_cache(req, resp, cached)
+
+    def _run_in_executor(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    @property
+    def is_async(self):
+        if self._is_async is None:
+            authorize = getattr(self._authorizer, 'authorize', None)
+            self._is_async = iscoroutinefunction(getattr(self.module, self._operation_name)) \
+                or (self._auth_required and iscoroutinefunction(authorize)) \
+                or any(iscoroutinefunction(hook)
+                       for hook, _ in self._before_hooks + self._after_hooks)
+
+        return self._is_async
+
+    def compile_hooks(self, operations=None):
+        """ Flattens the model and the operation hooks in one call sequence
+
+        Called when the route is built and again whenever a hook is registered on the model.
+        The per hook counters are reset. The `operations` defaults to the model ones.
+        """
+        if operations is None:
+            operations = getattr(self.module, '__operations__', ())
+
+        operation = getattr(self.module, self._operation_name)
+        operation_hooks = getattr(operation, '__hooks__', None) or {}
+        model_hooks = {}
+        if any(operation.operation_id == self._operation_name for operation in operations):
+            model_hooks = getattr(self.module, '__hooks__', None) or {}
+
+        self._before_hooks = tuple((hook, [0, 0.0]) for hook in
+            model_hooks.get('before', []) + operation_hooks.get('before', []))
+        self._after_hooks = tuple((hook, [0, 0.0]) for hook in
+            operation_hooks.get('after', []) + model_hooks.get('after', []))
+        self._is_async = None
+
+    def _run_hooks(self, hooks, req, resp, kwargs):
+        for hook, counter in hooks:
+            start = perf_counter()
+            try:
+                result = hook(req, resp, self.module, kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += perf_counter() - start
+
+            if result is SKIP_OPERATION:
+                return False
+
+        return True
+
+    async def _run_hooks_async(self, hooks, req, resp, kwargs):
+        for hook, counter in hooks:
+            start = perf_counter()
+            try:
+                result = hook(req, resp, self.module, kwargs)
+                if isawaitable(result):
+                    result = await result
+            finally:
+                counter[0] += 1
+                counter[1] += perf_counter() - start
+
+            if result is SKIP_OPERATION:
+                return False
+
+        return True
+
+    def get_hooks_stats(self):
+        """ Returns the calls and the seconds spent by each hook, counted without locking """
+        return [{
+            'stage': stage,
+            'hook': getattr(hook, '__qualname__', repr(hook)),
+            'calls': calls,
+            'seconds': seconds
+        } for stage, hooks in (('before', self._before_hooks), ('after', self._after_hooks))
+          for hook, (calls, seconds) in hooks]
+
+    def _check_rate_limit(self, req, authorization, timer):
+        session = req.context.get('session')
+        if authorization is None:
+            identity = req.remote_addr
+        else:
+            identity = get_authorization_identity(
+                self._authorizer, session, req.auth, authorization)
+
+        with timer.phase('rate_limit'):
+            self._rate_limiter.check(self, identity, getattr(session, 'redis_bind', None))
+
+    def _get_cache_redis_bind(self, req):
+        if self._cache_options is not None and not self._cache_options.get('redis'):
+            return None
+
+        return getattr(req.context.get('session'), 'redis_bind', None)
+
+    def _is_cache_blocking(self, req):
+        return self._response_cache is not None and (
+            self._response_cache.channel is not None
+            or self._get_cache_redis_bind(req) is not None)
+
+    def _get_cached_response(self, req, resp, kwargs, timer):
+        if self._cache_options is None:
+            return None
+
+        with timer.phase('cache'):
+            key = self._build_cache_key(req, kwargs)
+            generation = self._response_cache.get_generation(self._cache_tag)
+            response = self._response_cache.get(
+                self._cache_tag, key, self._get_cache_redis_bind(req))
+
+        if response is None:
+            return key, generation
+
+        status, headers, body = response
+        resp.status = status
+        etag = None
+        for name, value in headers:
+            resp.set_header(name, value)
+            if name.lower() == 'etag':
+                etag = value
+
+        resp.set_header('X-Cache', 'HIT')
+        if etag is not None and etag_matches(req.get_header('If-None-Match'), etag):
+            resp.status = HTTP_NOT_MODIFIED
+        else:
+            resp.data = body
+
+        return _CACHE_HIT
+
+    def _build_cache_key(self, req, kwargs):
+        query_string = req.params
+        key_params = self._cache_options.get('key_params')
+        if key_params is not None:
+            query_string = {name: query_string[name] for name in key_params if name in query_string}
+
+        vary = self._cache_options.get('vary', [])
+        if self._auth_required and 'Authorization' not in vary:
+            vary = list(vary) + ['Authorization']
+
+        key = json.dumps([kwargs, query_string, [req.get_header(name) for name in vary]],
+                         sort_keys=True, default=str)
+        return sha1(key.encode()).hexdigest()
+
+    def _update_response_cache(self, req, resp, cached):
+        if self._response_cache is None:
+            return
+
+        if cached is not None:
+            if resp.status[:3] == '200' and resp.stream is None:
+                body = resp.data if resp.data is not None else (resp.body or '').encode()
+                headers = [(name, value) for name, value in resp._headers.items()
+                           if name != 'set-cookie']
+                key, generation = cached
+                self._response_cache.set(
+                    self._cache_tag, key, (resp.status, headers, body),
+                    self._cache_options.get('ttl', 60), generation, self._get_cache_redis_bind(req))
+
+        elif resp.status[0] == '2' and self._response_cache.is_registered(self._cache_tag):
+            self._response_cache.invalidate(self._cache_tag, self._get_cache_redis_bind(req))
+
+    def _set_parameters(self, req, kwargs, timer):
+        with timer.phase('body'):
+            body_params = self._build_body_params(req)
+
+        with timer.phase('params'):
+            query_string_params = self._build_non_body_params(
+                self._query_string_validator, req.params)
+            uri_template_params = self._build_non_body_params(
+                self._uri_template_validator, kwargs)
+            headers_params = self._build_non_body_params(
+                self._headers_validator, req, 'headers')
 
-        body_params = self._build_body_params(req)
-        query_string_params = self._build_non_body_params(self._query_string_validator, req.params)
-        uri_template_params = self._build_non_body_params(self._uri_template_validator, kwargs)
-        headers_params = self._build_non_body_params(self._headers_validator, req, 'headers')
         req.context['parameters'] = {
             'query_string': query_string_params,
             'path': uri_template_params,
@@ -144,8 +425,6 @@ class Route(object):
         if self._body_validator:
             req.context['body_schema'] = self._body_validator.schema
 
-        getattr(self.module, self._operation_name)(req, resp)
-
     def _build_body_params(self, req):
         if req.content_length and (req.content_type is None or 'application/json' in req.content_type):
             if not self._has_body_parameter:
@@ -307,19 +586,29 @@ class ModelRouter(object):
     def __init__(self):
         self._nodes = DefaultDict()
 
+    def copy(self):
+        """ Returns a router with a copy of the nodes tree, sharing the `Route` objects """
+        router = type(self)()
+        router._nodes = _copy_nodes(self._nodes)
+        return router
+
+    def swap(self, router):
+        """ Serves the nodes tree of `router` from now on, with a single assignment """
+        self._nodes = router._nodes
+
     def add_model(self, model, base_path=''):
         for route in model.__routes__:
             self.add_route(route)
 
-    def add_route(self, route, base_path=''):
+    def add_route(self, route, base_path='', replace=False):
         uri_template = route.uri_template.strip('/')
         uri_template = base_path + uri_template
         uri_nodes = deque([UriNode(uri_node) for uri_node in uri_template.split('/')])
         nodes_tree = self._nodes
         while uri_nodes:
-            nodes_tree = self._set_node(nodes_tree, uri_nodes, route)
+            nodes_tree = self._set_node(nodes_tree, uri_nodes, route, replace)
 
-    def _set_node(self, nodes_tree, uri_nodes, route):
+    def _set_node(self, nodes_tree, uri_nodes, route, replace=False):
         node_uri_template = uri_nodes.popleft()
         self._raise_private_method_error(node_uri_template)
         private_method_name = _build_private_method_name(route.method_name)
@@ -328,7 +617,7 @@ class ModelRouter(object):
             last_node = nodes_tree[node_uri_template]
             route_ = last_node.get(private_method_name)
 
-            if route_:
+            if route_ and not replace:
                 raise ModelBaseError(
                     "Route with uri_template '{}' and method '{}' was alreadly registered"
                     .format(node_uri_template, route.method_name_))
@@ -430,4 +719,7 @@ class ModelRouter(object):
 
             if not method_map:
                 while nodes_tree_reverse:
-                    nodes_tree_reverse.pop().pop(path_nodes.pop())
+                    parent_node = nodes_tree_reverse.pop()
+                    parent_node.pop(path_nodes.pop())
+                    if parent_node:
+                        break
@@ -1,7 +1,7 @@
-from falcon.constants import HTTP_METHODS
 from falcon.routing import CompiledRouter, create_http_method_map
 from falconopenapi import OpenApiDefinition
 from falconopenapi.exceptions import OpenApiError
+from collections import defaultdict
 
 import importlib
 
@@ -16,8 +16,12 @@ class OpenApiRouter(CompiledRouter):
 
         self.definition = definition
         self.resources = dict()
+        self._paths_operations = defaultdict(list)
 
-        for path in definition.paths:
+        for operation in definition.operations.values():
+            self._paths_operations[operation.path].append(operation)
+
+        for path in self._paths_operations:
             self.add_route(path, self._lookup_resource(path))
         #check if file exists
         # read the Json or Yaml file
@@ -28,15 +32,8 @@ class OpenApiRouter(CompiledRouter):
         if path in self.resources:
             return self.resources[path]
 
-        resources = set()
-
         # find all resources for a given path which should be encoded in the operationId
-        for method in HTTP_METHODS:
-            if method.lower() in self.definition[path]:
-                if 'operationId' not in self.definition[path][method.lower()]:
-                    raise OpenApiError('Elemten operationId was not found for path: ' + path + " method: " + method.lower())
-                # set ignores duplicates
-                resources.add(self.definition[path][method.lower()]['operationId'])
+        resources = set([operation.operation_id for operation in self._paths_operations[path]])
 
         for resource in resources:
             package, obj = resource.rsplit('.', 1)
@@ -21,39 +21,98 @@
 # SOFTWARE.
 
 
-from falcon import API, HTTP_INTERNAL_SERVER_ERROR, HTTP_BAD_REQUEST, HTTPError, HTTPNotFound
-from falconopenapi.middlewares import SessionMiddleware
+from falcon import API, Request, HTTP_INTERNAL_SERVER_ERROR, HTTP_BAD_REQUEST, HTTP_NOT_MODIFIED, \
+    HTTPError, HTTPNotFound
+from falconopenapi.middlewares import SessionMiddleware, MetricsMiddleware, TimingMiddleware, \
+    ProfilerMiddleware, AdmissionMiddleware, RequestContext
+from falconopenapi.metrics import RouteMetrics, DEFAULT_BUCKETS, PROMETHEUS_CONTENT_TYPE
 from falconopenapi.router import ModelRouter, Route
-from falconopenapi.exceptions import JSONError, ModelBaseError, UnauthorizedError, SwaggerAPIError
+from falconopenapi.exceptions import JSONError, ModelBaseError, UnauthorizedError, SwaggerAPIError, \
+    ServiceUnavailableError, TooManyRequestsError
 from falconopenapi.mixins import LoggerMixin
-from falconopenapi.utils import get_module_path
+from falconopenapi.utils import get_module_path, etag_matches, accepts_encoding
 from falconopenapi.constants import SWAGGER_TEMPLATE, SWAGGER_SCHEMA
+from falconopenapi.profiling import STARTUP_PROFILER
+from falconopenapi.timing import NULL_TIMER
 from sqlalchemy.exc import IntegrityError
 from jsonschema import Draft4Validator
 from jsonschema import ValidationError
 from copy import deepcopy
+from threading import Lock
+from hashlib import sha1
+from io import BytesIO
+import gzip
 import logging
 import json
 import re
 
 
+_DEFINITIONS_REF_REGEX = re.compile(r'#/definitions/([a-zA-Z0-9_]+)$')
+
+
+def _namespace_definitions_refs(value, namespace):
+    if isinstance(value, dict):
+        return {key: _namespace_definitions_refs(item, namespace) for key, item in value.items()}
+
+    elif isinstance(value, list):
+        return [_namespace_definitions_refs(item, namespace) for item in value]
+
+    elif isinstance(value, str) and value.startswith('#/definitions/'):
+        match = _DEFINITIONS_REF_REGEX.match(value)
+        if match:
+            return '#/definitions/{}.{}'.format(namespace, match.group(1))
+
+    return value
+
+
+class SwaggerRequest(Request):
+    __slots__ = ()
+    context_type = RequestContext
+
+
 class SwaggerAPI(API, LoggerMixin):
 
     def __init__(self, models, sqlalchemy_bind=None, redis_bind=None,
                  middleware=None, router=None, swagger_template=None,
-                 title=None, version='1.0.0', authorizer=None):
+                 title=None, version='1.0.0', authorizer=None,
+                 swagger_cache_control='no-cache', swagger_gzip=False,
+                 metrics=False, metrics_path='/metrics', metrics_buckets=DEFAULT_BUCKETS,
+                 timing=False, timing_sample_rate=1.0, timing_log=False,
+                 profiler=None, profiler_path='/_debug/profiles', admission=None,
+                 redis_write_behind=None, redis_chunk_size=500, related_batch_size=500,
+                 related_max_depth=None):
+        self.redis_write_behind = redis_write_behind
         if sqlalchemy_bind is not None or redis_bind is not None:
-            sess_mid = SessionMiddleware(sqlalchemy_bind, redis_bind)
+            sess_mid = self._build_session_middleware(
+                sqlalchemy_bind, redis_bind, redis_write_behind, redis_chunk_size,
+                related_batch_size, related_max_depth)
 
             if middleware is None:
                 middleware = sess_mid
             else:
                 middleware.append(sess_mid)
 
+        self.admission = admission
+        if admission is not None:
+            middleware = self._prepend_middleware(middleware, AdmissionMiddleware(admission))
+
+        if timing:
+            middleware = self._prepend_middleware(
+                middleware, TimingMiddleware(timing_sample_rate, timing_log))
+
+        self.profiler = profiler
+        if profiler is not None:
+            middleware = self._prepend_middleware(middleware, ProfilerMiddleware(profiler))
+
+        self.metrics = None
+        if metrics:
+            self.metrics = RouteMetrics(metrics_buckets)
+            middleware = self._prepend_middleware(middleware, MetricsMiddleware(self.metrics))
+
         if router is None:
             router = ModelRouter()
 
-        API.__init__(self, router=router, middleware=middleware)
+        API.__init__(self, request_type=SwaggerRequest, router=router, middleware=middleware)
         self._build_logger()
 
         type(self).__schema_dir__ = get_module_path(type(self))
@@ -70,14 +129,24 @@ class SwaggerAPI(API, LoggerMixin):
 
         self._logger = logging.getLogger(type(self).__module__ + '.' + type(self).__name__)
         self.models = dict()
+        self._paths_models = dict()
+        self._reload_lock = Lock()
+        self._swagger_json_cache = dict()
+        self._swagger_cache_control = swagger_cache_control
+        self._swagger_gzip = swagger_gzip
         self.add_route = None
         del self.add_route
 
-        for model in models:
-            self.associate_model(model)
+        self.associate_models(models)
 
         self._set_swagger_json_route(authorizer)
 
+        if self.metrics is not None:
+            self._set_metrics_route(metrics_path, authorizer)
+
+        if self.profiler is not None:
+            self._set_profiles_route(profiler_path, authorizer)
+
         self.add_error_handler(Exception, self._handle_generic_error)
         self.add_error_handler(HTTPError, self._handle_http_error)
         self.add_error_handler(IntegrityError, self._handle_integrity_error)
@@ -86,6 +155,26 @@ class SwaggerAPI(API, LoggerMixin):
         self.add_error_handler(JSONError)
         self.add_error_handler(ModelBaseError)
         self.add_error_handler(UnauthorizedError)
+        self.add_error_handler(ServiceUnavailableError)
+        self.add_error_handler(TooManyRequestsError)
+
+    def _build_session_middleware(self, sqlalchemy_bind, redis_bind, redis_write_behind=None,
+                                  redis_chunk_size=500, related_batch_size=500,
+                                  related_max_depth=None):
+        return SessionMiddleware(
+            sqlalchemy_bind, redis_bind, redis_write_behind=redis_write_behind,
+            redis_chunk_size=redis_chunk_size, related_batch_size=related_batch_size,
+            related_max_depth=related_max_depth)
+
+    @staticmethod
+    def _prepend_middleware(middleware, new_middleware):
+        # the first middleware sees the request first and the response last
+        if middleware is None:
+            return [new_middleware]
+        elif isinstance(middleware, (list, tuple)):
+            return [new_middleware] + list(middleware)
+        else:
+            return [new_middleware, middleware]
 
     def _set_swagger_template(self, swagger_template, title, version):
         if swagger_template is None:
@@ -104,87 +193,250 @@ class SwaggerAPI(API, LoggerMixin):
         self.swagger['definitions'] = definitions
 
     def associate_model(self, model):
-        if hasattr(model, '__schema__'):
-            if model.__api__ is not self:
+        self.associate_models([model])
+
+    def associate_models(self, models):
+        """ Associates many models at once
+
+        The duplicated paths are checked against an index of the paths already served and
+        the swagger 'paths' and 'definitions' are updated once for the whole batch.
+        """
+        models = [model for model in models
+                  if hasattr(model, '__schema__') and model.__api__ is not self]
+        batch_paths_models = dict()
+
+        for model in models:
+            for path in model.__schema__:
+                if path == 'definitions':
+                    continue
+
+                other_model = batch_paths_models.get(path, self._paths_models.get(path))
+                if other_model is not None and other_model is not model:
+                    raise SwaggerAPIError("Duplicated path '{}' for models '{}' and '{}'".format(
+                        path, model.__name__, other_model.__name__))
+
+                batch_paths_models[path] = model
+
+        base_path = self.swagger.get('basePath', '')
+        base_path = '' if base_path == '/' else base_path
+        paths = dict()
+        definitions = dict()
+
+        for model in models:
+            with STARTUP_PROFILER.phase('associate_model', model.__name__):
                 if isinstance(model.__api__, SwaggerAPI):
                     model.__api__.disassociate_model(model)
 
-                base_path = self.swagger.get('basePath', '')
-                base_path = '' if base_path == '/' else base_path
-
                 self._router.add_model(model, base_path)
                 self.models[model.__key__] = model
                 model.__api__ = self
 
-                model_paths = deepcopy(model.__schema__)
-                definitions = {}
+                model_paths, model_definitions = self._build_model_swagger(model)
+                paths.update(model_paths)
+                definitions.update(model_definitions)
+
+        if models:
+            self._paths_models.update(batch_paths_models)
+            self.swagger['paths'].update(paths)
+            self.swagger['definitions'].update(definitions)
+            self._invalidate_swagger_json()
+
+    def _build_model_swagger(self, model):
+        with STARTUP_PROFILER.phase('swagger_namespace', model.__name__):
+            model_name = model.__name__
+            model_paths = {path: _namespace_definitions_refs(path_item, model_name) \
+                for path, path_item in model.__schema__.items() if path != 'definitions'}
+            definitions = {'{}.{}'.format(model_name, definition): \
+                    _namespace_definitions_refs(values, model_name) \
+                for definition, values in model.__schema__.get('definitions', {}).items()}
+
+            for operation in model.__operations__:
+                method = model_paths[operation.path][operation.method.lower()]
+                method['operationId'] = '{}.{}'.format(model_name, operation.operation_id)
+
+        return model_paths, definitions
+
+    def reload_model(self, model, schema):
+        self.reload_models({model: schema})
+
+    def reload_models(self, models_schemas):
+        """ Replaces the schemas of associated models without rebuilding unchanged routes
+
+        Each new schema is diffed per path and method against the current one: only the
+        routes of added or changed operations are built. They are set in a copy of the
+        router nodes tree, which replaces the served one with a single assignment once
+        everything was built, so a failure leaves the model and the router untouched.
+        """
+        with self._reload_lock:
+            for model, schema in models_schemas.items():
+                self._reload_model(model, schema)
+
+    def _reload_model(self, model, schema):
+        if model.__api__ is not self:
+            raise SwaggerAPIError("Model '{}' is not associated with this API".format(model.__name__))
+
+        for path in schema:
+            other_model = self._paths_models.get(path)
+            if other_model is not None and other_model is not model:
+                raise SwaggerAPIError("Duplicated path '{}' for models '{}' and '{}'".format(
+                    path, model.__name__, other_model.__name__))
 
-                for definition, values in model_paths.pop('definitions', {}).items():
-                    definitions['{}.{}'.format(model.__name__, definition)] = values
+        old_schema = model.__schema__
+        attributes, new_routes, removed_routes = model.prepare_reload_schema(schema)
+        new_routes_keys = set([(route.uri_template, route.method_name) for route in new_routes])
+        router = self._router.copy()
 
-                for path in model_paths.values():
-                    for method in path.values():
-                        if not isinstance(method, list):
-                            opId = method['operationId']
-                            method['operationId'] = '{}.{}'.format(model.__name__, opId)
+        for route in new_routes:
+            router.add_route(route, replace=True)
 
-                self._validate_model_paths(model_paths, model.__name__)
-                json_paths = json.dumps(model_paths)
-                json_paths = re.sub(r'"#/definitions/([a-zA-Z0-9_]+)"',
-                        r'"#/definitions/{}.\1"'.format(model.__name__),
-                        json_paths)
-                model_paths = json.loads(json_paths)
+        for route in removed_routes:
+            if (route.uri_template, route.method_name) not in new_routes_keys:
+                router.remove_route(route)
 
-                self.swagger['paths'].update(model_paths)
-                self.swagger['definitions'].update(definitions)
+        model.commit_reload_schema(attributes)
+        self._router.swap(router)
+
+        if self.admission is not None:
+            for route in new_routes:
+                self.admission.discard(route)
+
+        self._remove_model_swagger(model, old_schema)
+        model_paths, definitions = self._build_model_swagger(model)
+        self._paths_models.update({path: model for path in model_paths})
+        self.swagger['paths'].update(model_paths)
+        self.swagger['definitions'].update(definitions)
+        self._invalidate_swagger_json()
 
     def disassociate_model(self, model):
         if hasattr(model, '__schema__'):
             if model.__api__ is self:
                 self._router.remove_model(model)
                 self.models.pop(model.__key__)
-                [self.swagger['paths'].pop(path, None) for path in model.__schema__]
+                self._remove_model_swagger(model, model.__schema__)
+                self._invalidate_swagger_json()
 
-                for definition in model.__schema__.get('definitions', {}):
-                    self.swagger['definitions'].pop('{}.{}'.format(model.__name__, definition))
-
-    def _validate_model_paths(self, model_paths, model_name):
-        for path in model_paths:
-            if path in self.swagger['paths']:
-                raise SwaggerAPIError("Duplicated path '{}' for models '{}' and '{}'".format(
-                    path, model_name, self._get_duplicated_path_model_name(path)))
+    def _remove_model_swagger(self, model, schema):
+        for path in schema:
+            self.swagger['paths'].pop(path, None)
+            self._paths_models.pop(path, None)
 
-    def _get_duplicated_path_model_name(self, path):
-        models_repeated_paths = []
-        for model in self.models.values():
-            if path in model.__schema__:
-                return model.__name__
+        for definition in schema.get('definitions', {}):
+            self.swagger['definitions'].pop('{}.{}'.format(model.__name__, definition))
 
     def _set_swagger_json_route(self, authorizer):
-        if authorizer:
-            schema = {
-                'parameters': [{
-                    'name': 'Authorization',
-                    'in': 'header',
-                    'required': True,
-                    'type': 'string'
-                }]
-            }
-        else:
-            schema = {}
-
+        schema = self._build_internal_route_schema(authorizer, [{
+            'name': 'compact',
+            'in': 'query',
+            'type': 'boolean'
+        }])
         self._swagger_route = Route('/swagger.json', 'GET', '_get_swagger_json',
                       self, schema, [], authorizer)
-        self._router.add_route(self._swagger_route, self.swagger.get('basePath', ''))
+        self._add_internal_route(self._swagger_route)
 
     def _get_swagger_json(self, req, resp):
-        resp.body = json.dumps(self.swagger, indent=2)
+        compact = bool(req.context['parameters']['query_string'].get('compact'))
+        gzipped = self._swagger_gzip and accepts_encoding(req.get_header('Accept-Encoding'), 'gzip')
+        body, etag = self._get_swagger_json_variant(compact, gzipped)
+
+        resp.set_header('ETag', etag)
+        resp.set_header('Cache-Control', self._swagger_cache_control)
+        if self._swagger_gzip:
+            resp.set_header('Vary', 'Accept-Encoding')
+
+        if etag_matches(req.get_header('If-None-Match'), etag):
+            resp.status = HTTP_NOT_MODIFIED
+            return
+
+        if gzipped:
+            resp.set_header('Content-Encoding', 'gzip')
+
+        resp.data = body
+
+    def _get_swagger_json_variant(self, compact, gzipped):
+        cache = self._swagger_json_cache
+        variant = cache.get((compact, gzipped))
+        if variant is not None:
+            return variant
+
+        if gzipped:
+            body, etag = self._get_swagger_json_variant(compact, False)
+            buffer_ = BytesIO()
+            with gzip.GzipFile(fileobj=buffer_, mode='wb', mtime=0) as gzip_file:
+                gzip_file.write(body)
+            variant = (buffer_.getvalue(), etag[:-1] + '-gzip"')
+
+        else:
+            if compact:
+                body = json.dumps(self.swagger, separators=(',', ':')).encode()
+            else:
+                body = json.dumps(self.swagger, indent=2).encode()
+
+            etag = '"{}-{}"'.format(sha1(body).hexdigest(), 'compact' if compact else 'pretty')
+            variant = (body, etag)
+
+        cache[(compact, gzipped)] = variant
+        return variant
+
+    def _invalidate_swagger_json(self):
+        self._swagger_json_cache = dict()
+
+    def _add_internal_route(self, route):
+        self._router.add_route(route, self.swagger.get('basePath', ''))
+
+        # the API own routes must keep answering under overload
+        if self.admission is not None:
+            self.admission.exempt(route)
+
+    def _build_internal_route_schema(self, authorizer, parameters=None):
+        parameters = [] if parameters is None else parameters
+
+        if authorizer:
+            parameters.append({
+                'name': 'Authorization',
+                'in': 'header',
+                'required': True,
+                'type': 'string'
+            })
+
+        return {'parameters': parameters, 'x-session': False}
+
+    def _set_metrics_route(self, metrics_path, authorizer):
+        schema = self._build_internal_route_schema(authorizer)
+        self._metrics_route = Route(metrics_path, 'GET', '_get_metrics',
+                                    self, schema, [], authorizer)
+        self._add_internal_route(self._metrics_route)
+
+    def _get_metrics(self, req, resp):
+        resp.content_type = PROMETHEUS_CONTENT_TYPE
+        resp.data = self.metrics.get_prometheus_text().encode()
+
+    def _set_profiles_route(self, profiler_path, authorizer):
+        schema = self._build_internal_route_schema(authorizer, [{
+            'name': 'format',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['collapsed', 'json']
+        }])
+        self._profiles_route = Route(profiler_path, 'GET', '_get_profiles',
+                                     self, schema, [], authorizer)
+        self._add_internal_route(self._profiles_route)
+
+    def _get_profiles(self, req, resp):
+        if req.context['parameters']['query_string'].get('format') == 'json':
+            resp.body = json.dumps(self.profiler.get_profiles())
+        else:
+            resp.content_type = 'text/plain; charset=utf-8'
+            resp.data = self.profiler.get_collapsed_stacks().encode()
 
     def _get_responder(self, req):
-        route, params = self._router.get_route_and_params(req)
+        with req.context.get('timer', NULL_TIMER).phase('routing'):
+            route, params = self._router.get_route_and_params(req)
+
         if route is None:
             return self._get_sink_responder(req)
 
+        req.context['route'] = route
+
         return route, params, route.module, route.uri_template
 
     def _get_sink_responder(self, path):
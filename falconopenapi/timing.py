@@ -0,0 +1,99 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import OrderedDict
+from time import perf_counter
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    __slots__ = ['_phases', '_name', '_start']
+
+    def __init__(self, phases, name):
+        self._phases = phases
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._phases[self._name] = self._phases.get(self._name, 0.0) + \
+            perf_counter() - self._start
+        return False
+
+
+class RequestTimer(object):
+    """ Accumulates the monotonic duration of the phases of one request
+
+    A phase entered many times (like 'sql' or 'redis') is summed up. The 'operation' phase
+    is inclusive: it contains the ORM and serialization phases run by the operation. The
+    counters (like 'redis_round_trips') are reported along with the phases.
+    """
+    __slots__ = ['start', 'phases', 'counters']
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    def phase(self, name):
+        return _Phase(self.phases, name)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_total(self):
+        return perf_counter() - self.start
+
+    def get_server_timing(self, total=None):
+        total = self.get_total() if total is None else total
+        metrics = ['{};dur={:.3f}'.format(name, seconds * 1000)
+                   for name, seconds in self.phases.items()]
+        metrics.extend('{};desc="{}"'.format(name, value) for name, value in self.counters.items())
+        metrics.append('total;dur={:.3f}'.format(total * 1000))
+        return ', '.join(metrics)
+
+
+class _NullTimer(object):
+    __slots__ = []
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_TIMER = _NullTimer()
@@ -1,9 +1,18 @@
 from jsonschema import Draft4Validator, RefResolver
+from collections import namedtuple
+from hashlib import sha1
 import os.path
 import json
 import sys
 
 
+OPERATION_METHODS = ('get', 'put', 'post', 'delete', 'options', 'head', 'patch', 'trace')
+
+
+Operation = namedtuple(
+    'Operation', ['operation_id', 'path', 'method', 'parameters', 'security', 'tags', 'schema'])
+
+
 def build_validator(schema, path):
     handlers = {'': _URISchemaHandler(path)}
     resolver = RefResolver.from_schema(schema, handlers=handlers)
@@ -21,6 +30,44 @@ class _URISchemaHandler(object):
             return json.load(json_schema_file)
 
 
+def build_etag(chunks):
+    hash_ = sha1()
+    for chunk in chunks:
+        hash_.update(chunk)
+
+    return '"{}"'.format(hash_.hexdigest())
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+
+        if candidate == etag:
+            return True
+
+    return False
+
+
+def accepts_encoding(accept_encoding, encoding):
+    if not accept_encoding:
+        return False
+
+    for value in accept_encoding.split(','):
+        name, _, params = value.partition(';')
+        if name.strip().lower() == encoding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+
+    return False
+
+
 def get_dir_path(filename):
     return os.path.dirname(os.path.abspath(filename))
 
@@ -28,3 +75,40 @@ def get_dir_path(filename):
 def get_module_path(cls):
     module_filename = sys.modules[cls.__module__].__file__
     return get_dir_path(module_filename)
+
+
+def iter_operations(paths, security=None):
+    """ Yields one `Operation` per path and method of an OpenAPI/Swagger 'paths' object
+
+    The path level parameters are merged into the operation parameters here, once,
+    with the operation level ones taking precedence as the specification says.
+    """
+    for path, path_item in paths.items():
+        if not path.startswith('/'):
+            continue
+
+        path_parameters = path_item.get('parameters', [])
+        for method in OPERATION_METHODS:
+            operation = path_item.get(method)
+            if operation is None:
+                continue
+
+            yield Operation(
+                operation.get('operationId'), path, method.upper(),
+                merge_parameters(path_parameters, operation.get('parameters', [])),
+                operation.get('security', security),
+                tuple(operation.get('tags', [])),
+                operation)
+
+
+def merge_parameters(path_parameters, operation_parameters):
+    keys = set([_build_parameter_key(parameter) for parameter in operation_parameters])
+    return list(operation_parameters) + \
+        [parameter for parameter in path_parameters if _build_parameter_key(parameter) not in keys]
+
+
+def _build_parameter_key(parameter):
+    if '$ref' in parameter:
+        return parameter['$ref']
+
+    return (parameter.get('name'), parameter.get('in'))
@@ -30,7 +30,12 @@ import json
 
 
 @pytest.fixture
-def app():
+def redis_bind():
+    return FakeStrictRedis()
+
+
+@pytest.fixture
+def app(redis_bind):
     schema = {
         '/test': {
             'parameters': [{
@@ -62,7 +67,16 @@ def app():
             },
             'get': {
                 'operationId': 'get_by_body',
-                'responses': {'200': {'description': 'Got'}}
+                'responses': {'200': {'description': 'Got'}},
+                'parameters': [{
+                    'name': 'limit',
+                    'in': 'query',
+                    'type': 'integer'
+                }, {
+                    'name': 'cursor',
+                    'in': 'query',
+                    'type': 'string'
+                }]
             },
         },
         '/test/{id}': {
@@ -120,7 +134,7 @@ def app():
         }
     }
     return SwaggerAPI([ModelRedisFactory.make('TestModel', 'test', ['id'], schema)],
-                      redis_bind=FakeStrictRedis(), title='Test API')
+                      redis_bind=redis_bind, title='Test API')
 
 
 class TestModelRedisPost(object):
@@ -168,3 +182,43 @@ class TestModelRedisPost(object):
         }
         resp = client.put('/test/1/', body=json.dumps(body))
         assert json.loads(resp.body) == body
+
+
+class TestModelRedisGetPages(object):
+    def test_get_pages(self, client):
+        bodies = [{'id': i, 'field1': 'test', 'field2': {'fid': '1'}} for i in range(1, 4)]
+        for body in bodies:
+            client.post('/test', body=json.dumps(body))
+
+        resp = client.get('/test', query_string='limit=2')
+        assert json.loads(resp.body) == bodies[:2]
+
+        resp = client.get(
+            '/test', query_string='limit=2&cursor=' + resp.headers['X-Next-Cursor'])
+        assert json.loads(resp.body) == bodies[2:]
+        assert 'X-Next-Cursor' not in resp.headers
+
+    def test_get_pages_skip_deleted_objects(self, client):
+        bodies = [{'id': i, 'field1': 'test', 'field2': {'fid': '1'}} for i in range(1, 4)]
+        for body in bodies:
+            client.post('/test', body=json.dumps(body))
+        resp = client.get('/test', query_string='limit=1')
+        client.delete('/test/2/')
+
+        resp = client.get(
+            '/test', query_string='limit=1&cursor=' + resp.headers['X-Next-Cursor'])
+        assert json.loads(resp.body) == bodies[2:]
+
+    def test_get_pages_without_index(self, client, redis_bind):
+        bodies = [{'id': i, 'field1': 'test', 'field2': {'fid': '1'}} for i in range(1, 4)]
+        for body in bodies:
+            client.post('/test', body=json.dumps(body))
+        redis_bind.delete('test_index')
+
+        resp = client.get('/test', query_string='limit=2')
+        assert json.loads(resp.body) == bodies[:2]
+        assert redis_bind.zcard('test_index') == 3
+
+    def test_get_with_invalid_cursor(self, client):
+        resp = client.get('/test', query_string='cursor=a')
+        assert resp.status_code == 400
@@ -0,0 +1,297 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.asgi import SwaggerAsgiAPI, build_environ
+from falconopenapi.admission import AdmissionController
+from falconopenapi.middlewares import SessionMiddleware
+from falconopenapi.hooks import Authorizer, before_operation, after_operation, SKIP_OPERATION
+from unittest import mock
+
+import pytest
+import asyncio
+import threading
+import json
+import sqlalchemy as sa
+
+
+async def skip_unless_header(req, resp, cls, params):
+    await asyncio.sleep(0)
+    if req.get_header('X-Run') is None:
+        resp.body = json.dumps({'skipped': True})
+        return SKIP_OPERATION
+
+
+async def set_hooked_header(req, resp, cls, params):
+    await asyncio.sleep(0)
+    resp.set_header('X-Hooked', 'true')
+
+
+@pytest.fixture
+def model(model_base):
+    class MyAuth(Authorizer):
+        async def authorize(self, session, auth_token, uri, path, method):
+            await asyncio.sleep(0)
+            if auth_token == '1':
+                return True
+
+    class model(model_base):
+        __authorizer__ = MyAuth('test')
+        __tablename__ = 'model'
+        id = sa.Column(sa.Integer, primary_key=True)
+        __schema__ = {
+            '/async/{id}': {
+                'get': {
+                    'operationId': 'get_async',
+                    'parameters': [{
+                        'name': 'id',
+                        'in': 'path',
+                        'required': True,
+                        'type': 'integer'
+                    }],
+                    'responses': {'200': {'description': 'test'}}
+                }
+            },
+            '/sync': {
+                'get': {
+                    'operationId': 'get_sync',
+                    'responses': {'200': {'description': 'test'}}
+                }
+            },
+            '/hooked': {
+                'get': {
+                    'operationId': 'get_hooked',
+                    'responses': {'200': {'description': 'test'}}
+                }
+            },
+            '/auth': {
+                'get': {
+                    'operationId': 'get_sync',
+                    'parameters': [{
+                        'name': 'Authorization',
+                        'in': 'header',
+                        'required': True,
+                        'type': 'string'
+                    }],
+                    'responses': {'200': {'description': 'test'}}
+                }
+            }
+        }
+
+        @classmethod
+        async def get_async(cls, req, resp, **kwargs):
+            await asyncio.sleep(0)
+            resp.body = json.dumps(req.context['parameters']['path'])
+
+        @classmethod
+        def get_sync(cls, req, resp, **kwargs):
+            resp.body = json.dumps({'sync': True})
+
+        @before_operation(skip_unless_header)
+        @after_operation(set_hooked_header)
+        @classmethod
+        def get_hooked(cls, req, resp, **kwargs):
+            resp.body = json.dumps({'hooked': True})
+
+    return model
+
+
+@pytest.fixture
+def app(model):
+    return SwaggerAsgiAPI({model}, sqlalchemy_bind=mock.MagicMock(), title='Test API',
+                          executor_workers=2)
+
+
+def request(app, path, headers=None):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(request_async(app, path, headers))
+    finally:
+        loop.close()
+
+
+async def request_async(app, path, headers=None):
+    messages = []
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': b'',
+        'headers': [(name.lower().encode(), value.encode())
+                    for name, value in (headers or {}).items()]
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]['status'], dict(messages[0]['headers']), messages[1]['body']
+
+
+class TestSwaggerAsgiAPI(object):
+
+    def test_async_operation(self, app):
+        status, _, body = request(app, '/async/1')
+
+        assert status == 200
+        assert json.loads(body.decode()) == {'id': 1}
+
+    def test_sync_operation(self, app):
+        status, _, body = request(app, '/sync')
+
+        assert status == 200
+        assert json.loads(body.decode()) == {'sync': True}
+
+    def test_not_found(self, app):
+        status, _, _ = request(app, '/invalid')
+
+        assert status == 404
+
+    def test_async_authorizer_with_valid_authorization(self, app):
+        status, _, body = request(app, '/auth', {'Authorization': '1'})
+
+        assert status == 200
+
+    def test_async_authorizer_with_invalid_authorization(self, app):
+        status, headers, body = request(app, '/auth', {'Authorization': '2'})
+
+        assert status == 401
+        assert headers[b'www-authenticate'] == b'Basic realm="test"'
+        assert json.loads(body.decode()) == {'error': 'Invalid authorization'}
+
+
+    def test_async_hooks(self, app):
+        status, headers, body = request(app, '/hooked', {'X-Run': '1'})
+
+        assert status == 200
+        assert headers[b'x-hooked'] == b'true'
+        assert json.loads(body.decode()) == {'hooked': True}
+
+    def test_async_hook_skips_operation(self, app):
+        status, headers, body = request(app, '/hooked')
+
+        assert headers[b'x-hooked'] == b'true'
+        assert json.loads(body.decode()) == {'skipped': True}
+
+    @pytest.mark.parametrize('path', ['/async/1', '/sync'])
+    def test_routes_once(self, app, path):
+        get_route_and_params = app._router.get_route_and_params
+        with mock.patch.object(app._router, 'get_route_and_params',
+                               side_effect=get_route_and_params) as routing:
+            status, _, _ = request(app, path)
+
+        assert status == 200
+        assert routing.call_count == 1
+
+    def test_async_operation_is_not_profiled(self, model):
+        profiler = mock.MagicMock()
+        profiler.start.return_value = None
+        app = SwaggerAsgiAPI({model}, sqlalchemy_bind=mock.MagicMock(), title='Test API',
+                             profiler=profiler)
+
+        request(app, '/async/1')
+        assert not profiler.start.called
+
+        request(app, '/sync')
+        assert profiler.start.call_count == 1
+
+    def test_async_operations_queued_by_admission(self, model):
+        admission = AdmissionController(max_concurrency=1, max_queue=2, timeout=5.0)
+        app = SwaggerAsgiAPI({model}, sqlalchemy_bind=mock.MagicMock(), title='Test API',
+                             admission=admission)
+
+        async def requests():
+            return await asyncio.gather(*[request_async(app, '/async/{}'.format(id_))
+                                          for id_ in range(3)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            responses = loop.run_until_complete(requests())
+        finally:
+            loop.close()
+
+        assert [status for status, _, _ in responses] == [200, 200, 200]
+        assert admission.get_stats()['global']['queued'] == 2
+        assert admission.get_stats()['global']['in_flight'] == 0
+
+    def test_rate_limit_checked_off_the_event_loop(self, model):
+        threads = []
+        rate_limiter = mock.MagicMock()
+        rate_limiter.check.side_effect = lambda *args: threads.append(threading.get_ident())
+        for route in model.__routes__:
+            route._rate_limiter = rate_limiter
+        app = SwaggerAsgiAPI({model}, sqlalchemy_bind=mock.MagicMock(), title='Test API')
+
+        status, _, _ = request(app, '/async/1')
+
+        assert status == 200
+        assert len(threads) == 1
+        assert threads[0] != threading.get_ident()
+
+    def test_redis_response_cache_used_off_the_event_loop(self, model):
+        threads = []
+        response_cache = mock.MagicMock(channel=None)
+        response_cache.get.side_effect = lambda *args: threads.append(threading.get_ident())
+        response_cache.set.side_effect = lambda *args: threads.append(threading.get_ident())
+        for route in model.__routes__:
+            route._cache_options = {'redis': True}
+            route._response_cache = response_cache
+        app = SwaggerAsgiAPI({model}, sqlalchemy_bind=mock.MagicMock(),
+                             redis_bind=mock.MagicMock(), title='Test API')
+
+        status, _, _ = request(app, '/async/1')
+
+        assert status == 200
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+
+    def test_session_options(self, model):
+        with mock.patch('falconopenapi.asgi.SessionMiddleware',
+                        side_effect=SessionMiddleware) as middleware:
+            SwaggerAsgiAPI({model}, sqlalchemy_bind=mock.MagicMock(), title='Test API',
+                           redis_chunk_size=100, related_batch_size=50, related_max_depth=2)
+
+        assert middleware.call_args[1]['redis_chunk_size'] == 100
+        assert middleware.call_args[1]['related_batch_size'] == 50
+        assert middleware.call_args[1]['related_max_depth'] == 2
+
+
+class TestBuildEnviron(object):
+
+    def test_build_environ(self):
+        environ = build_environ({
+            'method': 'POST',
+            'path': '/test',
+            'query_string': b'a=1',
+            'headers': [(b'content-type', b'application/json'), (b'x-test', b'1'),
+                        (b'x-test', b'2')]
+        }, b'{}')
+
+        assert environ['REQUEST_METHOD'] == 'POST'
+        assert environ['PATH_INFO'] == '/test'
+        assert environ['QUERY_STRING'] == 'a=1'
+        assert environ['CONTENT_TYPE'] == 'application/json'
+        assert environ['HTTP_X_TEST'] == '1,2'
+        assert environ['wsgi.input'].read() == b'{}'
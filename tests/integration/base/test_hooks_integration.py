@@ -21,13 +21,20 @@
 # SOFTWARE.
 
 
-from falconopenapi.hooks import authorization_hook, Authorizer
+from falconopenapi.hooks import authorization_hook, Authorizer, SharedCachingAuthorizer, \
+    before_operation, after_operation, SKIP_OPERATION
+from falconopenapi.pubsub import InvalidationChannel
 from falconopenapi.swagger_api import SwaggerAPI
+from falconopenapi.rate_limit import RateLimiter
 from falcon import before as falcon_before
+from fakeredis import FakeStrictRedis
 from unittest import mock
+from time import sleep
 
 
 import pytest
+import asyncio
+import threading
 import json
 import sqlalchemy as sa
 
@@ -105,3 +112,254 @@ class TestAuthorizationHook(object):
         assert resp.status_code == 200
         assert resp.headers.get('WWW-Authenticate') == None
         assert resp.body == ''
+
+
+@pytest.fixture
+def limited_model(model_base):
+    class MyAuth(Authorizer):
+        def authorize(self, session, auth_token, uri, path, method):
+            return {'1': 'account1', '2': 'account1', '3': 'account2'}.get(auth_token)
+
+    class limited_model(model_base):
+        __authorizer__ = MyAuth('test')
+        __rate_limiter__ = RateLimiter()
+        __tablename__ = 'limited_model'
+        id = sa.Column(sa.Integer, primary_key=True)
+        __schema__ = {
+            '/': {
+                'parameters': [{
+                    'name': 'Authorization',
+                    'in': 'header',
+                    'required': True,
+                    'type': 'string'
+                }],
+                'get': {
+                    'operationId': 'get_test',
+                    'x-rate-limit': {'limit': 1, 'period': 60},
+                    'responses': {'200': {'description': 'test'}}
+                }
+            }
+        }
+
+        @classmethod
+        def get_test(cls, req, resp, **kwargs):
+            pass
+
+    return limited_model
+
+
+class TestRateLimit(object):
+
+    @pytest.fixture
+    def app(self, limited_model):
+        return SwaggerAPI({limited_model}, sqlalchemy_bind=mock.MagicMock(), title='Test API')
+
+    def test_limits_by_authorized_identity(self, app, client):
+        assert client.get('/', headers={'Authorization': '1'}).status_code == 200
+
+        resp = client.get('/', headers={'Authorization': '2'})
+        assert resp.status_code == 429
+        assert resp.headers.get('Retry-After') == '60'
+        assert resp.body == json.dumps({'error': 'Too many requests'})
+
+        assert client.get('/', headers={'Authorization': '3'}).status_code == 200
+
+    def test_unauthorized_requests_are_not_counted(self, app, client):
+        assert client.get('/', headers={'Authorization': '4'}).status_code == 401
+        assert client.get('/', headers={'Authorization': '1'}).status_code == 200
+
+
+class TestSharedCachingAuthorizer(object):
+
+    @pytest.fixture
+    def redis_bind(self):
+        redis_bind = FakeStrictRedis()
+        redis_bind.flushall()
+        return redis_bind
+
+    @pytest.fixture
+    def workers(self, redis_bind):
+        authorizer = mock.MagicMock(realm='test')
+        authorizer.authorize.return_value = 'account'
+        workers = [SharedCachingAuthorizer(
+                       authorizer, InvalidationChannel(redis_bind, poll_timeout=0.01))
+                   for _ in range(2)]
+        yield workers
+        [worker.channel.close() for worker in workers]
+
+    @pytest.fixture
+    def session(self, redis_bind):
+        return mock.MagicMock(redis_bind=redis_bind, user=None)
+
+    def test_result_is_shared_between_workers(self, workers, session):
+        assert workers[0].authorize(session, 'token', '/', '/', 'GET') == 'account'
+        assert workers[1].authorize(session, 'token', '/', '/', 'GET') == 'account'
+        assert workers[0].authorizer.authorize.call_count == 1
+
+    def test_result_with_user_is_authorized_again_by_other_worker(
+            self, workers, redis_bind):
+        user = mock.MagicMock()
+
+        def authorize(session, *args):
+            session.user = user
+            return 'account'
+
+        workers[0].authorizer.authorize.side_effect = authorize
+        workers[0].authorize(mock.MagicMock(redis_bind=redis_bind, user=None),
+                             'token', '/', '/', 'GET')
+        session = mock.MagicMock(redis_bind=redis_bind, user=None)
+
+        assert workers[1].authorize(session, 'token', '/', '/', 'GET') == 'account'
+        assert session.user is user
+        assert workers[0].authorizer.authorize.call_count == 2
+
+    def test_invalidate_evicts_every_worker(self, workers, session):
+        for worker in workers:
+            worker.authorize(session, 'token', '/', '/', 'GET')
+
+        workers[0].invalidate('token')
+
+        for _ in range(100):
+            if not len(workers[1].cache):
+                break
+            sleep(0.01)
+
+        assert len(workers[1].cache) == 0
+        workers[1].authorize(session, 'token', '/', '/', 'GET')
+        assert workers[0].authorizer.authorize.call_count == 2
+
+    def test_invalidate_all(self, workers, session, redis_bind):
+        workers[0].authorize(session, 'token1', '/', '/', 'GET')
+        workers[0].authorize(session, 'token2', '/', '/', 'GET')
+        workers[0].invalidate()
+
+        assert redis_bind.keys('falconopenapi_authorization:*') == []
+        assert len(workers[0].cache) == 0
+
+    def test_per_resource_results_are_shared_by_path(self, redis_bind, session):
+        authorizer = mock.MagicMock(realm='test')
+        authorizer.authorize.return_value = 'account'
+        worker = SharedCachingAuthorizer(
+            authorizer, InvalidationChannel(redis_bind, poll_timeout=0.01), per_resource=True)
+        try:
+            worker.authorize(session, 'token', '/{id}', '/1', 'GET')
+            worker.authorize(session, 'token', '/{id}', '/2', 'GET')
+        finally:
+            worker.channel.close()
+
+        [key] = redis_bind.keys('falconopenapi_authorization:*')
+        assert sorted(redis_bind.hkeys(key)) == [b'GET /{id} /1', b'GET /{id} /2']
+        assert authorizer.authorize.call_count == 2
+
+    def test_async_authorization_uses_redis_off_the_event_loop(self, redis_bind):
+        class MyAuth(Authorizer):
+            async def authorize(self, session, authorization, uri_template, path, method):
+                return 'account'
+
+        threads = []
+        spy = mock.MagicMock(wraps=redis_bind)
+        spy.hget.side_effect = lambda *args: threads.append(threading.get_ident())
+        spy.pipeline.side_effect = \
+            lambda **kwargs: threads.append(threading.get_ident()) or mock.MagicMock()
+        worker = SharedCachingAuthorizer(
+            MyAuth('test'), InvalidationChannel(redis_bind, poll_timeout=0.01))
+        session = mock.MagicMock(redis_bind=spy, user=None)
+
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(
+                worker.authorize(session, 'token', '/', '/', 'GET')) == 'account'
+        finally:
+            loop.close()
+            worker.channel.close()
+
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+
+
+@pytest.fixture
+def hooked_model(model_base):
+    calls = []
+
+    def hook(name, result=None):
+        def call_hook(req, resp, cls, params):
+            calls.append((name, cls.__name__, params))
+            return result
+
+        return call_hook
+
+    @before_operation(hook('class_before1'))
+    @before_operation(hook('class_before2'))
+    @after_operation(hook('class_after'))
+    class hooked_model(model_base):
+        __tablename__ = 'hooked_model'
+        id = sa.Column(sa.Integer, primary_key=True)
+        __schema__ = {
+            '/hooked/{id}': {
+                'parameters': [{
+                    'name': 'id',
+                    'in': 'path',
+                    'required': True,
+                    'type': 'integer'
+                }],
+                'get': {
+                    'operationId': 'get_test',
+                    'responses': {'200': {'description': 'test'}}
+                },
+                'delete': {
+                    'operationId': 'delete_test',
+                    'responses': {'204': {'description': 'test'}}
+                }
+            }
+        }
+
+        @before_operation(hook('method_before'))
+        @after_operation(hook('method_after'))
+        @classmethod
+        def get_test(cls, req, resp, **kwargs):
+            calls.append(('operation', cls.__name__, {}))
+
+        @before_operation(hook('skip', SKIP_OPERATION))
+        @classmethod
+        def delete_test(cls, req, resp, **kwargs):
+            calls.append(('operation', cls.__name__, {}))
+
+    hooked_model.calls = calls
+    return hooked_model
+
+
+class TestOperationHooks(object):
+
+    @pytest.fixture
+    def app(self, hooked_model):
+        return SwaggerAPI({hooked_model}, sqlalchemy_bind=mock.MagicMock(), title='Test API')
+
+    def test_hooks_order(self, app, hooked_model, client):
+        assert client.get('/hooked/1').status_code == 200
+        assert hooked_model.calls == [
+            ('class_before1', 'hooked_model', {'id': '1'}),
+            ('class_before2', 'hooked_model', {'id': '1'}),
+            ('method_before', 'hooked_model', {'id': '1'}),
+            ('operation', 'hooked_model', {}),
+            ('method_after', 'hooked_model', {'id': '1'}),
+            ('class_after', 'hooked_model', {'id': '1'})
+        ]
+
+    def test_skip_operation(self, app, hooked_model, client):
+        client.delete('/hooked/1')
+
+        assert [call[0] for call in hooked_model.calls] == [
+            'class_before1', 'class_before2', 'skip', 'class_after']
+
+    def test_options_route_has_no_model_hooks(self, app, hooked_model, client):
+        assert client.options('/hooked/1').status_code == 200
+        assert hooked_model.calls == []
+
+    def test_hooks_stats(self, app, hooked_model, client):
+        client.get('/hooked/1')
+        route = [route for route in hooked_model.__routes__ if route.method_name == 'GET'][0]
+        stats = route.get_hooks_stats()
+
+        assert [(stat['stage'], stat['calls']) for stat in stats] == [
+            ('before', 1), ('before', 1), ('before', 1), ('after', 1), ('after', 1)]
+        assert all(stat['seconds'] >= 0 for stat in stats)
@@ -0,0 +1,71 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.pubsub import InvalidationChannel
+from fakeredis import FakeStrictRedis
+from threading import Event
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def redis_bind():
+    redis_bind = FakeStrictRedis()
+    redis_bind.flushall()
+    return redis_bind
+
+
+@pytest.fixture
+def channel(redis_bind):
+    channel = InvalidationChannel(redis_bind, poll_timeout=0.01)
+    yield channel
+    channel.close()
+
+
+class TestInvalidationChannel(object):
+
+    def test_publish_calls_topic_callbacks(self, channel):
+        received = Event()
+        callback = mock.MagicMock(side_effect=lambda key: received.set())
+        other_callback = mock.MagicMock()
+        channel.subscribe('topic', callback)
+        channel.subscribe('other', other_callback)
+        channel.publish('topic', 'key')
+
+        assert received.wait(1)
+        assert callback.call_args_list == [mock.call('key')]
+        assert not other_callback.called
+
+    def test_reconnection_invalidates_all_topics(self, channel, redis_bind):
+        received = Event()
+        callback = mock.MagicMock(side_effect=lambda key: received.set())
+        pubsub = mock.MagicMock()
+        pubsub.get_message.side_effect = ConnectionError
+        channel.retry_interval = 0.01
+
+        with mock.patch.object(channel, '_subscribe', side_effect=[pubsub, redis_bind.pubsub()]):
+            channel.subscribe('topic', callback)
+            assert received.wait(1)
+
+        assert callback.call_args_list[0] == mock.call(None)
@@ -0,0 +1,178 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from falconopenapi.models.orm.replicas import RoundRobinReplicas, LeastLatencyReplicas
+from falconopenapi.models.orm.session import Session
+from falconopenapi.middlewares import SessionMiddleware
+from unittest import mock
+from fakeredis import FakeStrictRedis
+
+import msgpack
+import pytest
+import sqlalchemy as sa
+
+
+@pytest.fixture
+def model(model_base):
+    class model_(model_base):
+        __tablename__ = 'test'
+        id = sa.Column(sa.Integer, primary_key=True)
+        origin = sa.Column(sa.String(255))
+
+    return model_
+
+
+def build_bind(model, tmpdir, origin):
+    bind = sa.create_engine('sqlite:///{}'.format(tmpdir.join(origin + '.db')))
+    model.metadata.create_all(bind)
+    bind.execute(model.__table__.insert(), id=1, origin=origin)
+    return bind
+
+
+@pytest.fixture
+def primary(model, tmpdir):
+    return build_bind(model, tmpdir, 'primary')
+
+
+@pytest.fixture
+def replicas_binds(model, tmpdir):
+    return [build_bind(model, tmpdir, 'replica1'), build_bind(model, tmpdir, 'replica2')]
+
+
+@pytest.fixture
+def session(primary, replicas_binds, request):
+    session = Session(bind=primary, replicas=RoundRobinReplicas(replicas_binds))
+    session.use_replicas = True
+    request.addfinalizer(session.close)
+    return session
+
+
+def get_origin(model, session, id_=1):
+    insts = model.get(session, {'id': id_}, todict=False)
+    return insts[0].origin if insts else None
+
+
+class TestSessionReplicas(object):
+
+    def test_reads_go_to_a_replica(self, model, session):
+        assert get_origin(model, session) == 'replica1'
+        assert get_origin(model, session) == 'replica1'
+
+    def test_replicas_are_chosen_round_robin(self, model, session):
+        origins = []
+        for _ in range(3):
+            origins.append(get_origin(model, session))
+            session.close()
+            session.use_replicas = True
+
+        assert origins == ['replica1', 'replica2', 'replica1']
+
+    def test_reads_go_to_the_primary_without_use_replicas(self, model, session):
+        session.use_replicas = False
+
+        assert get_origin(model, session) == 'primary'
+
+    def test_reads_after_a_write_go_to_the_primary(self, model, session):
+        model.insert(session, {'id': 2, 'origin': 'primary'})
+
+        assert get_origin(model, session, 2) == 'primary'
+        assert get_origin(model, session) == 'primary'
+
+    def test_reads_after_a_pending_write_go_to_the_primary(self, model, session):
+        session.add(model(session, id=2, origin='primary'))
+
+        assert get_origin(model, session, 2) == 'primary'
+
+    def test_other_statements_go_to_the_primary(self, model, session):
+        session.execute(sa.text('SELECT 1'))
+
+        assert get_origin(model, session) == 'primary'
+
+    def test_close_unpins_the_primary(self, model, session):
+        model.insert(session, {'id': 2, 'origin': 'primary'})
+        session.close()
+        session.use_replicas = True
+
+        assert get_origin(model, session) == 'replica1'
+
+    def test_redis_cache_fills_are_read_from_the_primary(self, model, session):
+        session.redis_bind = FakeStrictRedis()
+        session.redis_bind.flushall()
+
+        assert model.get(session, {'id': 1}) == [{'id': 1, 'origin': 'primary'}]
+        assert msgpack.loads(session.redis_bind.hget('test', b'1'), encoding='utf-8') == \
+            {'id': 1, 'origin': 'primary'}
+        assert get_origin(model, session) == 'replica1'
+
+    def test_redis_cache_fills_without_use_primary(self, model, primary):
+        session = sa.orm.Session(bind=primary)
+        session.redis_bind = FakeStrictRedis()
+        session.redis_bind.flushall()
+
+        assert model.get(session, {'id': 1}) == [{'id': 1, 'origin': 'primary'}]
+        session.close()
+
+
+class TestLeastLatencyReplicas(object):
+
+    def test_chooses_the_replicas_without_latency_first(self, replicas_binds):
+        replicas = LeastLatencyReplicas(replicas_binds)
+        replicas.latencies[replicas_binds[0]] = 0.1
+
+        assert replicas.choose() is replicas_binds[1]
+
+    def test_chooses_the_lowest_latency(self, model, replicas_binds):
+        replicas = LeastLatencyReplicas(replicas_binds)
+        replicas_binds[0].execute(model.__table__.select())
+        replicas_binds[1].execute(model.__table__.select())
+        replicas.latencies[replicas_binds[0]] += 1.0
+
+        assert replicas.choose() is replicas_binds[1]
+
+    def test_latency_moving_average(self, model, replicas_binds):
+        replicas = LeastLatencyReplicas(replicas_binds, alpha=0.5)
+        replicas.latencies[replicas_binds[0]] = 1.0
+        replicas_binds[0].execute(model.__table__.select())
+
+        assert 0.5 < replicas.latencies[replicas_binds[0]] < 0.6
+
+
+class TestSessionMiddlewareReplicas(object):
+
+    @pytest.mark.parametrize('method,origin', [
+        ('GET', 'replica1'), ('HEAD', 'replica1'), ('POST', 'primary'), ('DELETE', 'primary')])
+    def test_reads_by_method(self, model, primary, replicas_binds, method, origin):
+        middleware = SessionMiddleware(primary, replica_binds=replicas_binds)
+        req = mock.MagicMock(method=method, context=dict())
+        middleware.process_resource(req, None, model, {})
+
+        assert get_origin(model, req.context['session']) == origin
+        middleware.process_response(req, None, model)
+
+    def test_least_latency_strategy(self, model, primary, replicas_binds):
+        middleware = SessionMiddleware(
+            primary, replica_binds=replicas_binds, replica_strategy='least_latency')
+
+        assert isinstance(middleware.replicas, LeastLatencyReplicas)
+
+    def test_unknown_strategy(self, primary, replicas_binds):
+        with pytest.raises(ValueError):
+            SessionMiddleware(primary, replica_binds=replicas_binds, replica_strategy='random')
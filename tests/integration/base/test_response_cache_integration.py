@@ -0,0 +1,90 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.swagger_api import SwaggerAPI
+from falconopenapi.cache import ResponseCache
+from unittest import mock
+
+import pytest
+import json
+import sqlalchemy as sa
+
+
+@pytest.fixture
+def model(model_base):
+    class model(model_base):
+        __tablename__ = 'model'
+        __response_cache__ = ResponseCache()
+        id = sa.Column(sa.Integer, primary_key=True)
+        __schema__ = {
+            '/cached': {
+                'get': {
+                    'operationId': 'get_cached',
+                    'x-cache': {'ttl': 60},
+                    'responses': {'200': {'description': 'test'}}
+                }
+            }
+        }
+
+        calls = 0
+
+        @classmethod
+        def get_cached(cls, req, resp, **kwargs):
+            cls.calls += 1
+            resp.set_header('ETag', '"v1"')
+            resp.body = json.dumps({'calls': cls.calls})
+
+    return model
+
+
+@pytest.fixture
+def app(model):
+    return SwaggerAPI({model}, sqlalchemy_bind=mock.MagicMock(), title='Test API')
+
+
+class TestResponseCache(object):
+
+    def test_hit(self, app, model, client):
+        client.get('/cached')
+        resp = client.get('/cached')
+
+        assert resp.status_code == 200
+        assert resp.headers['X-Cache'] == 'HIT'
+        assert json.loads(resp.body) == {'calls': 1}
+
+    def test_hit_with_matching_etag(self, app, model, client):
+        client.get('/cached')
+        resp = client.get('/cached', headers={'If-None-Match': '"v1"'})
+
+        assert resp.status_code == 304
+        assert resp.headers['X-Cache'] == 'HIT'
+        assert resp.headers['ETag'] == '"v1"'
+        assert resp.body == ''
+        assert model.calls == 1
+
+    def test_hit_with_other_etag(self, app, model, client):
+        client.get('/cached')
+        resp = client.get('/cached', headers={'If-None-Match': '"v0"'})
+
+        assert resp.status_code == 200
+        assert json.loads(resp.body) == {'calls': 1}
@@ -21,11 +21,14 @@
 # SOFTWARE.
 
 
+from fakeredis import FakeStrictRedis
 from sqlalchemy.ext.declarative import declarative_base
 from unittest import mock
 
+from falconopenapi.cache import NearCache
 from falconopenapi.models.orm.session import Session
 from falconopenapi.models.orm.sqlalchemy_redis import ModelSQLAlchemyRedisFactory
+from falconopenapi.models.orm.write_behind import RedisWriteBehind
 
 import msgpack
 import pytest
@@ -37,10 +40,25 @@ def model_base():
     return ModelSQLAlchemyRedisFactory.make()
 
 
+class PipelineMock(object):
+    # queues the commands and runs them on the redis mock on execute
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.redis, name)(*args) for name, args in commands]
+
+
 @pytest.fixture
 def redis():
     r = mock.MagicMock()
     r.smembers = lambda x: {x.replace('_filters_names', '').encode()}
+    r.pipeline.side_effect = lambda transaction=True: PipelineMock(r)
     return r
 
 
@@ -97,6 +115,74 @@ class TestSessionCommitWithoutRedis(object):
         assert redis.hmdel.call_args_list == []
 
 
+class TestSessionCommitRedisRoundTrips(object):
+    def test_commit_uses_two_round_trips(self, session, model1, model2, redis):
+        session.add_all([model1(session, id=i) for i in range(1, 11)])
+        session.add_all([model2(session, id=i) for i in range(1, 11)])
+        session.commit()
+
+        assert session.redis_round_trips == 2
+        assert redis.pipeline.call_count == 2
+        assert len(redis.hmset.call_args_list) == 2
+
+    def test_commit_without_redis_objects(self, session, model1_no_redis, redis):
+        session.add(model1_no_redis(session, id=1))
+        session.commit()
+
+        assert session.redis_round_trips == 0
+        assert redis.pipeline.call_count == 0
+
+    def test_hmset_in_chunks(self, session, model1, redis):
+        session.redis_chunk_size = 2
+        session.add_all([model1(session, id=i) for i in range(1, 6)])
+        session.commit()
+
+        assert [len(call[0][1]) for call in redis.hmset.call_args_list] == [2, 2, 1]
+        assert session.redis_round_trips == 2
+
+    def test_hdel_in_chunks(self, session, model1, redis):
+        session.redis_chunk_size = 2
+        insts = [model1(session, id=i) for i in range(1, 4)]
+        session.add_all(insts)
+        session.commit()
+        [session.delete(inst) for inst in insts]
+        session.commit()
+
+        assert sorted(len(call[0]) - 1 for call in redis.hdel.call_args_list) == [1, 2]
+
+
+class TestSessionCommitWriteBehind(object):
+    def test_writes_are_applied_by_the_worker(self, session, model1, redis):
+        write_behind = session.redis_write_behind = RedisWriteBehind(redis)
+        m1 = model1(session, id=1)
+        session.add_all([m1, model1(session, id=2)])
+        session.commit()
+        write_behind.flush()
+        session.delete(m1)
+        session.commit()
+        write_behind.close()
+
+        assert redis.hmset.call_args_list == [mock.call('test1', {
+            b'1': msgpack.dumps({'id': 1}), b'2': msgpack.dumps({'id': 2})})]
+        assert redis.hdel.call_args_list == [mock.call('test1', b'1')]
+        assert session.redis_round_trips == 0
+
+    def test_old_key_is_deleted(self, session, model1, redis):
+        write_behind = session.redis_write_behind = RedisWriteBehind(redis)
+        m1 = model1(session, id=1)
+        session.add(m1)
+        session.commit()
+        m1.old_redis_key = m1.get_key()
+        m1.id = 2
+        session.mark_for_hmset(m1)
+        session.commit()
+        write_behind.close()
+
+        assert redis.hdel.call_args_list == [mock.call('test1', b'1')]
+        assert redis.hmset.call_args_list[-1] == \
+            mock.call('test1', {b'2': msgpack.dumps({'id': 2})})
+
+
 class TestSessionCommitRedisSet(object):
     def test_if_instance_is_seted_on_redis(self, session, model1, redis):
         session.add(model1(session, id=1))
@@ -405,3 +491,110 @@ class TestSessionCommitWithNestedRelatedModels(object):
 
         assert redis.hmset.call_args_list == [call2, call3] or \
             redis.hmset.call_args_list == [call3, call2]
+
+
+class TestSessionCommitRelatedTraversal(object):
+    def add_chains(self, session, model1_related, model2_related, model3_related, count):
+        m1s = [model1_related(session, id=i) for i in range(1, count + 1)]
+        for i, m1 in enumerate(m1s, 1):
+            m2 = model2_related(session, id=i)
+            m2.model1 = [m1]
+            m3 = model3_related(session, id=i)
+            m3.model2 = m2
+            session.add_all([m1, m2, m3])
+
+        session.commit()
+        return m1s
+
+    def get_hmset_models_keys(self, redis):
+        return {call[0][0] for call in redis.hmset.call_args_list}
+
+    def test_queries_by_level(self, session, model1_related, model2_related, model3_related, redis):
+        m1s = self.add_chains(session, model1_related, model2_related, model3_related, 10)
+        redis.hmset.reset_mock()
+        statements = []
+        sa.event.listen(
+            session.bind, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement))
+
+        for m1 in m1s:
+            m1.test = 'test'
+            session.mark_for_hmset(m1)
+        session.commit()
+
+        selects = [statement for statement in statements if statement.startswith('SELECT')]
+        assert len([s for s in selects if 'JOIN' in s]) == 2
+        assert self.get_hmset_models_keys(redis) == {'test1', 'test2', 'test3'}
+
+    def test_queries_in_batches(self, session, model1_related, model2_related, model3_related, redis):
+        m1s = self.add_chains(session, model1_related, model2_related, model3_related, 5)
+        session.related_batch_size = 2
+        statements = []
+        sa.event.listen(
+            session.bind, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(statement))
+
+        for m1 in m1s:
+            m1.test = 'test'
+            session.mark_for_hmset(m1)
+        session.commit()
+
+        assert len([s for s in statements if s.startswith('SELECT') and 'JOIN' in s]) == 6
+
+    def test_max_depth(self, session, model1_related, model2_related, model3_related, redis):
+        m1s = self.add_chains(session, model1_related, model2_related, model3_related, 2)
+        session.related_max_depth = 1
+        redis.hmset.reset_mock()
+
+        for m1 in m1s:
+            m1.test = 'test'
+            session.mark_for_hmset(m1)
+        session.commit()
+
+        assert self.get_hmset_models_keys(redis) == {'test1', 'test2'}
+
+
+@pytest.fixture
+def model1_near_cached(request, model_base, session):
+    class model_(model_base):
+        __tablename__ = 'test1'
+        __table_args__ = {'mysql_engine':'innodb'}
+        __near_cache__ = NearCache(ttl=60)
+        id = sa.Column(sa.Integer, primary_key=True)
+        test = sa.Column(sa.String(255))
+
+    model_base.metadata.create_all()
+    return model_
+
+
+class TestSessionCommitNearCache(object):
+    def test_hits_skip_redis(self, session, model1_near_cached):
+        redis = session.redis_bind = mock.MagicMock(wraps=FakeStrictRedis())
+        model1_near_cached.insert(session, [{'id': 1, 'test': 'test1'}])
+        redis.hmget.reset_mock()
+
+        assert model1_near_cached.get(session, {'id': 1}) == [{'id': 1, 'test': 'test1'}]
+        assert model1_near_cached.get(session, {'id': 1}) == [{'id': 1, 'test': 'test1'}]
+        assert [msgpack.loads(obj, encoding='utf-8')
+                for obj in model1_near_cached.get_packed(session, {'id': 1})] == \
+            [{'id': 1, 'test': 'test1'}]
+        assert redis.hmget.call_count == 1
+
+    def test_commit_invalidates_the_near_cache(self, session, model1_near_cached):
+        session.redis_bind = FakeStrictRedis()
+        inst = model1_near_cached.insert(session, [{'id': 1, 'test': 'test1'}], todict=False)[0]
+        model1_near_cached.get(session, {'id': 1})
+
+        inst.test = 'test2'
+        session.mark_for_hmset(inst)
+        session.commit()
+
+        assert model1_near_cached.get(session, {'id': 1}) == [{'id': 1, 'test': 'test2'}]
+
+    def test_delete_invalidates_the_near_cache(self, session, model1_near_cached):
+        session.redis_bind = FakeStrictRedis()
+        model1_near_cached.insert(session, [{'id': 1, 'test': 'test1'}])
+        model1_near_cached.get(session, {'id': 1})
+        model1_near_cached.delete(session, {'id': 1})
+
+        assert model1_near_cached.get(session, {'id': 1}) == []
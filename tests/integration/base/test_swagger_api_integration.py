@@ -246,3 +246,59 @@ class TestSwaggerAPIErrorHandlingPOST(object):
                 'message': 'Something unexpected happened'
             }
         }
+
+
+class TestSwaggerAPISwaggerJson(object):
+
+    def test_swagger_json_with_etag(self, client, model1):
+        resp = client.get('/swagger.json')
+
+        assert resp.status_code == 200
+        assert resp.headers['ETag'].endswith('-pretty"')
+        assert resp.headers['Cache-Control'] == 'no-cache'
+        assert '/model1/' in json.loads(resp.body)['paths']
+
+    def test_swagger_json_with_if_none_match(self, client, model1):
+        etag = client.get('/swagger.json').headers['ETag']
+        resp = client.get('/swagger.json', headers={'If-None-Match': etag})
+
+        assert resp.status_code == 304
+        assert resp.body == ''
+
+    def test_swagger_json_compact(self, client, model1):
+        resp = client.get('/swagger.json', query_string='compact=true')
+
+        assert resp.status_code == 200
+        assert resp.headers['ETag'].endswith('-compact"')
+        assert '\n' not in resp.body
+
+    def test_swagger_json_etag_changes_after_disassociate_model(self, app, client, model1):
+        etag = client.get('/swagger.json').headers['ETag']
+        app.disassociate_model(model1)
+        resp = client.get('/swagger.json', headers={'If-None-Match': etag})
+
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+        assert json.loads(resp.body)['paths'] == {}
+
+
+@pytest.fixture
+def client_with_metrics(model1, session):
+    app_ = SwaggerAPI([model1], session.bind, session.redis_bind,
+                      title='Test API', metrics=True)
+    return Client(app_)
+
+
+class TestSwaggerAPIMetrics(object):
+
+    def test_metrics_route(self, client_with_metrics, model1):
+        client_with_metrics.post('/model1/', body=json.dumps([{}]))
+        resp = client_with_metrics.get('/metrics')
+
+        assert resp.status_code == 200
+        assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        assert 'falconopenapi_requests_total{uri_template="/model1/",method="POST",' \
+            'status="201"} 1' in resp.body
+
+    def test_metrics_route_is_not_setted_by_default(self, client, model1):
+        assert client.get('/metrics').status_code == 404
@@ -32,7 +32,17 @@ import pymysql
 
 @pytest.fixture
 def redis():
-    return mock.MagicMock()
+    redis = mock.MagicMock()
+    pipeline = redis.pipeline.return_value
+
+    def execute():
+        # an empty filters names set for each SMEMBERS queued since the last execute
+        results = [set() for _ in pipeline.smembers.call_args_list]
+        pipeline.smembers.reset_mock()
+        return results
+
+    pipeline.execute.side_effect = execute
+    return redis
 
 
 @pytest.fixture
@@ -466,3 +466,80 @@ class TestModelBaseBuildsHeadersParameters(object):
         assert model.insert.call_args_list == [
             mock.call(req.context['session'], req.context['parameters']['body'], **kwargs_expected)
         ]
+
+
+class TestModelBaseReloadSchema(object):
+    def build_schema(self, query_type='string'):
+        return {
+            '/test': {
+                'get': {
+                    'responses': {'200': {'description': 'test'}},
+                    'operationId': 'get_by_body'
+                },
+                'post': {
+                    'responses': {'200': {'description': 'test'}},
+                    'operationId': 'post_by_body',
+                    'parameters': [{
+                        'name': 'test',
+                        'in': 'query',
+                        'type': query_type
+                    }]
+                }
+            }
+        }
+
+    def get_routes(self, model):
+        return {(route.uri_template, route.method_name): route for route in model.__routes__}
+
+    def test_reload_schema_rebuilds_only_changed_routes(self):
+        model = ModelRedisBaseMeta('TestModel', (ModelRedisBase,), {'__schema__': self.build_schema()})
+        old_routes = self.get_routes(model)
+
+        new_routes, removed_routes = model.reload_schema(self.build_schema('array'))
+        routes = self.get_routes(model)
+
+        assert routes[('/test', 'GET')] is old_routes[('/test', 'GET')]
+        assert routes[('/test', 'OPTIONS')] is old_routes[('/test', 'OPTIONS')]
+        assert routes[('/test', 'POST')] is not old_routes[('/test', 'POST')]
+        assert new_routes == {routes[('/test', 'POST')]}
+        assert removed_routes == {old_routes[('/test', 'POST')]}
+
+    def test_reload_schema_with_removed_operation(self):
+        model = ModelRedisBaseMeta('TestModel', (ModelRedisBase,), {'__schema__': self.build_schema()})
+        old_routes = self.get_routes(model)
+        schema = self.build_schema()
+        schema['/test'].pop('post')
+
+        new_routes, removed_routes = model.reload_schema(schema)
+
+        assert set(self.get_routes(model)) == {('/test', 'GET'), ('/test', 'OPTIONS')}
+        assert removed_routes == {old_routes[('/test', 'POST')], old_routes[('/test', 'OPTIONS')]}
+        assert [route.method_name for route in new_routes] == ['OPTIONS']
+
+    def test_prepare_reload_schema_does_not_change_the_model(self):
+        schema = self.build_schema()
+        model = ModelRedisBaseMeta('TestModel', (ModelRedisBase,), {'__schema__': schema})
+        old_routes = model.__routes__
+
+        attributes, new_routes, _ = model.prepare_reload_schema(self.build_schema('array'))
+
+        assert model.__schema__ is schema
+        assert model.__routes__ is old_routes
+        model.commit_reload_schema(attributes)
+        assert new_routes < model.__routes__
+
+    def test_reload_in_router_copy_does_not_change_the_served_router(self):
+        model = ModelRedisBaseMeta('TestModel', (ModelRedisBase,), {'__schema__': self.build_schema()})
+        router = ModelRouter()
+        router.add_model(model)
+        req = mock.MagicMock(path='/test', method='POST')
+        old_route, _ = router.get_route_and_params(req)
+        _, new_routes, _ = model.prepare_reload_schema(self.build_schema('array'))
+
+        router_copy = router.copy()
+        for route in new_routes:
+            router_copy.add_route(route, replace=True)
+
+        assert router.get_route_and_params(req)[0] is old_route
+        router.swap(router_copy)
+        assert router.get_route_and_params(req)[0] in new_routes
@@ -42,6 +42,31 @@ def model():
     return ModelRedisFactory.make('TestModel', 'test', ['id'], {})
 
 
+def set_existing_keys(session, keys):
+    pipeline = session.redis_bind.pipeline.return_value
+    fields = []
+    pipeline.hexists.side_effect = lambda key, field: fields.append(field)
+    pipeline.execute.side_effect = lambda: [fields.pop(0) in keys for _ in list(fields)]
+
+
+def set_update_script(session, hash_):
+    results = []
+
+    def update_script(keys, args, client):
+        applied = []
+        for key, value in zip(args[::2], args[1::2]):
+            applied.append(int(key in hash_))
+            if key in hash_ and value:
+                hash_[key] = value
+            elif key in hash_:
+                del hash_[key]
+        results.append(applied)
+
+    session.redis_bind.register_script.return_value.side_effect = update_script
+    session.redis_bind.pipeline.return_value.execute.side_effect = \
+        lambda: [results.pop(0) for _ in list(results)]
+
+
 class TestModelRedisMetaInsert(object):
 
     def test_without_objects(self, model):
@@ -77,12 +102,12 @@ class TestModelRedisMetaUpdateWithoutIDs(object):
 
     def test_without_objects_and_without_ids(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = []
+        set_existing_keys(session, [])
         assert model.update(session, []) == []
 
     def test_hmset_with_objects_and_without_ids(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode()]
+        set_existing_keys(session, ['1'.encode()])
         expected_map = {
             '1'.encode(): msgpack.dumps({'id': 1})
         }
@@ -92,14 +117,14 @@ class TestModelRedisMetaUpdateWithoutIDs(object):
 
     def test_hmset_with_objects_and_without_ids_and_with_invalid_keys(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['test']
+        set_existing_keys(session, ['test'])
 
         assert model.update(session, [{'id': 1}]) == []
         assert session.redis_bind.hmset.call_args_list == []
 
     def test_hmset_with_objects_and_without_ids_and_with_one_invalid_key(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['test', '1'.encode(), 'test2']
+        set_existing_keys(session, ['test', '1'.encode(), 'test2'])
         expected_map = {
             '1'.encode(): msgpack.dumps({'id': 1})
         }
@@ -109,7 +134,7 @@ class TestModelRedisMetaUpdateWithoutIDs(object):
 
     def test_hmset_with_objects_and_without_ids_with_set_map_len_greater_than_chunks(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['2'.encode(), '1'.encode()]
+        set_existing_keys(session, ['2'.encode(), '1'.encode()])
         model.CHUNKS = 1
         expected_map1 = {
             '1'.encode(): msgpack.dumps({'id': 1})
@@ -132,13 +157,13 @@ class TestModelRedisMetaUpdateWithIDs(object):
 
     def test_without_objects_and_with_ids(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['2', '1']
+        set_existing_keys(session, ['2', '1'])
         assert model.update(session, [], {'id': 1}) == []
         assert not session.redis_bind.hmset.called
 
     def test_with_objects_and_with_ids_and_with_one_id_different_than_objects(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode()]
+        set_existing_keys(session, ['1'.encode()])
         expected_map = {
             '1'.encode(): msgpack.dumps({'id': 1})
         }
@@ -147,7 +172,7 @@ class TestModelRedisMetaUpdateWithIDs(object):
 
     def test_with_objects_and_with_ids_and_with_one_obj_different_than_ids(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode()]
+        set_existing_keys(session, ['1'.encode()])
         expected_map = {
             '1'.encode(): msgpack.dumps({'id': 1})
         }
@@ -156,19 +181,19 @@ class TestModelRedisMetaUpdateWithIDs(object):
 
     def test_with_objects_and_with_ids_and_with_ids_different_than_objects(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode()]
+        set_existing_keys(session, ['1'.encode()])
         assert model.update(session, [{'id': 2}], {'id': 1}) == []
         assert not session.redis_bind.hmset.called
 
     def test_with_objects_and_with_ids_and_with_objs_different_than_ids(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['2'.encode()]
+        set_existing_keys(session, ['2'.encode()])
         assert model.update(session, [{'id': 2}], {'id': 1}) == []
         assert not session.redis_bind.hmset.called
 
     def test_hmset_with_objects_and_with_ids(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode()]
+        set_existing_keys(session, ['1'.encode()])
         expected_map = {
             '1'.encode(): msgpack.dumps({'id': 1})
         }
@@ -178,14 +203,14 @@ class TestModelRedisMetaUpdateWithIDs(object):
 
     def test_hmset_with_objects_and_with_ids_and_with_invalid_keys(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['test']
+        set_existing_keys(session, ['test'])
 
         assert model.update(session, [{'id': 1}], [{'id': 1}]) == []
         assert session.redis_bind.hmset.call_args_list == []
 
     def test_hmset_with_objects_and_with_ids_and_with_one_invalid_key(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['test', '1'.encode(), 'test2']
+        set_existing_keys(session, ['test', '1'.encode(), 'test2'])
         expected_map = {
             '1'.encode(): msgpack.dumps({'id': 1})
         }
@@ -195,7 +220,7 @@ class TestModelRedisMetaUpdateWithIDs(object):
 
     def test_hmset_with_objects_and_with_ids_len_greater_than_chunks(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['2'.encode(), '1'.encode()]
+        set_existing_keys(session, ['2'.encode(), '1'.encode()])
         model.CHUNKS = 1
         expected_map1 = {
             '1'.encode(): msgpack.dumps({'id': 1})
@@ -216,6 +241,68 @@ class TestModelRedisMetaUpdateWithIDs(object):
         ])
 
 
+class TestModelRedisMetaUpdateExistenceCheck(object):
+
+    def test_checks_only_the_submitted_keys(self, model):
+        session = mock.MagicMock()
+        set_existing_keys(session, [b'1'])
+        model.update(session, [{'id': 1}, {'id': 2}])
+
+        assert not session.redis_bind.hkeys.called
+        assert session.redis_bind.pipeline.return_value.hexists.call_args_list == [
+            mock.call('test', b'1'), mock.call('test', b'2')]
+
+    def test_delete_operation(self, model):
+        session = mock.MagicMock()
+        set_existing_keys(session, [b'1'])
+
+        assert model.update(session, [{'id': 1, '_operation': 'delete'}]) == \
+            [{'id': 1, '_operation': 'delete'}]
+        assert session.redis_bind.hdel.call_args_list == [mock.call('test', b'1')]
+
+
+class TestModelRedisMetaAtomicUpdate(object):
+
+    def test_sets_only_existing_keys(self, model):
+        session = mock.MagicMock()
+        hash_ = {b'1': msgpack.dumps({'id': 1})}
+        set_update_script(session, hash_)
+        model.ATOMIC_UPDATE = True
+
+        assert model.update(session, [{'id': 1, 'name': 'test'}, {'id': 2}]) == [
+            {'id': 1, 'name': 'test'}]
+        assert hash_ == {b'1': msgpack.dumps({'id': 1, 'name': 'test'})}
+        assert not session.redis_bind.hkeys.called
+        assert not session.redis_bind.hmset.called
+
+    def test_delete_operation(self, model):
+        session = mock.MagicMock()
+        hash_ = {b'1': msgpack.dumps({'id': 1}), b'2': msgpack.dumps({'id': 2})}
+        set_update_script(session, hash_)
+        model.ATOMIC_UPDATE = True
+
+        assert model.update(session, [{'id': 1, '_operation': 'delete'}]) == [
+            {'id': 1, '_operation': 'delete'}]
+        assert list(hash_) == [b'2']
+
+    def test_script_call_by_chunk(self, model):
+        session = mock.MagicMock()
+        set_update_script(session, {b'1': b'', b'2': b''})
+        model.ATOMIC_UPDATE = True
+        model.CHUNKS = 1
+
+        assert model.update(session, [{'id': 1}, {'id': 2}], [{'id': 1}, {'id': 2}]) == [
+            {'id': 1}, {'id': 2}]
+        assert session.redis_bind.register_script.return_value.call_count == 2
+
+    def test_without_objects(self, model):
+        session = mock.MagicMock()
+        model.ATOMIC_UPDATE = True
+
+        assert model.update(session, []) == []
+        assert not session.redis_bind.register_script.called
+
+
 class TestModelRedisMetaDelete(object):
 
     def test_without_ids(self, model):
@@ -238,25 +325,139 @@ class TestModelRedisMetaGetAll(object):
 
     def test_get_all_with_limit(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode(), '2'.encode()]
+        session.redis_bind.zrange.return_value = ['1'.encode()]
         model.get(session, limit=1)
 
+        assert session.redis_bind.zrange.call_args_list == [mock.call('test_index', 0, 0)]
         assert session.redis_bind.hmget.call_args_list == [mock.call('test', b'1')]
 
     def test_get_all_with_limit_and_offset(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode(), '2'.encode(), '3'.encode()]
+        session.redis_bind.zrange.return_value = ['2'.encode(), '3'.encode()]
         model.get(session, limit=2, offset=1)
 
+        assert session.redis_bind.zrange.call_args_list == [mock.call('test_index', 1, 2)]
         assert session.redis_bind.hmget.call_args_list == [mock.call('test', b'2', b'3')]
 
     def test_get_all_with_offset(self, model):
         session = mock.MagicMock()
-        session.redis_bind.hkeys.return_value = ['1'.encode(), '2'.encode(), '3'.encode()]
+        session.redis_bind.zrange.return_value = ['3'.encode()]
         model.get(session, offset=2)
 
+        assert session.redis_bind.zrange.call_args_list == [mock.call('test_index', 2, -1)]
         assert session.redis_bind.hmget.call_args_list == [mock.call('test', b'3')]
 
+    def test_get_all_with_limit_without_keys(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.zrange.return_value = []
+        pipeline = session.redis_bind.pipeline.return_value
+        pipeline.execute.return_value = [0, 0]
+
+        assert model.get(session, limit=1) == []
+        assert pipeline.zcard.call_args_list == [mock.call('test_index')]
+        assert pipeline.hlen.call_args_list == [mock.call('test')]
+        assert not session.redis_bind.hmget.called
+        assert not session.redis_bind.hkeys.called
+
+    def test_get_all_with_limit_rebuilds_missing_index(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.zrange.side_effect = [[], [b'1']]
+        session.redis_bind.hkeys.return_value = [b'1']
+        pipeline = session.redis_bind.pipeline.return_value
+        pipeline.execute.side_effect = [[0, 1], [0, 1]]
+        model.get(session, limit=1)
+
+        assert pipeline.execute_command.call_args_list == [
+            mock.call('ZADD', 'test_index', 0, b'1')]
+        assert session.redis_bind.zrange.call_count == 2
+        assert session.redis_bind.hmget.call_args_list == [mock.call('test', b'1')]
+
+
+class TestModelRedisMetaIndex(object):
+
+    def test_insert_adds_to_index(self, model):
+        session = mock.MagicMock()
+        model.insert(session, [{'id': 1}])
+
+        assert session.redis_bind.execute_command.call_args_list == [
+            mock.call('ZADD', 'test_index', 0, b'1')]
+
+    def test_delete_removes_from_index(self, model):
+        session = mock.MagicMock()
+        model.delete(session, [{'id': 1}, {'id': 2}])
+
+        assert session.redis_bind.zrem.call_args_list == [mock.call('test_index', b'1', b'2')]
+
+    def test_update_delete_operation_removes_from_index(self, model):
+        session = mock.MagicMock()
+        set_existing_keys(session, [b'1'])
+        model.update(session, [{'id': 1, '_operation': 'delete'}])
+
+        assert session.redis_bind.zrem.call_args_list == [mock.call('test_index', b'1')]
+
+    def test_rebuild_index(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.hkeys.return_value = [b'1', b'2']
+        pipeline = session.redis_bind.pipeline.return_value
+
+        assert model.rebuild_index(session) == 2
+        assert pipeline.delete.call_args_list == [mock.call('test_index')]
+        assert pipeline.execute_command.call_args_list == [
+            mock.call('ZADD', 'test_index', 0, b'1', 0, b'2')]
+
+
+class TestModelRedisMetaGetPage(object):
+
+    def test_first_page(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.zrangebylex.return_value = [b'1', b'2', b'3']
+        session.redis_bind.hmget.return_value = [msgpack.dumps({'id': 1}), msgpack.dumps({'id': 2})]
+        objs, cursor = model.get_page(session, limit=2)
+
+        assert objs == [{'id': 1}, {'id': 2}]
+        assert session.redis_bind.zrangebylex.call_args_list == [
+            mock.call('test_index', b'-', b'+', 0, 3)]
+        assert session.redis_bind.hmget.call_args_list == [mock.call('test', b'1', b'2')]
+
+        model.get_page(session, cursor, limit=2)
+        assert session.redis_bind.zrangebylex.call_args_list[1] == \
+            mock.call('test_index', b'(2', b'+', 0, 3)
+
+    def test_last_page(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.zrangebylex.return_value = [b'1']
+        session.redis_bind.hmget.return_value = [msgpack.dumps({'id': 1})]
+
+        assert model.get_page(session, limit=2) == ([{'id': 1}], None)
+
+    def test_first_page_rebuilds_missing_index(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.zrangebylex.side_effect = [[], [b'1']]
+        session.redis_bind.hkeys.return_value = [b'1']
+        session.redis_bind.hmget.return_value = [msgpack.dumps({'id': 1})]
+        session.redis_bind.pipeline.return_value.execute.side_effect = [[0, 1], [0, 1]]
+
+        assert model.get_page(session, limit=2) == ([{'id': 1}], None)
+
+    def test_invalid_cursor(self, model):
+        with pytest.raises(ModelBaseError):
+            model.get_page(mock.MagicMock(), 'a')
+
+    def test_cursor_out_of_the_alphabet(self, model):
+        with pytest.raises(ModelBaseError):
+            model.get_page(mock.MagicMock(), '!!!')
+
+    def test_cursor_not_encoded_back(self, model):
+        with pytest.raises(ModelBaseError):
+            model.get_page(mock.MagicMock(), 'MQ==!')
+
+    def test_zero_limit(self, model):
+        session = mock.MagicMock()
+        session.redis_bind.zrangebylex.return_value = [b'1', b'2']
+
+        assert model.get_page(session, limit=0) == ([], None)
+        assert not session.redis_bind.hmget.called
+
 
 class TestModelRedisMetaGetMany(object):
 
@@ -279,3 +480,50 @@ class TestModelRedisMetaGetMany(object):
         session = mock.MagicMock()
         model.get(session, [{'id': 1}, {'id': 2}, {'id': 3}], offset=2)
         assert session.redis_bind.hmget.call_args_list == [mock.call('test', b'3')]
+
+
+@pytest.fixture
+def get_req():
+    session = mock.MagicMock()
+    session.redis_bind.hmget.return_value = [msgpack.dumps({'id': 1})]
+    req = mock.MagicMock(context={
+        'session': session,
+        'parameters': {'body': None, 'path': {'id': 1}, 'headers': {}, 'query_string': {}}
+    })
+    req.get_header.return_value = None
+    return req
+
+
+class TestModelRedisMetaGetETag(object):
+
+    def test_get_by_uri_template_sets_etag(self, model, get_req):
+        resp = mock.MagicMock()
+        model.get_by_uri_template(get_req, resp)
+        etag = resp.set_header.call_args[0][1]
+
+        assert resp.set_header.call_args_list == [mock.call('ETag', etag)]
+        assert resp.body == '{"id": 1}'
+
+    def test_get_by_uri_template_with_if_none_match(self, model, get_req):
+        resp = mock.MagicMock()
+        model.get_by_uri_template(get_req, resp)
+        get_req.get_header.return_value = resp.set_header.call_args[0][1]
+        resp = mock.MagicMock()
+
+        with mock.patch('falconopenapi.models.orm.http.msgpack') as msgpack_:
+            model.get_by_uri_template(get_req, resp)
+
+        assert resp.status == '304 Not Modified'
+        assert not msgpack_.loads.called
+
+    def test_get_by_body_etag_changes_with_objects(self, model, get_req):
+        get_req.context['parameters']['body'] = [{'id': 1}]
+        resp = mock.MagicMock()
+        model.get_by_body(get_req, resp)
+        etag = resp.set_header.call_args[0][1]
+        get_req.context['session'].redis_bind.hmget.return_value = [msgpack.dumps({'id': 2})]
+        resp = mock.MagicMock()
+        model.get_by_body(get_req, resp)
+
+        assert resp.set_header.call_args[0][1] != etag
+        assert resp.body == '[{"id": 2}]'
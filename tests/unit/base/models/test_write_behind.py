@@ -0,0 +1,169 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from falconopenapi.models.orm.redis_base import ModelRedisBaseMeta
+from falconopenapi.models.orm.write_behind import RedisWriteBehind
+from threading import Event
+from unittest import mock
+
+import pytest
+
+
+class model(metaclass=ModelRedisBaseMeta):
+    __key__ = 'test'
+
+
+class PipelineMock(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.redis, name)(*args) for name, args in commands]
+
+
+@pytest.fixture
+def redis_bind():
+    redis = mock.MagicMock()
+    redis.smembers = lambda key: {b'test', b'filter'}
+    redis.pipeline.side_effect = lambda transaction=True: PipelineMock(redis)
+    return redis
+
+
+@pytest.fixture
+def write_behind(redis_bind):
+    write_behind = RedisWriteBehind(redis_bind)
+    yield write_behind
+    write_behind.close()
+
+
+def get_calls(redis_bind, name):
+    return sorted(getattr(redis_bind, name).call_args_list, key=str)
+
+
+class TestRedisWriteBehind(object):
+
+    def test_put_is_applied_by_the_worker(self, write_behind, redis_bind):
+        write_behind.put([(model, b'1', b'value1'), (model, b'2', None)])
+        write_behind.flush()
+
+        assert get_calls(redis_bind, 'hmset') == [
+            mock.call('test', {b'1': b'value1'}),
+            mock.call('test_filter', {b'1': b'value1'})]
+        assert get_calls(redis_bind, 'hdel') == [
+            mock.call('test', b'2'), mock.call('test_filter', b'2')]
+        assert write_behind.get_stats()['applied'] == 2
+
+    def test_coalesces_writes_to_the_same_key(self, write_behind, redis_bind):
+        applying = Event()
+        release = Event()
+        redis_bind.smembers = lambda key: applying.set() or release.wait() and {b'test'}
+
+        write_behind.put([(model, b'0', b'value0')])
+        applying.wait()
+        write_behind.put([(model, b'1', b'value1'), (model, b'1', None)])
+        write_behind.put([(model, b'1', b'value2')])
+        release.set()
+        write_behind.flush()
+
+        assert get_calls(redis_bind, 'hmset') == [
+            mock.call('test', {b'0': b'value0'}), mock.call('test', {b'1': b'value2'})]
+        assert redis_bind.hdel.call_args_list == []
+        assert write_behind.coalesced_count == 2
+
+    def test_put_blocks_when_full(self, redis_bind):
+        write_behind = RedisWriteBehind(redis_bind, maxsize=1)
+        write_behind.put([(model, str(i).encode(), b'value') for i in range(3)])
+        write_behind.close()
+
+        assert write_behind.blocked_count == 1
+        assert write_behind.applied_count == 3
+
+    def test_close_flushes_pending_writes(self, redis_bind):
+        write_behind = RedisWriteBehind(redis_bind)
+        write_behind.put([(model, b'1', b'value1')])
+        write_behind.close()
+
+        assert write_behind.get_stats()['pending'] == 0
+        assert write_behind.get_lag() == 0.0
+        assert redis_bind.hmset.call_count == 2
+
+    def test_put_after_close_is_applied_synchronously(self, write_behind, redis_bind):
+        write_behind.close()
+        write_behind.put([(model, b'1', b'value1')])
+
+        assert redis_bind.hmset.call_count == 2
+
+    def test_failed_batch_is_retried(self, redis_bind):
+        write_behind = RedisWriteBehind(redis_bind, retry_backoff=0)
+        redis_bind.hmset.side_effect = [Exception, Exception, None, None]
+
+        write_behind.put([(model, b'1', b'value1')])
+        write_behind.close()
+
+        assert write_behind.get_stats()['retries'] == 2
+        assert write_behind.applied_count == 1
+        assert write_behind.errors_count == 0
+
+    def test_keys_are_deleted_when_retries_fail(self, redis_bind):
+        write_behind = RedisWriteBehind(redis_bind, max_retries=2, retry_backoff=0)
+        redis_bind.hmset.side_effect = Exception
+        model.__near_cache__ = mock.MagicMock()
+
+        try:
+            write_behind.put([(model, b'1', b'value1'), (model, b'2', None)])
+            write_behind.close()
+        finally:
+            del model.__near_cache__
+
+        assert redis_bind.hmset.call_count == 3
+        assert get_calls(redis_bind, 'hdel') == [
+            mock.call('test', b'1', b'2'), mock.call('test_filter', b'1', b'2')]
+        assert write_behind.get_stats()['invalidated'] == 2
+        assert write_behind.applied_count == 0
+        assert write_behind.errors_count == 0
+
+    def test_errors_are_counted(self, redis_bind):
+        write_behind = RedisWriteBehind(redis_bind, retry_backoff=0)
+        redis_bind.pipeline.side_effect = Exception
+        model.__near_cache__ = mock.MagicMock()
+
+        try:
+            write_behind.put([(model, b'1', b'value1')])
+            write_behind.close()
+            assert model.__near_cache__.invalidate.call_args_list == [mock.call([b'1'])]
+        finally:
+            del model.__near_cache__
+
+        assert write_behind.errors_count == 1
+        assert write_behind.get_stats()['retries'] == 3
+
+    def test_lag_of_pending_writes(self, redis_bind):
+        write_behind = RedisWriteBehind(redis_bind)
+        write_behind._start = lambda: None
+        write_behind.put([(model, b'1', b'value1')])
+
+        assert write_behind.get_lag() > 0
+        assert write_behind.get_stats()['pending'] == 1
@@ -0,0 +1,177 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.admission import ConcurrencyLimiter, AdmissionController
+from falconopenapi.exceptions import ServiceUnavailableError
+from threading import Thread, Timer
+from unittest import mock
+
+import asyncio
+import pytest
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def route():
+    return mock.MagicMock(method_name='GET', uri_template='/test', extensions={})
+
+
+class TestConcurrencyLimiter(object):
+
+    def test_rejects_over_limit_without_queue(self):
+        limiter = ConcurrencyLimiter(1)
+
+        assert limiter.acquire()
+        assert not limiter.acquire()
+        assert limiter.get_stats() == {
+            'limit': 1, 'in_flight': 1, 'waiting': 0,
+            'accepted': 1, 'queued': 0, 'rejected': 1}
+
+    def test_queued_request_gets_released_slot(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, timeout=5.0)
+        limiter.acquire()
+        Timer(0.01, limiter.release).start()
+
+        assert limiter.acquire()
+        assert limiter.get_stats()['queued'] == 1
+
+    def test_queued_request_is_rejected_after_timeout(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, timeout=0.01)
+        limiter.acquire()
+
+        assert not limiter.acquire()
+        assert limiter.get_stats()['waiting'] == 0
+        assert limiter.get_stats()['rejected'] == 1
+
+    def test_rejects_when_queue_is_full(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, timeout=5.0)
+        limiter.acquire()
+        waiter = Thread(target=limiter.acquire)
+        waiter.start()
+        while not limiter.waiting:
+            pass
+
+        assert not limiter.acquire()
+
+        limiter.release()
+        waiter.join()
+        assert limiter.get_stats()['in_flight'] == 1
+
+    def test_async_queued_requests_wait_on_the_loop(self):
+        limiter = ConcurrencyLimiter(1, max_queue=2, timeout=5.0)
+
+        async def request():
+            assert await limiter.acquire_async()
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        async def requests():
+            await asyncio.gather(request(), request(), request())
+
+        run_async(requests())
+        assert limiter.get_stats() == {
+            'limit': 1, 'in_flight': 0, 'waiting': 0,
+            'accepted': 3, 'queued': 2, 'rejected': 0}
+
+    def test_async_queued_request_gets_slot_released_by_thread(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, timeout=5.0)
+        limiter.acquire()
+        Timer(0.01, limiter.release).start()
+
+        assert run_async(limiter.acquire_async())
+        assert limiter.get_stats()['queued'] == 1
+
+    def test_async_queued_request_is_rejected_after_timeout(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, timeout=0.01)
+        limiter.acquire()
+
+        assert not run_async(limiter.acquire_async())
+        assert limiter.get_stats()['waiting'] == 0
+        assert limiter.get_stats()['rejected'] == 1
+        assert not limiter._async_waiters
+
+
+class TestAdmissionController(object):
+
+    def test_admit_with_global_limit(self, route):
+        controller = AdmissionController(max_concurrency=1, retry_after=2)
+        limiters = controller.admit(route)
+
+        with pytest.raises(ServiceUnavailableError) as exc_info:
+            controller.admit(route)
+
+        assert exc_info.value.headers == {'Retry-After': '2'}
+        controller.release(limiters)
+        assert controller.admit(route)
+
+    def test_admit_with_route_extension(self, route):
+        route.extensions = {'x-max-concurrency': 1}
+        other_route = mock.MagicMock(method_name='GET', uri_template='/other', extensions={})
+        controller = AdmissionController()
+        controller.admit(route)
+
+        with pytest.raises(ServiceUnavailableError):
+            controller.admit(route)
+
+        assert controller.admit(other_route) == []
+        assert controller.get_stats()['GET /test']['rejected'] == 1
+
+    def test_routes_config_overrides_extension(self, route):
+        route.extensions = {'x-max-concurrency': 1}
+        controller = AdmissionController(routes_max_concurrency={'GET /test': 2})
+        controller.admit(route)
+
+        assert controller.admit(route)
+
+    def test_route_rejection_releases_global_limiter(self, route):
+        route.extensions = {'x-max-concurrency': 1}
+        controller = AdmissionController(max_concurrency=10)
+        controller.admit(route)
+
+        with pytest.raises(ServiceUnavailableError):
+            controller.admit(route)
+
+        assert controller.get_stats()['global']['in_flight'] == 1
+
+    def test_exempted_route(self, route):
+        controller = AdmissionController(max_concurrency=0)
+        controller.exempt(route)
+
+        assert controller.admit(route) == ()
+
+    def test_admit_async_with_global_limit(self, route):
+        controller = AdmissionController(max_concurrency=1)
+        limiters = run_async(controller.admit_async(route))
+
+        with pytest.raises(ServiceUnavailableError):
+            run_async(controller.admit_async(route))
+
+        controller.release(limiters)
+        assert run_async(controller.admit_async(route))
@@ -0,0 +1,209 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.cache import LRUCache, NearCache, ResponseCache
+from unittest import mock
+
+
+class TestLRUCache(object):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    @mock.patch('falconopenapi.cache.monotonic')
+    def test_expired_entry(self, monotonic):
+        monotonic.return_value = 0
+        cache = LRUCache()
+        cache.set('a', 1, ttl=10)
+        monotonic.return_value = 10
+
+        assert cache.get('a') is None
+        assert len(cache) == 0
+        assert (cache.hits, cache.misses) == (0, 1)
+
+    def test_discard_keys(self):
+        cache = LRUCache()
+        cache.set(('a', 1), 1)
+        cache.set(('a', 2), 2)
+        cache.set(('b', 1), 3)
+
+        assert cache.discard_keys(lambda key: key[0] == 'a') == 2
+        assert len(cache) == 1
+        assert cache.get(('b', 1)) == 3
+
+
+class TestNearCache(object):
+
+    def test_get_many(self):
+        cache = NearCache()
+        cache.set_many([(('model', b'1'), (b'packed', {'id': 1}))], cache.generation)
+
+        assert cache.get_many([('model', b'1'), ('model', b'2')]) == \
+            [(b'packed', {'id': 1}), None]
+
+    def test_invalidate_keys(self):
+        cache = NearCache()
+        cache.set_many([(('model', b'1'), 1), (('model_filter', b'1'), 1), (('model', b'2'), 2)],
+                       cache.generation)
+        cache.invalidate([b'1'])
+
+        assert cache.get_many([('model', b'1'), ('model_filter', b'1'), ('model', b'2')]) == \
+            [None, None, 2]
+
+    def test_invalidate_all(self):
+        cache = NearCache()
+        cache.set_many([(('model', b'1'), 1)], cache.generation)
+        cache.invalidate()
+
+        assert cache.get_many([('model', b'1')]) == [None]
+
+    def test_set_is_skipped_after_invalidation(self):
+        cache = NearCache()
+        generation = cache.generation
+        cache.invalidate([b'1'])
+        cache.set_many([(('model', b'1'), 1)], generation)
+
+        assert cache.get_many([('model', b'1')]) == [None]
+
+    def test_invalidations_through_the_channel(self):
+        channel = mock.MagicMock()
+        cache = NearCache(channel=channel)
+        cache.bind('model')
+        cache.get_many([])
+        cache.set_many([(('model', b'1'), 1), (('model', b'2'), 2)], cache.generation)
+        cache.invalidate([b'1'])
+
+        assert channel.subscribe.call_args_list == [mock.call('model', cache._on_invalidation)]
+        assert channel.publish.call_args_list == [mock.call('model', ['1'])]
+
+        cache._on_invalidation(['2'])
+        assert cache.get_many([('model', b'2')]) == [None]
+
+
+class TestResponseCache(object):
+
+    def test_invalidate_tag(self):
+        cache = ResponseCache()
+        cache.register_tag('model')
+        cache.set('model', 'key', ('200 OK', [], b'{}'), 60, 0)
+
+        assert cache.get('model', 'key') == ('200 OK', [], b'{}')
+
+        cache.invalidate('model')
+        assert cache.get('model', 'key') is None
+
+    def test_set_is_skipped_after_invalidation(self):
+        cache = ResponseCache()
+        cache.register_tag('model')
+        generation = cache.get_generation('model')
+        cache.invalidate('model')
+        cache.set('model', 'key', ('200 OK', [], b'{}'), 60, generation)
+
+        assert cache.get('model', 'key') is None
+
+    def build_redis_bind(self):
+        redis_values = {}
+        redis_bind = mock.MagicMock()
+        redis_bind.pipeline().hset.side_effect = \
+            lambda key, field, value: redis_values.setdefault(key, {}).__setitem__(field, value)
+        redis_bind.hget.side_effect = lambda key, field: redis_values.get(key, {}).get(field)
+        redis_bind.get.side_effect = redis_values.get
+
+        def incr(key):
+            redis_values[key] = redis_values.get(key, 0) + 1
+            return redis_values[key]
+
+        redis_bind.incr.side_effect = incr
+        return redis_bind
+
+    def test_redis_tier(self):
+        redis_bind = self.build_redis_bind()
+        response = ('200 OK', [('content-type', 'application/json')], b'{}')
+        ResponseCache().set('model', 'key', response, 60, 0, redis_bind)
+
+        assert ResponseCache().get('model', 'key', redis_bind) == response
+
+    def test_invalidate_increments_redis_generation_of_redis_tags(self):
+        redis_bind = self.build_redis_bind()
+        cache = ResponseCache()
+        cache.register_tag('model')
+        cache.register_tag('redis_model', redis=True)
+        cache.invalidate('model', redis_bind)
+        cache.invalidate('redis_model', redis_bind)
+
+        assert redis_bind.incr.call_args_list == [
+            mock.call('falconopenapi_response_cache:redis_model:generation')]
+        assert cache.get_generation('redis_model') == 1
+
+    def test_invalidation_by_other_process_with_redis_tier(self):
+        redis_bind = self.build_redis_bind()
+        response = ('200 OK', [], b'{}')
+        cache = ResponseCache()
+        other_cache = ResponseCache()
+        for cache_ in (cache, other_cache):
+            cache_.register_tag('model', redis=True)
+
+        cache.set('model', 'key', response, 60, 0, redis_bind)
+        assert cache.get('model', 'key', redis_bind) == response
+
+        other_cache.invalidate('model', redis_bind)
+        assert cache.get('model', 'key', redis_bind) is None
+        assert cache.get_generation('model') == 1
+
+    def test_set_of_other_process_generation_is_not_read(self):
+        redis_bind = self.build_redis_bind()
+        cache = ResponseCache()
+        other_cache = ResponseCache()
+        for cache_ in (cache, other_cache):
+            cache_.register_tag('model', redis=True)
+
+        generation = other_cache.get_generation('model')
+        cache.invalidate('model', redis_bind)
+        other_cache.set('model', 'key', ('200 OK', [], b'{}'), 60, generation, redis_bind)
+
+        assert cache.get('model', 'key', redis_bind) is None
+
+    def test_invalidation_channel(self):
+        channel = mock.MagicMock()
+        cache = ResponseCache(channel=channel)
+        cache.register_tag('model')
+        cache.set('model', 'key', ('200 OK', [], b'{}'), 60, 0)
+
+        assert cache.get('model', 'key') == ('200 OK', [], b'{}')
+        assert channel.subscribe.call_args_list == [
+            mock.call('falconopenapi_response_cache', cache._on_invalidation)]
+
+        cache._on_invalidation('model')
+        assert cache.get('model', 'key') is None
+
+        cache.invalidate('model')
+        assert channel.publish.call_args_list == [
+            mock.call('falconopenapi_response_cache', 'model')]
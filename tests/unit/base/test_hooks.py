@@ -0,0 +1,276 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.hooks import Authorizer, CachingAuthorizer, get_authorization_identity, \
+    async_authorization_hook
+from inspect import iscoroutinefunction
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import make_transient_to_detached
+from unittest import mock
+
+import asyncio
+import threading
+import pytest
+import sqlalchemy as sa
+
+
+@pytest.fixture
+def authorizer():
+    authorizer = mock.MagicMock(spec=Authorizer('test'))
+    authorizer.realm = 'test'
+    return authorizer
+
+
+@pytest.fixture
+def session():
+    return mock.MagicMock(user=None)
+
+
+class TestCachingAuthorizer(object):
+
+    def test_caches_valid_authorization(self, authorizer, session):
+        authorizer.authorize.return_value = 'account'
+        caching = CachingAuthorizer(authorizer)
+
+        assert caching.authorize(session, 'token', '/', '/', 'GET') == 'account'
+        assert caching.authorize(session, 'token', '/', '/', 'GET') == 'account'
+        assert authorizer.authorize.call_count == 1
+        assert caching.realm == 'test'
+
+    def test_key_has_uri_template_and_method(self, authorizer, session):
+        authorizer.authorize.return_value = True
+        caching = CachingAuthorizer(authorizer)
+        caching.authorize(session, 'token', '/', '/', 'GET')
+        caching.authorize(session, 'token', '/', '/', 'POST')
+        caching.authorize(session, 'token', '/{id}', '/1', 'GET')
+
+        assert authorizer.authorize.call_count == 3
+
+    def test_key_has_not_path(self, authorizer, session):
+        authorizer.authorize.return_value = True
+        caching = CachingAuthorizer(authorizer)
+        caching.authorize(session, 'token', '/{id}', '/1', 'GET')
+        caching.authorize(session, 'token', '/{id}', '/2', 'GET')
+
+        assert authorizer.authorize.call_count == 1
+
+    def test_per_resource_key_has_path(self, authorizer, session):
+        authorizer.authorize.side_effect = \
+            lambda session, token, uri, path, method: True if path == '/1' else None
+        caching = CachingAuthorizer(authorizer, per_resource=True)
+
+        assert caching.authorize(session, 'token', '/{id}', '/1', 'GET') is True
+        assert caching.authorize(session, 'token', '/{id}', '/2', 'GET') is None
+        assert caching.authorize(session, 'token', '/{id}', '/1', 'GET') is True
+        assert authorizer.authorize.call_count == 2
+
+    @mock.patch('falconopenapi.cache.monotonic')
+    def test_caches_invalid_authorization_with_negative_ttl(
+            self, monotonic, authorizer, session):
+        monotonic.return_value = 0
+        authorizer.authorize.return_value = None
+        caching = CachingAuthorizer(authorizer, ttl=60, negative_ttl=5)
+        caching.authorize(session, 'token', '/', '/', 'GET')
+        monotonic.return_value = 4
+        caching.authorize(session, 'token', '/', '/', 'GET')
+
+        assert authorizer.authorize.call_count == 1
+
+        monotonic.return_value = 5
+        assert caching.authorize(session, 'token', '/', '/', 'GET') is None
+        assert authorizer.authorize.call_count == 2
+
+    def test_refresh_result_drops_token_entries(self, authorizer, session):
+        authorizer.authorize.return_value = True
+        caching = CachingAuthorizer(authorizer)
+        caching.authorize(session, 'token', '/', '/', 'GET')
+        caching.authorize(session, 'other', '/', '/', 'GET')
+        authorizer.authorize.return_value = False
+
+        assert caching.authorize(session, 'token', '/', '/', 'POST') is False
+        assert caching.authorize(session, 'token', '/', '/', 'POST') is False
+        assert len(caching.cache) == 1
+
+    def test_invalidate_token(self, authorizer, session):
+        authorizer.authorize.return_value = True
+        caching = CachingAuthorizer(authorizer)
+        caching.authorize(session, 'token', '/', '/', 'GET')
+        caching.authorize(session, 'other', '/', '/', 'GET')
+        caching.invalidate('token')
+        caching.authorize(session, 'token', '/', '/', 'GET')
+        caching.authorize(session, 'other', '/', '/', 'GET')
+
+        assert authorizer.authorize.call_count == 3
+
+    def test_result_computed_during_invalidation_is_not_stored(self, authorizer, session):
+        caching = CachingAuthorizer(authorizer)
+
+        def authorize(*args):
+            caching.invalidate()
+            return True
+
+        authorizer.authorize.side_effect = authorize
+        caching.authorize(session, 'token', '/', '/', 'GET')
+
+        assert len(caching.cache) == 0
+
+    def test_restores_session_user_on_hit(self, authorizer):
+        user = mock.MagicMock()
+
+        def authorize(session, *args):
+            session.user = user
+            return True
+
+        authorizer.authorize.side_effect = authorize
+        caching = CachingAuthorizer(authorizer)
+        caching.authorize(mock.MagicMock(user=None), 'token', '/', '/', 'GET')
+        session = mock.MagicMock(user=None)
+        caching.authorize(session, 'token', '/', '/', 'GET')
+
+        assert session.user is user
+
+    @pytest.fixture
+    def orm(self):
+        class User(declarative_base()):
+            __tablename__ = 'user'
+            id = sa.Column(sa.Integer, primary_key=True)
+            name = sa.Column(sa.String(255))
+
+        bind = sa.create_engine('sqlite://')
+        User.metadata.create_all(bind)
+        statements = []
+        sa.event.listen(bind, 'before_cursor_execute',
+                        lambda conn, cursor, statement, *args: statements.append(statement))
+        user = User(id=1, name='user1')
+        make_transient_to_detached(user)
+        return User, bind, user, statements
+
+    def cache_user(self, authorizer, user):
+        def authorize(session, *args):
+            session.user = user
+            return True
+
+        authorizer.authorize.side_effect = authorize
+        caching = CachingAuthorizer(authorizer)
+        caching.authorize(mock.MagicMock(user=None), 'token', '/', '/', 'GET')
+        return caching
+
+    def test_merges_orm_session_user_on_hit(self, authorizer, orm):
+        User, bind, user, statements = orm
+        caching = self.cache_user(authorizer, user)
+        session = sa.orm.Session(bind=bind)
+        session.user = None
+        caching.authorize(session, 'token', '/', '/', 'GET')
+
+        assert session.user is not user
+        assert session.user in session
+        assert (session.user.id, session.user.name) == (1, 'user1')
+        assert statements == []
+
+    def test_loads_changed_orm_session_user_on_hit(self, authorizer, orm):
+        User, bind, user, statements = orm
+        caching = self.cache_user(authorizer, user)
+        user.name = 'changed'
+        session = sa.orm.Session(bind=bind)
+        session.user = None
+        caching.authorize(session, 'token', '/', '/', 'GET')
+
+        assert session.user is None
+        assert len(statements) == 1
+
+    def test_async_authorizer(self, session):
+        class MyAuth(Authorizer):
+            calls = 0
+
+            async def authorize(self, session, authorization, uri_template, path, method):
+                type(self).calls += 1
+                return True
+
+        caching = CachingAuthorizer(MyAuth('test'))
+        loop = asyncio.new_event_loop()
+        try:
+            for _ in range(2):
+                assert loop.run_until_complete(
+                    caching.authorize(session, 'token', '/', '/', 'GET')) is True
+        finally:
+            loop.close()
+
+        assert iscoroutinefunction(caching.authorize)
+        assert MyAuth.calls == 1
+
+
+class TestAsyncAuthorizationHook(object):
+
+    def run(self, authorizer, session):
+        req = mock.MagicMock(auth='token', context={'session': session})
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(async_authorization_hook(authorizer, req, None, {}))
+        finally:
+            loop.close()
+
+    def test_sync_authorizer_runs_off_the_event_loop(self, authorizer, session):
+        threads = []
+
+        def authorize(*args):
+            threads.append(threading.get_ident())
+            return True
+
+        authorizer.authorize.side_effect = authorize
+
+        assert self.run(authorizer, session) is True
+        assert threads != [threading.get_ident()]
+        assert authorizer.authorize.call_args_list == [
+            mock.call(session, 'token', mock.ANY, mock.ANY, mock.ANY)]
+
+    def test_async_authorizer(self, session):
+        class MyAuth(Authorizer):
+            async def authorize(self, session, authorization, uri_template, path, method):
+                return authorization == 'token'
+
+        assert self.run(MyAuth('test'), session) is True
+
+
+class TestAuthorizerGetIdentity(object):
+
+    @pytest.mark.parametrize('account_id', ['user1', 1])
+    def test_with_account_id(self, account_id):
+        assert Authorizer('test').get_identity(None, 'token', account_id) == str(account_id)
+
+    @pytest.mark.parametrize('authorization', [True, object(), {'id': 1}])
+    def test_without_account_id(self, authorization):
+        identity = Authorizer('test').get_identity(None, 'token', authorization)
+        assert identity == Authorizer('test').get_identity(None, 'token', True)
+        assert identity != Authorizer('test').get_identity(None, 'other', True)
+
+    def test_without_get_identity(self):
+        authorizer = mock.MagicMock(spec=['realm', 'authorize'])
+
+        assert get_authorization_identity(authorizer, None, 'token', 'user1') == 'user1'
+        assert get_authorization_identity(authorizer, None, 'token', True) == \
+            Authorizer('test').get_identity(None, 'token', True)
+
+    def test_caching_authorizer_without_get_identity(self):
+        authorizer = CachingAuthorizer(mock.MagicMock(spec=['realm', 'authorize']))
+
+        assert authorizer.get_identity(None, 'token', 'user1') == 'user1'
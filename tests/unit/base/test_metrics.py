@@ -0,0 +1,83 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.metrics import RouteMetrics
+from threading import Thread
+
+
+class TestRouteMetrics(object):
+
+    def test_record(self):
+        metrics = RouteMetrics(buckets=(0.1, 1.0))
+        metrics.record('/test', 'GET', '200', 0.05)
+        metrics.record('/test', 'GET', '200', 0.5)
+        metrics.record('/test', 'GET', '200', 5.0)
+
+        assert metrics.get_series() == {('/test', 'GET', '200'): [1, 1, 1, 5.55]}
+
+    def test_record_merges_threads(self):
+        metrics = RouteMetrics(buckets=(1.0,))
+        threads = [Thread(target=metrics.record, args=('/test', 'GET', '200', 0.5))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert metrics.get_series() == {('/test', 'GET', '200'): [4, 0, 2.0]}
+
+    def test_reset(self):
+        metrics = RouteMetrics()
+        metrics.record('/test', 'GET', '200', 0.5)
+        metrics.reset()
+
+        assert metrics.get_series() == {}
+
+    def test_get_prometheus_text(self):
+        metrics = RouteMetrics(buckets=(0.1, 1.0))
+        metrics.record('/test/{id}', 'GET', '200', 0.05)
+        metrics.record('/test/{id}', 'GET', '200', 0.5)
+
+        assert metrics.get_prometheus_text() == '\n'.join([
+            '# HELP falconopenapi_requests_total Total number of requests.',
+            '# TYPE falconopenapi_requests_total counter',
+            'falconopenapi_requests_total{uri_template="/test/{id}",method="GET",status="200"} 2',
+            '# HELP falconopenapi_request_duration_seconds Requests latency in seconds.',
+            '# TYPE falconopenapi_request_duration_seconds histogram',
+            'falconopenapi_request_duration_seconds_bucket{uri_template="/test/{id}",'
+            'method="GET",status="200",le="0.1"} 1',
+            'falconopenapi_request_duration_seconds_bucket{uri_template="/test/{id}",'
+            'method="GET",status="200",le="1.0"} 2',
+            'falconopenapi_request_duration_seconds_bucket{uri_template="/test/{id}",'
+            'method="GET",status="200",le="+Inf"} 2',
+            'falconopenapi_request_duration_seconds_sum{uri_template="/test/{id}",'
+            'method="GET",status="200"} 0.55',
+            'falconopenapi_request_duration_seconds_count{uri_template="/test/{id}",'
+            'method="GET",status="200"} 2'
+        ]) + '\n'
+
+    def test_get_prometheus_text_escapes_labels(self):
+        metrics = RouteMetrics()
+        metrics.record('/test/"\\', 'GET', '200', 0.5)
+
+        assert 'uri_template="/test/\\"\\\\"' in metrics.get_prometheus_text()
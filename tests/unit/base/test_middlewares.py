@@ -21,7 +21,9 @@
 # SOFTWARE.
 
 
-from falconopenapi.middlewares import SessionMiddleware
+from falconopenapi.middlewares import SessionMiddleware, MetricsMiddleware, TimingMiddleware, \
+    AdmissionMiddleware, RequestContext
+from falconopenapi.timing import RequestTimer
 from falconopenapi.models.orm.sqlalchemy_redis import ModelSQLAlchemyRedisFactory
 from unittest import mock
 
@@ -58,9 +60,22 @@ class TestFalconSQLAlchemyRedisMiddleware(object):
         sqlalchemy_middleware.process_resource(req, resp, resource, params)
 
         assert session.call_args_list == [
-            mock.call(bind=bind, redis_bind=redis_bind)]
+            mock.call(bind=bind, redis_bind=redis_bind, redis_write_behind=None,
+                      redis_chunk_size=500, related_batch_size=500, related_max_depth=None,
+                      replicas=None)]
         assert req.context['session'] == session.return_value
 
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_process_resource_with_session_options(self, session, bind, redis_bind):
+        middleware = SessionMiddleware(bind, redis_bind, redis_chunk_size=100,
+                                       related_batch_size=50, related_max_depth=2)
+        req = mock.MagicMock(method='GET', context=dict())
+        middleware.process_resource(req, None, ModelSQLAlchemyRedisBase, {})
+
+        assert session.call_args[1]['redis_chunk_size'] == 100
+        assert session.call_args[1]['related_batch_size'] == 50
+        assert session.call_args[1]['related_max_depth'] == 2
+
     def test_process_response(self, sqlalchemy_middleware):
         session = mock.MagicMock()
         req = mock.MagicMock(
@@ -81,3 +96,161 @@ class TestFalconSQLAlchemyRedisMiddleware(object):
 
         sqlalchemy_middleware.process_response(req, resp, resource)
         assert 'session' not in req.context
+
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_process_resource_with_lazy_session(self, session, sqlalchemy_middleware):
+        req = mock.MagicMock(context=RequestContext())
+        sqlalchemy_middleware.process_resource(req, None, ModelSQLAlchemyRedisBase, {})
+
+        assert 'session' in req.context
+        assert not session.called
+        assert req.context['session'] is session.return_value
+        assert req.context.get('session') is session.return_value
+        assert session.call_count == 1
+
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_process_response_without_session_access(self, session, sqlalchemy_middleware):
+        req = mock.MagicMock(context=RequestContext())
+        sqlalchemy_middleware.process_resource(req, None, ModelSQLAlchemyRedisBase, {})
+        sqlalchemy_middleware.process_response(req, None, ModelSQLAlchemyRedisBase)
+
+        assert not session.called
+
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_process_resource_with_route_without_session(self, session, sqlalchemy_middleware):
+        route = mock.MagicMock(needs_session=False)
+        req = mock.MagicMock(context=RequestContext(route=route))
+        sqlalchemy_middleware.process_resource(req, None, ModelSQLAlchemyRedisBase, {})
+
+        assert req.context.get('session') is None
+        assert not session.called
+
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_session_is_reused_by_the_next_request(self, session, sqlalchemy_middleware):
+        session.side_effect = lambda **kwargs: mock.MagicMock()
+        sessions = []
+        for _ in range(2):
+            req = mock.MagicMock(context=dict())
+            sqlalchemy_middleware.process_resource(req, None, ModelSQLAlchemyRedisBase, {})
+            sessions.append(req.context['session'])
+            sqlalchemy_middleware.process_response(req, None, ModelSQLAlchemyRedisBase)
+
+        assert sessions[0] is sessions[1]
+        assert sessions[0].close.call_count == 2
+        assert sqlalchemy_middleware.created_count == 1
+
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_concurrent_requests_get_different_sessions(self, session, sqlalchemy_middleware):
+        session.side_effect = lambda **kwargs: mock.MagicMock()
+        reqs = [mock.MagicMock(context=dict()) for _ in range(3)]
+        for req in reqs:
+            sqlalchemy_middleware.process_resource(req, None, ModelSQLAlchemyRedisBase, {})
+
+        sessions = [req.context['session'] for req in reqs]
+        for req in reqs:
+            sqlalchemy_middleware.process_response(req, None, ModelSQLAlchemyRedisBase)
+
+        assert len(set(map(id, sessions))) == 3
+        assert sqlalchemy_middleware._local.sessions == [sessions[0]]
+
+
+class TestRequestContext(object):
+
+    def test_lazy_entry_is_built_once(self):
+        factory = mock.MagicMock(return_value='value')
+        context = RequestContext()
+        context.set_lazy('key', factory)
+
+        assert context['key'] == 'value'
+        assert context['key'] == 'value'
+        assert factory.call_count == 1
+
+    def test_missing_key(self):
+        context = RequestContext(key='value')
+
+        assert context.get('other', 'default') == 'default'
+        assert 'other' not in context
+        with pytest.raises(KeyError):
+            context['other']
+
+
+class TestMetricsMiddleware(object):
+
+    def test_process_response_records_route(self):
+        metrics = mock.MagicMock()
+        middleware = MetricsMiddleware(metrics)
+        req = mock.MagicMock(method='GET', uri_template='/test/{id}', context=dict())
+        resp = mock.MagicMock(status='200 OK')
+
+        middleware.process_request(req, resp)
+        middleware.process_response(req, resp, None, True)
+
+        assert metrics.record.call_args_list == [
+            mock.call('/test/{id}', 'GET', '200', mock.ANY)]
+        assert metrics.record.call_args[0][3] >= 0
+
+    def test_process_response_without_route(self):
+        metrics = mock.MagicMock()
+        middleware = MetricsMiddleware(metrics)
+        req = mock.MagicMock(method='GET', uri_template=None, context=dict())
+        resp = mock.MagicMock(status='404 Not Found')
+
+        middleware.process_request(req, resp)
+        middleware.process_response(req, resp, None, False)
+
+        assert metrics.record.call_args_list == [mock.call('', 'GET', '404', mock.ANY)]
+
+
+class TestTimingMiddleware(object):
+
+    def test_process_response_sets_server_timing(self):
+        middleware = TimingMiddleware()
+        req = mock.MagicMock(method='GET', uri_template='/test', context=dict())
+        resp = mock.MagicMock(status='200 OK')
+
+        middleware.process_request(req, resp)
+        with req.context['timer'].phase('operation'):
+            pass
+        middleware.process_response(req, resp, None, True)
+
+        header, value = resp.set_header.call_args[0]
+        assert header == 'Server-Timing'
+        assert value.startswith('operation;dur=')
+        assert ', total;dur=' in value
+
+    def test_process_request_not_sampled(self):
+        middleware = TimingMiddleware(sample_rate=0.0)
+        req = mock.MagicMock(method='GET', uri_template='/test', context=dict())
+        resp = mock.MagicMock(status='200 OK')
+
+        middleware.process_request(req, resp)
+        middleware.process_response(req, resp, None, True)
+
+        assert 'timer' not in req.context
+        assert not resp.set_header.called
+
+    @mock.patch('falconopenapi.middlewares.Session')
+    def test_session_middleware_sets_timer(self, session, sqlalchemy_middleware):
+        timer = RequestTimer()
+        req = mock.MagicMock(method='GET', uri_template='/test', context={'timer': timer})
+
+        sqlalchemy_middleware.process_resource(
+            req, mock.MagicMock(), ModelSQLAlchemyRedisBase, mock.MagicMock())
+
+        assert req.context['session'].timer is timer
+
+
+class TestAdmissionMiddleware(object):
+
+    def test_limiters_are_released_on_response(self):
+        controller = mock.MagicMock()
+        middleware = AdmissionMiddleware(controller)
+        route = mock.MagicMock()
+        req = mock.MagicMock(context={'route': route})
+
+        middleware.process_resource(req, mock.MagicMock(), None, {})
+        middleware.process_response(req, mock.MagicMock(), None, True)
+
+        assert controller.admit.call_args_list == [mock.call(route)]
+        assert controller.release.call_args_list == [mock.call(controller.admit.return_value)]
+        assert 'admission_limiters' not in req.context
@@ -0,0 +1,223 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi import OpenApiDefinition, LazyMapping
+from falconopenapi.exceptions import OpenApiError
+import pytest
+import json
+
+
+@pytest.fixture
+def definition_file(tmpdir):
+    definition = {
+        'openapi': '3.0.0',
+        'info': {'title': 'Test API', 'version': '1.0.0'},
+        'paths': {
+            '/pets': {
+                'get': {
+                    'operationId': 'pets.Pets',
+                    'tags': ['pets'],
+                    'responses': {'200': {'$ref': '#/components/responses/Pets'}}
+                }
+            },
+            '/users': {
+                'get': {
+                    'operationId': 'users.Users',
+                    'tags': ['users'],
+                    'responses': {'200': {'description': 'test'}}
+                }
+            }
+        },
+        'components': {
+            'responses': {
+                'Pets': {
+                    'description': 'test',
+                    'content': {'application/json': {
+                        'schema': {'$ref': '#/components/schemas/Pet'}}}
+                }
+            },
+            'schemas': {
+                'Pet': {'type': 'object'},
+                'PetAlias': {'$ref': '#/components/schemas/Pet'},
+                'User': {'type': 'object'}
+            }
+        }
+    }
+    filename = tmpdir.join('definition.json')
+    filename.write(json.dumps(definition))
+    return str(filename)
+
+
+class TestOpenApiDefinitionLazy(object):
+
+    def test_without_lazy(self, definition_file):
+        definition = OpenApiDefinition(definition_file)
+        assert isinstance(definition.paths, dict)
+        assert set(definition.paths) == {'/pets', '/users'}
+
+    def test_with_lazy(self, definition_file):
+        definition = OpenApiDefinition(definition_file, lazy=True)
+        assert isinstance(definition.paths, LazyMapping)
+        assert isinstance(definition.components, LazyMapping)
+        assert definition.paths._loaded == {}
+        assert definition.components._loaded == {}
+        assert set(definition.paths) == {'/pets', '/users'}
+        assert definition.components['schemas']['PetAlias'] == {'type': 'object'}
+
+
+class TestOpenApiDefinitionRestricted(object):
+
+    def test_with_tags(self, definition_file):
+        definition = OpenApiDefinition(definition_file, tags=['pets'])
+        assert set(definition.paths) == {'/pets'}
+        assert definition.components == {
+            'responses': {'Pets': definition.components['responses']['Pets']},
+            'schemas': {'Pet': {'type': 'object'}}
+        }
+
+    def test_with_paths(self, definition_file):
+        definition = OpenApiDefinition(definition_file, paths=['/users'])
+        assert set(definition.paths) == {'/users'}
+        assert definition.components == {}
+
+    def test_with_tags_and_lazy(self, definition_file):
+        definition = OpenApiDefinition(definition_file, lazy=True, tags=['users'])
+        assert set(definition.paths) == {'/users'}
+        assert 'schemas' not in definition.components
+
+
+class TestOpenApiDefinitionOperations(object):
+
+    def test_operations_index(self, definition_file):
+        definition = OpenApiDefinition(definition_file)
+        operation = definition.operations['pets.Pets']
+        assert list(definition.operations) == ['pets.Pets', 'users.Users']
+        assert operation.path == '/pets'
+        assert operation.method == 'GET'
+        assert operation.tags == ('pets',)
+        assert operation.parameters == []
+
+    def test_operations_index_merges_parameters(self, tmpdir):
+        path_param = {'name': 'id', 'in': 'path', 'required': True}
+        query_param = {'name': 'q', 'in': 'query'}
+        query_param_override = {'name': 'q', 'in': 'query', 'required': True}
+        definition = {
+            'openapi': '3.0.0',
+            'security': [{'basic': []}],
+            'paths': {
+                '/pets/{id}': {
+                    'parameters': [path_param, query_param],
+                    'get': {
+                        'operationId': 'pets.Pet',
+                        'parameters': [query_param_override],
+                        'responses': {}
+                    }
+                }
+            }
+        }
+        filename = tmpdir.join('definition.json')
+        filename.write(json.dumps(definition))
+
+        operation = OpenApiDefinition(str(filename)).operations['pets.Pet']
+        assert operation.parameters == [query_param_override, path_param]
+        assert operation.security == [{'basic': []}]
+
+    def test_operations_index_does_not_load_lazy_paths(self, definition_file):
+        definition = OpenApiDefinition(definition_file, lazy=True)
+        assert list(definition.operations) == ['pets.Pets', 'users.Users']
+        assert definition.paths._loaded == {}
+
+    def test_operations_index_with_path_item_reference(self, tmpdir):
+        definition = {
+            'openapi': '3.0.0',
+            'paths': {
+                '/a': {'$ref': '#/x-path-items/A'}
+            },
+            'x-path-items': {
+                'A': {'get': {'operationId': 'a.A', 'responses': {}}}
+            }
+        }
+        filename = tmpdir.join('definition.json')
+        filename.write(json.dumps(definition))
+
+        operation = OpenApiDefinition(str(filename)).operations['a.A']
+        assert operation.path == '/a'
+        assert operation.method == 'GET'
+
+    def test_path_item_reference_is_resolved_eager_and_lazy(self, tmpdir):
+        definition = {
+            'openapi': '3.0.0',
+            'paths': {
+                '/a': {'$ref': '#/x-path-items/A'}
+            },
+            'x-path-items': {
+                'A': {'get': {'operationId': 'a.A', 'responses': {}}}
+            }
+        }
+        filename = tmpdir.join('definition.json')
+        filename.write(json.dumps(definition))
+
+        eager = OpenApiDefinition(str(filename))
+        lazy = OpenApiDefinition(str(filename), lazy=True)
+
+        assert eager.paths['/a'] == lazy.paths['/a'] == definition['x-path-items']['A']
+
+    def test_operations_index_with_duplicated_operation_id(self, tmpdir):
+        definition = {
+            'openapi': '3.0.0',
+            'paths': {
+                '/pets': {'get': {'operationId': 'pets.Pets', 'responses': {}}},
+                '/pets2': {'get': {'operationId': 'pets.Pets', 'responses': {}}}
+            }
+        }
+        filename = tmpdir.join('definition.json')
+        filename.write(json.dumps(definition))
+
+        with pytest.raises(OpenApiError):
+            OpenApiDefinition(str(filename))
+
+
+class TestOpenApiDefinitionReload(object):
+
+    def test_reload_diff(self, definition_file):
+        definition = OpenApiDefinition(definition_file)
+        with open(definition_file) as file_:
+            new_definition = json.load(file_)
+
+        new_definition['paths'].pop('/users')
+        new_definition['paths']['/owners'] = {
+            'get': {'operationId': 'owners.Owners', 'responses': {}}}
+        new_definition['components']['schemas']['Pet'] = {'type': 'array'}
+        with open(definition_file, 'w') as file_:
+            json.dump(new_definition, file_)
+
+        diff = definition.reload()
+        assert diff.added == {('/owners', 'GET')}
+        assert diff.removed == {('/users', 'GET')}
+        assert diff.changed == {('/pets', 'GET')}
+        assert set(definition.operations) == {'pets.Pets', 'owners.Owners'}
+
+    def test_reload_without_changes(self, definition_file):
+        definition = OpenApiDefinition(definition_file, lazy=True)
+        diff = definition.reload()
+        assert diff == (set(), set(), set())
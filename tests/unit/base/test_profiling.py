@@ -0,0 +1,144 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.profiling import StartupProfiler, RequestProfiler
+from time import sleep
+import json
+import tracemalloc
+
+
+class TestStartupProfiler(object):
+
+    def test_disabled(self):
+        profiler = StartupProfiler()
+        with profiler.phase('set_routes', 'Model'):
+            pass
+
+        assert profiler.get_records() == []
+
+    def test_records_ranked_by_wall_time(self):
+        profiler = StartupProfiler(enabled=True)
+        with profiler.phase('model_init', 'Model'):
+            with profiler.phase('set_routes', 'Model'):
+                pass
+
+        records = profiler.get_records()
+        assert [(r['phase'], r['label'], r['calls']) for r in records] == [
+            ('model_init', 'Model', 1), ('set_routes', 'Model', 1)]
+
+    def test_records_temporary_allocations_peak(self):
+        profiler = StartupProfiler(enabled=True)
+        tracemalloc.start()
+        try:
+            with profiler.phase('model_init', 'Model'):
+                with profiler.phase('set_routes', 'Model'):
+                    temporary = bytearray(1024 * 1024)
+                    del temporary
+                with profiler.phase('set_hooks', 'Model'):
+                    pass
+        finally:
+            tracemalloc.stop()
+
+        records = {record['phase']: record for record in profiler.get_records()}
+        assert records['set_routes']['retained_bytes'] < 1024 * 1024
+        assert records['set_routes']['peak_bytes'] >= 1024 * 1024
+        assert records['model_init']['peak_bytes'] >= 1024 * 1024
+
+    def test_dump_json(self, tmpdir):
+        output = str(tmpdir.join('startup.json'))
+        profiler = StartupProfiler(enabled=True, output=output)
+        with profiler.phase('route_init', 'Model.get'):
+            pass
+
+        profiler.dump()
+        with open(output) as output_file:
+            assert json.load(output_file)[0]['label'] == 'Model.get'
+
+
+def _slow_operation(profiler):
+    capture = profiler.start()
+    sleep(0.05)
+    return capture
+
+
+class TestRequestProfiler(object):
+
+    def test_captures_selected_request(self):
+        profiler = RequestProfiler(rate=1, interval=0.001)
+        capture = _slow_operation(profiler)
+        profiler.stop(capture, '/test', 'GET', 'Model.get_test')
+        profiler.close()
+
+        profile, = profiler.get_profiles()
+        assert profile['operation'] == 'Model.get_test'
+        assert any(stack.endswith(':_slow_operation') for stack in profile['stacks'])
+
+    def test_keeps_concurrent_captures_of_one_thread(self):
+        profiler = RequestProfiler(rate=1, interval=0.001)
+        first = profiler.start()
+        second = profiler.start()
+        profiler.stop(first, '/first', 'GET', 'Model.first')
+        assert list(profiler._active.values()) == [second]
+        profiler.stop(second, '/second', 'GET', 'Model.second')
+        profiler.close()
+
+        assert first.thread_id == second.thread_id
+        assert [profile['operation'] for profile in profiler.get_profiles()] == [
+            'Model.first', 'Model.second']
+
+    def test_skips_not_selected_request(self):
+        profiler = RequestProfiler(rate=2)
+
+        assert profiler.start() is not None
+        assert profiler.start() is None
+
+    def test_keeps_only_slow_requests_with_threshold(self):
+        profiler = RequestProfiler(rate=0, threshold=0.01, interval=0.001)
+        fast_capture = profiler.start()
+        profiler.stop(fast_capture, '/fast', 'GET', 'Model.get_fast')
+        slow_capture = _slow_operation(profiler)
+        profiler.stop(slow_capture, '/slow', 'GET', 'Model.get_slow')
+        profiler.close()
+
+        assert [profile['uri_template'] for profile in profiler.get_profiles()] == ['/slow']
+
+    def test_ring_buffer_is_bounded(self):
+        profiler = RequestProfiler(rate=1, max_profiles=2)
+        for i in range(3):
+            profiler.stop(profiler.start(), '/test/{}'.format(i), 'GET', 'Model.get_test')
+        profiler.close()
+
+        assert [profile['uri_template'] for profile in profiler.get_profiles()] == \
+            ['/test/1', '/test/2']
+
+    def test_get_collapsed_stacks(self):
+        profiler = RequestProfiler()
+        profiler.profiles.append({
+            'uri_template': '/test', 'method': 'GET', 'operation': 'Model.get_test',
+            'stacks': {'a:f;b:g': 2}})
+        profiler.profiles.append({
+            'uri_template': '/test', 'method': 'GET', 'operation': 'Model.get_test',
+            'stacks': {'a:f;b:g': 1, 'a:f': 1}})
+
+        assert profiler.get_collapsed_stacks() == \
+            'GET /test;Model.get_test;a:f 1\nGET /test;Model.get_test;a:f;b:g 3\n'
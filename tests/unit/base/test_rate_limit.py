@@ -0,0 +1,129 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.rate_limit import LocalTokenBuckets, RateLimiter
+from falconopenapi.exceptions import TooManyRequestsError
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def route():
+    return mock.MagicMock(method_name='GET', uri_template='/test',
+                          extensions={'x-rate-limit': {'limit': 2, 'period': 10}})
+
+
+@pytest.fixture
+def redis_bind():
+    return mock.MagicMock()
+
+
+class TestLocalTokenBuckets(object):
+
+    def test_take_until_empty(self):
+        buckets = LocalTokenBuckets()
+
+        assert buckets.take('key', 1.0, 2, 100.0) == (True, 1.0, 0.0)
+        assert buckets.take('key', 1.0, 2, 100.0) == (True, 0.0, 0.0)
+        assert buckets.take('key', 1.0, 2, 100.0) == (False, 0.0, 1.0)
+
+    def test_refills_with_time(self):
+        buckets = LocalTokenBuckets()
+        buckets.take('key', 1.0, 1, 100.0)
+
+        assert buckets.take('key', 1.0, 1, 100.5)[0] is False
+        assert buckets.take('key', 1.0, 1, 101.5)[0] is True
+
+    def test_evicts_least_recently_used_key(self):
+        buckets = LocalTokenBuckets(max_keys=1)
+        buckets.take('key1', 1.0, 1, 100.0)
+        buckets.take('key2', 1.0, 1, 100.0)
+
+        assert buckets.take('key1', 1.0, 1, 100.0)[0] is True
+
+
+class TestRateLimiter(object):
+
+    def test_check_without_limit(self, route):
+        route.extensions = {}
+        limiter = RateLimiter()
+
+        assert limiter.check(route, 'user') is None
+
+    def test_check_with_local_buckets(self, route):
+        limiter = RateLimiter()
+
+        assert limiter.check(route, 'user') == 1
+        assert limiter.check(route, 'user') == 0
+        with pytest.raises(TooManyRequestsError) as exc_info:
+            limiter.check(route, 'user')
+
+        assert exc_info.value.headers == {'Retry-After': '5'}
+        assert limiter.check(route, 'other_user') == 1
+
+    def test_routes_config_overrides_extension(self, route):
+        limiter = RateLimiter({'GET /test': {'limit': 1}})
+
+        assert limiter.get_limit(route) == (1, 1, 1)
+
+    def test_check_with_redis(self, route, redis_bind):
+        script = redis_bind.register_script.return_value
+        script.return_value = [1, b'1', b'0']
+        limiter = RateLimiter(redis_timeout=10)
+
+        assert limiter.check(route, 'user', redis_bind) == 1
+        assert limiter.check(route, 'user', redis_bind) == 1
+        assert redis_bind.register_script.call_count == 1
+        assert script.call_args[1]['keys'] == ['falconopenapi_rate_limit:GET /test:user']
+        assert script.call_args[1]['args'][:2] == [0.2, 2]
+
+    def test_check_with_redis_rejection(self, route, redis_bind):
+        redis_bind.register_script.return_value.return_value = [0, b'0', b'1.5']
+        limiter = RateLimiter(redis_timeout=10)
+
+        with pytest.raises(TooManyRequestsError) as exc_info:
+            limiter.check(route, 'user', redis_bind)
+
+        assert exc_info.value.headers == {'Retry-After': '2'}
+        assert limiter.get_stats()['limited'] == 1
+
+    def test_falls_back_to_local_buckets_on_redis_error(self, route, redis_bind):
+        script = redis_bind.register_script.return_value
+        script.side_effect = ConnectionError
+        limiter = RateLimiter()
+
+        assert limiter.check(route, 'user', redis_bind) == 1
+        assert limiter.check(route, 'user', redis_bind) == 0
+        assert script.call_count == 1
+        assert limiter.get_stats() == {'limited': 0, 'fallbacks': 1, 'fallback': True}
+
+    def test_falls_back_to_local_buckets_on_slow_redis(self, route, redis_bind):
+        redis_bind.register_script.return_value.return_value = [1, b'1', b'0']
+        limiter = RateLimiter(redis_timeout=-1)
+
+        assert limiter.check(route, 'user', redis_bind) == 1
+        limiter.check(route, 'user', redis_bind)
+
+        assert redis_bind.register_script.return_value.call_count == 1
+        assert limiter.get_stats()['fallbacks'] == 1
@@ -0,0 +1,69 @@
+# MIT License
+
+# Copyright (c) 2016 Diogo Dutra
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from falconopenapi.timing import RequestTimer, NULL_TIMER
+from unittest import mock
+import pytest
+
+
+class TestRequestTimer(object):
+
+    @mock.patch('falconopenapi.timing.perf_counter')
+    def test_phases_are_accumulated(self, perf_counter):
+        perf_counter.side_effect = [0.0, 1.0, 1.5, 2.0, 2.25, 3.0, 3.5, 4.0]
+        timer = RequestTimer()
+
+        with timer.phase('routing'):
+            pass
+        with timer.phase('sql'):
+            pass
+        with timer.phase('sql'):
+            pass
+
+        assert list(timer.phases.items()) == [('routing', 0.5), ('sql', 0.75)]
+        assert timer.get_server_timing() == \
+            'routing;dur=500.000, sql;dur=750.000, total;dur=4000.000'
+
+    def test_phase_is_recorded_on_error(self):
+        timer = RequestTimer()
+
+        with pytest.raises(ValueError):
+            with timer.phase('operation'):
+                raise ValueError()
+
+        assert 'operation' in timer.phases
+
+    @mock.patch('falconopenapi.timing.perf_counter')
+    def test_counters_are_reported(self, perf_counter):
+        perf_counter.side_effect = [0.0, 1.0]
+        timer = RequestTimer()
+        timer.count('redis_round_trips')
+        timer.count('redis_round_trips')
+
+        assert timer.counters == {'redis_round_trips': 2}
+        assert timer.get_server_timing() == 'redis_round_trips;desc="2", total;dur=1000.000'
+
+    def test_null_timer(self):
+        NULL_TIMER.count('redis_round_trips')
+        with NULL_TIMER.phase('operation') as phase:
+            assert phase is not None